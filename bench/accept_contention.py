@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+"""
+accept_contention.py
+N ta haydovchi bitta buyurtmani bir vaqtda "qabul qilish"ni bosadi.
+Latency va to'g'rilikni (faqat bitta g'olib, faqat bitta komissiya yechilgan) tekshiradi.
+
+    DATABASE_URL=postgresql://localhost/cargobot python bench/accept_contention.py -n 200
+    python bench/accept_contention.py --mode legacy   # eski 4 ta statementli yo'l bilan solishtirish
+
+Hamma jadvallar alohida `bench_accept` sxemasida yaratiladi, asosiy ma'lumotlarga tegilmaydi.
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+
+import asyncpg
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import migrate  # noqa: E402
+import repo  # noqa: E402
+
+SCHEMA = "bench_accept"
+FEE = 10000
+BALANCE = 50000
+
+
+async def setup(pool, n: int, rounds: int):
+    async with pool.acquire() as conn:
+        await conn.execute(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE")
+        await conn.execute(f"CREATE SCHEMA {SCHEMA}")
+    await migrate.migrate(pool)
+    async with pool.acquire() as conn:
+        await conn.executemany(
+            "INSERT INTO drivers(driver_id, username, balance, status) VALUES($1,$2,$3,'active')",
+            [(i, f"@drv{i}", BALANCE) for i in range(1, n + 1)])
+        await conn.executemany(
+            "INSERT INTO orders(customer_id, from_address, to_address, status, commission) VALUES(1,'A','B','open',$1)",
+            [(FEE,) for _ in range(rounds)])
+
+
+async def accept_atomic(pool, driver_id: int, order_id: int) -> bool:
+    async with pool.acquire() as conn:
+        res = await repo.accept_order(conn, driver_id, order_id)
+    return res.outcome == repo.ACCEPTED
+
+
+async def accept_legacy(pool, driver_id: int, order_id: int) -> bool:
+    # bot.py dagi avvalgi ketma-ketlik: 2 ta acquire, 5 ta statement, tranzaksiyasiz
+    async with pool.acquire() as conn:
+        d = await conn.fetchrow("SELECT balance, phone, username, status FROM drivers WHERE driver_id=$1", driver_id)
+        order = await conn.fetchrow("SELECT * FROM orders WHERE id=$1", order_id)
+    if not d or d["status"] == "blocked" or not order or order["status"] != "open":
+        return False
+    fee = int(order["commission"] or 0)
+    if (d["balance"] or 0) < fee:
+        return False
+    async with pool.acquire() as conn:
+        row = await conn.fetchrow("SELECT status FROM orders WHERE id=$1", order_id)
+        if not row or row["status"] != "open":
+            return False
+        await conn.execute("UPDATE orders SET status='taken', driver_id=$1 WHERE id=$2 AND status='open'", driver_id, order_id)
+        await conn.execute("UPDATE drivers SET balance = balance - $1 WHERE driver_id=$2", fee, driver_id)
+    return True
+
+
+def pct(values, p):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    k = min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))
+    return values[k]
+
+
+async def run(args):
+    dsn = args.dsn or os.getenv("DATABASE_URL")
+    if not dsn:
+        raise SystemExit("DATABASE_URL yoki --dsn kerak")
+    if dsn.startswith("postgres://"):
+        dsn = dsn.replace("postgres://", "postgresql://", 1)
+    pool = await asyncpg.create_pool(dsn=dsn, min_size=args.pool, max_size=args.pool,
+                                     server_settings={"search_path": SCHEMA})
+    await setup(pool, args.n, args.rounds)
+    accept = accept_atomic if args.mode == "atomic" else accept_legacy
+
+    latencies = []
+    claimed = 0
+
+    async def one(driver_id, order_id):
+        t = time.perf_counter()
+        ok = await accept(pool, driver_id, order_id)
+        latencies.append((time.perf_counter() - t) * 1000)
+        return ok
+
+    started = time.perf_counter()
+    async with pool.acquire() as conn:
+        order_ids = [r["id"] for r in await conn.fetch("SELECT id FROM orders ORDER BY id")]
+    for order_id in order_ids:
+        results = await asyncio.gather(*(one(did, order_id) for did in range(1, args.n + 1)))
+        claimed += sum(results)
+    wall = time.perf_counter() - started
+
+    async with pool.acquire() as conn:
+        taken = await conn.fetchval("SELECT count(*) FROM orders WHERE status='taken'")
+        debited = await conn.fetchval("SELECT COALESCE(sum($1::numeric - balance), 0) FROM drivers", BALANCE)
+        negative = await conn.fetchval("SELECT count(*) FROM drivers WHERE balance < 0")
+        if not args.keep:
+            await conn.execute(f"DROP SCHEMA {SCHEMA} CASCADE")
+    await pool.close()
+
+    expected = len(order_ids) * FEE
+    print(f"mode={args.mode} drivers={args.n} orders={len(order_ids)} pool={args.pool}")
+    print(f"accepts: {len(latencies)} in {wall:.2f}s ({len(latencies) / wall:.0f}/s)")
+    print(f"latency ms: p50={pct(latencies, 50):.2f} p95={pct(latencies, 95):.2f} "
+          f"p99={pct(latencies, 99):.2f} max={max(latencies):.2f} mean={statistics.mean(latencies):.2f}")
+    print(f"winners reported: {claimed} (expected {len(order_ids)})")
+    print(f"orders taken: {taken}, commission debited: {int(debited)} (expected {expected}), negative balances: {negative}")
+    correct = claimed == len(order_ids) == taken and int(debited) == expected and negative == 0
+    print("RESULT:", "OK" if correct else "INCONSISTENT")
+    return 0 if correct else 1
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Concurrent accept_order benchmark")
+    parser.add_argument("-n", type=int, default=100, help="bir vaqtda bosadigan haydovchilar soni")
+    parser.add_argument("--rounds", type=int, default=20, help="nechta buyurtma uchun takrorlash")
+    parser.add_argument("--pool", type=int, default=20, help="pool hajmi")
+    parser.add_argument("--mode", choices=["atomic", "legacy"], default="atomic")
+    parser.add_argument("--dsn", default=None)
+    parser.add_argument("--keep", action="store_true", help="sxemani o'chirmaslik")
+    sys.exit(asyncio.run(run(parser.parse_args())))
+
+
+if __name__ == "__main__":
+    main()
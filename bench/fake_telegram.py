@@ -0,0 +1,272 @@
+# -*- coding: utf-8 -*-
+"""
+fake_telegram.py
+api.telegram.org o'rnida lokal server (end-to-end fan-out benchmarklari uchun, tarmoqsiz).
+- `/bot<token>/<method>` va `/file/bot<token>/<path>`, javoblar Bot API formatida
+- flood limit: global (sekundiga N xabar) va chat bo'yicha (1 xabar / interval, qisqa burst ruxsat);
+  oshsa 429 va `parameters.retry_after`
+- botni bloklagan foydalanuvchilar (`--blocked` ulushi yoki `--blocked-ids`): 403
+- sozlanadigan kechikish (±50%)
+- `/stats`: yetkazilgan xabarlar, 429/403 soni, sekundiga yetkazish (o'rtacha va cho'qqi)
+
+    python bench/fake_telegram.py serve --port 8081 --blocked 0.05
+    TELEGRAM_API_BASE=http://127.0.0.1:8081 python bot.py
+
+    python bench/fake_telegram.py fanout --chats 2000                # server + fanout engine bitta jarayonda
+    python bench/fake_telegram.py fanout --chats 2000 --rate 45      # RetryAfter bilan ishlashni ko'rish
+"""
+import argparse
+import asyncio
+import json
+import math
+import os
+import random
+import sys
+import time
+from collections import Counter, deque
+
+from aiohttp import web
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+BENCH_TOKEN = "123456:BENCH-fake-telegram"
+
+# shu metodlar "xabar" — flood limitga kiradi
+SEND_METHODS = {"sendMessage", "sendPhoto", "sendDocument", "sendVideo", "sendAnimation",
+                "sendMediaGroup", "copyMessage", "forwardMessage"}
+MESSAGE_METHODS = SEND_METHODS | {"editMessageText", "editMessageCaption", "editMessageReplyMarkup"}
+
+
+class FakeTelegram:
+    def __init__(self, global_rate: float = 30, per_chat_interval: float = 1.0, chat_burst: int = 3,
+                 latency: float = 0.03, blocked: float = 0.0, blocked_ids=(), seed: int = 0):
+        self.global_rate = global_rate
+        self.per_chat_interval = per_chat_interval
+        self.chat_burst = chat_burst
+        self.latency = latency
+        self.blocked = blocked
+        self.blocked_ids = set(blocked_ids)
+        self.rng = random.Random(seed)
+        self._window = deque()        # oxirgi 1 s dagi yuborishlar (monotonic)
+        self._chat_tokens = {}         # chat_id -> (tokens, vaqt)
+        self._message_ids = 0
+        self.calls = Counter()
+        self.replies = Counter()       # 200 / 429_global / 429_chat / 403
+        self.delivered = 0
+        self._per_second = Counter()   # int(sekund) -> yetkazilgan
+        self.first_at = None
+        self.last_at = None
+        self.on_message = None         # on_message(msg) — bot yuborgan/tahrirlagan har bir xabar (load_test)
+
+    def is_blocked(self, chat_id: int) -> bool:
+        if chat_id in self.blocked_ids:
+            return True
+        # chat_id bo'yicha barqaror: har safar bir xil foydalanuvchilar "bloklagan"
+        return self.blocked > 0 and (chat_id * 2654435761) % 10000 < self.blocked * 10000
+
+    def _flood(self, chat_id, now: float):
+        """429 uchun retry_after (sekund) yoki None."""
+        while self._window and self._window[0] <= now - 1.0:
+            self._window.popleft()
+        if len(self._window) >= self.global_rate:
+            self.replies["429_global"] += 1
+            return max(1, math.ceil(self._window[0] + 1.0 - now))
+        if self.per_chat_interval <= 0:
+            return None
+        tokens, at = self._chat_tokens.get(chat_id, (self.chat_burst, now))
+        tokens = min(self.chat_burst, tokens + (now - at) / self.per_chat_interval)
+        if tokens < 1:
+            self.replies["429_chat"] += 1
+            return max(1, math.ceil((1 - tokens) * self.per_chat_interval))
+        self._chat_tokens[chat_id] = (tokens - 1, now)
+        return None
+
+    def _message(self, chat_id, params: dict) -> dict:
+        self._message_ids += 1
+        msg = {"message_id": int(params.get("message_id") or self._message_ids), "date": int(time.time()),
+               "chat": {"id": chat_id, "type": "private"}}
+        for key in ("text", "caption"):
+            if params.get(key):
+                msg[key] = params[key]
+        if params.get("reply_markup"):
+            markup = json.loads(params["reply_markup"])
+            if "inline_keyboard" in markup:
+                msg["reply_markup"] = markup
+        if isinstance(params.get("photo"), str):
+            msg["photo"] = [{"file_id": params["photo"], "file_unique_id": params["photo"],
+                             "width": 720, "height": 1280}]
+        if self.on_message is not None:
+            self.on_message(msg)
+        return msg
+
+    def _result(self, method: str, chat_id, params: dict):
+        if method in MESSAGE_METHODS:
+            if method == "sendMediaGroup":
+                return [self._message(chat_id, {})]
+            return self._message(chat_id, params)
+        if method == "getMe":
+            return {"id": int(BENCH_TOKEN.split(":")[0]), "is_bot": True, "first_name": "fake",
+                    "username": "fake_bot"}
+        if method == "getFile":
+            return {"file_id": params["file_id"], "file_unique_id": params["file_id"],
+                    "file_path": f"photos/{params['file_id']}.jpg"}
+        if method == "getWebhookInfo":
+            return {"url": "", "has_custom_certificate": False, "pending_update_count": 0}
+        if method == "getUpdates":
+            return []
+        if method == "copyMessage":
+            return {"message_id": self._message_ids}
+        return True
+
+    @staticmethod
+    def error(code: int, description: str, **parameters) -> web.Response:
+        body = {"ok": False, "error_code": code, "description": description}
+        if parameters:
+            body["parameters"] = parameters
+        return web.json_response(body, status=code)
+
+    async def handle_method(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"]
+        params = dict(await request.post())
+        if not params and request.can_read_body and request.content_type == "application/json":
+            params = await request.json()
+        self.calls[method] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency * self.rng.uniform(0.5, 1.5))
+        chat_id = params.get("chat_id")
+        chat_id = int(chat_id) if chat_id not in (None, "") else None
+
+        if chat_id is not None and method in MESSAGE_METHODS and self.is_blocked(chat_id):
+            self.replies["403"] += 1
+            return self.error(403, "Forbidden: bot was blocked by the user")
+        if chat_id is not None and method in SEND_METHODS:
+            now = time.monotonic()
+            retry_after = self._flood(chat_id, now)
+            if retry_after is not None:
+                return self.error(429, f"Too Many Requests: retry after {retry_after}", retry_after=retry_after)
+            self._window.append(now)
+            self.delivered += 1
+            self._per_second[int(now)] += 1
+            self.first_at = self.first_at or now
+            self.last_at = now
+        self.replies["200"] += 1
+        return web.json_response({"ok": True, "result": self._result(method, chat_id, params)})
+
+    async def handle_file(self, request: web.Request) -> web.Response:
+        return web.Response(body=os.urandom(2048), content_type="application/octet-stream")
+
+    async def handle_stats(self, request: web.Request) -> web.Response:
+        return web.json_response(self.stats())
+
+    def stats(self) -> dict:
+        span = (self.last_at - self.first_at) if self.first_at and self.last_at else 0.0
+        return {
+            "delivered": self.delivered,
+            "delivered_per_s": round(self.delivered / span, 1) if span > 0 else float(self.delivered),
+            "peak_per_s": max(self._per_second.values(), default=0),
+            "replies": dict(self.replies),
+            "calls": dict(self.calls.most_common()),
+        }
+
+    def app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post("/bot{token}/{method}", self.handle_method)
+        app.router.add_get("/bot{token}/{method}", self.handle_method)
+        app.router.add_get("/file/bot{token}/{path:.+}", self.handle_file)
+        app.router.add_get("/stats", self.handle_stats)
+        return app
+
+
+def make_server(args) -> FakeTelegram:
+    blocked_ids = [int(x) for x in args.blocked_ids.split(",") if x.strip()] if args.blocked_ids else ()
+    return FakeTelegram(global_rate=args.global_rate, per_chat_interval=args.chat_interval, chat_burst=args.chat_burst,
+                        latency=args.latency_ms / 1000, blocked=args.blocked, blocked_ids=blocked_ids,
+                        seed=args.seed)
+
+
+async def start(server: FakeTelegram, host: str, port: int) -> web.AppRunner:
+    runner = web.AppRunner(server.app(), access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    return runner
+
+
+async def serve(args):
+    server = make_server(args)
+    runner = await start(server, args.host, args.port)
+    print(f"fake Bot API on http://{args.host}:{args.port} "
+          f"(global {args.global_rate}/s, chat 1/{args.chat_interval}s, blocked {args.blocked:.0%}, "
+          f"latency {args.latency_ms}ms); stats: /stats")
+    try:
+        while True:
+            await asyncio.sleep(10)
+            if server.calls:
+                print(server.stats())
+    finally:
+        await runner.cleanup()
+
+
+async def fanout_bench(args):
+    """fanout.FanoutEngine -> haqiqiy aiohttp sessiya -> shu server: yetkazish tezligi va RetryAfter."""
+    from aiogram import Bot
+    from aiogram.client.session.aiohttp import AiohttpSession
+    from aiogram.client.telegram import TelegramAPIServer
+    from fanout import GLOBAL_RATE, FanoutEngine
+
+    if args.rate is None:
+        args.rate = GLOBAL_RATE
+    server = make_server(args)
+    runner = await start(server, "127.0.0.1", args.port)
+    base = f"http://127.0.0.1:{args.port}"
+    bot = Bot(BENCH_TOKEN, session=AiohttpSession(api=TelegramAPIServer.from_base(base)))
+    engine = FanoutEngine(rate=args.rate, concurrency=args.concurrency)
+    chat_ids = list(range(1_000_000, 1_000_000 + args.chats))
+    try:
+        result = await engine.send_message(bot, chat_ids, "📢 fan-out benchmark")
+    finally:
+        await bot.session.close()
+        await runner.cleanup()
+    stats = server.stats()
+    print(f"chats={args.chats} engine rate={args.rate}/s concurrency={args.concurrency} "
+          f"server limit={args.global_rate}/s blocked={args.blocked:.0%} latency={args.latency_ms}ms")
+    print(f"engine: {result} errors={result.errors}")
+    print(f"delivered/s: {result.delivered / result.elapsed:.1f} (server: avg {stats['delivered_per_s']}, "
+          f"peak {stats['peak_per_s']})")
+    print(f"server replies: {stats['replies']}")
+    lost = args.chats - result.delivered - stats["replies"].get("403", 0)
+    print("RESULT:", "OK" if lost == 0 else f"LOST {lost}")
+    return 0 if lost == 0 else 1
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local Telegram Bot API stand-in")
+    sub = parser.add_subparsers(dest="cmd")
+    for name in ("serve", "fanout"):
+        p = sub.add_parser(name)
+        p.add_argument("--port", type=int, default=8081)
+        p.add_argument("--global-rate", type=float, default=30, help="server: sekundiga xabar limiti")
+        p.add_argument("--chat-interval", type=float, default=1.0, help="server: bitta chatga xabarlar orasidagi min. s")
+        p.add_argument("--chat-burst", type=int, default=3, help="server: chatga ketma-ket ruxsat etilgan xabarlar")
+        p.add_argument("--latency-ms", type=float, default=30.0)
+        p.add_argument("--blocked", type=float, default=0.0, help="botni bloklagan chatlar ulushi")
+        p.add_argument("--blocked-ids", default="", help="vergul bilan chat_id lar")
+        p.add_argument("--seed", type=int, default=1)
+        if name == "serve":
+            p.add_argument("--host", default="127.0.0.1")
+        else:
+            p.add_argument("--chats", type=int, default=1000)
+            p.add_argument("--rate", type=float, default=None, help="FanoutEngine global rate (fanout.GLOBAL_RATE)")
+            p.add_argument("--concurrency", type=int, default=20)
+    args = parser.parse_args()
+    if args.cmd == "fanout":
+        sys.exit(asyncio.run(fanout_bench(args)))
+    if args.cmd is None:
+        args = parser.parse_args(["serve"] + sys.argv[1:])
+    try:
+        asyncio.run(serve(args))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+"""
+geo_index.py
+geo.GeoGrid uchun update va nearest() o'tkazuvchanligi / latency.
+Haydovchilar O'zbekiston bo'ylab, asosiy qismi Toshkent atrofida to'plangan.
+
+    python bench/geo_index.py -n 50000 --queries 20000 -k 20
+
+Natija to'liq skan (brute force) bilan solishtirilib tekshiriladi.
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import geo  # noqa: E402
+
+# (lat, lon, sigma_deg, ulush)
+CLUSTERS = [
+    (41.31, 69.28, 0.12, 0.45),   # Toshkent
+    (39.65, 66.96, 0.08, 0.12),   # Samarqand
+    (40.78, 72.34, 0.08, 0.10),   # Andijon
+    (40.38, 71.78, 0.08, 0.08),   # Farg'ona
+    (39.77, 64.42, 0.08, 0.07),   # Buxoro
+]
+BBOX = (37.2, 45.6, 56.0, 73.1)   # qolgani mamlakat bo'ylab tekis
+
+
+def random_point(rng: random.Random):
+    x = rng.random()
+    for lat, lon, sigma, share in CLUSTERS:
+        if x < share:
+            return rng.gauss(lat, sigma), rng.gauss(lon, sigma)
+        x -= share
+    return rng.uniform(BBOX[0], BBOX[1]), rng.uniform(BBOX[2], BBOX[3])
+
+
+def pct(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+
+def brute(points, lat, lon, k, allowed):
+    d = [(geo.distance_km(lat, lon, plat, plon), did) for did, (plat, plon) in points.items()
+         if allowed is None or did in allowed]
+    return sorted(d)[:k]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="GeoGrid benchmark")
+    parser.add_argument("-n", type=int, default=50000, help="haydovchilar soni")
+    parser.add_argument("--queries", type=int, default=20000)
+    parser.add_argument("--updates", type=int, default=200000)
+    parser.add_argument("-k", type=int, default=20)
+    parser.add_argument("--cell", type=float, default=geo.CELL_DEG, help="katak o'lchami, gradus")
+    parser.add_argument("--allowed", type=float, default=0.4, help="mos mashinali haydovchilar ulushi")
+    parser.add_argument("--check", type=int, default=200, help="brute force bilan tekshiriladigan so'rovlar")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    grid = geo.GeoGrid(cell_deg=args.cell)
+    points = {}
+
+    started = time.perf_counter()
+    for did in range(1, args.n + 1):
+        lat, lon = random_point(rng)
+        points[did] = (lat, lon)
+        grid.update(did, lat, lon)
+    load = time.perf_counter() - started
+
+    # live location: kichik siljishlar
+    moves = [(rng.randint(1, args.n), rng.gauss(0, 0.005), rng.gauss(0, 0.005)) for _ in range(args.updates)]
+    started = time.perf_counter()
+    for did, dlat, dlon in moves:
+        lat, lon = points[did]
+        lat, lon = lat + dlat, lon + dlon
+        points[did] = (lat, lon)
+        grid.update(did, lat, lon)
+    upd = time.perf_counter() - started
+
+    allowed = {did for did in points if rng.random() < args.allowed}
+    queries = [random_point(rng) for _ in range(args.queries)]
+    latencies = []
+    started = time.perf_counter()
+    for lat, lon in queries:
+        t = time.perf_counter()
+        grid.nearest(lat, lon, args.k, allowed=allowed)
+        latencies.append((time.perf_counter() - t) * 1e6)
+    qtime = time.perf_counter() - started
+
+    mismatches = 0
+    for lat, lon in queries[:args.check]:
+        got = [did for _, did in grid.nearest(lat, lon, args.k, allowed=allowed)]
+        want = [did for _, did in brute(points, lat, lon, args.k, allowed)]
+        if got != want:
+            mismatches += 1
+
+    print(f"drivers={args.n} cell={args.cell}° k={args.k} allowed={len(allowed)}")
+    print(f"load: {args.n / load:,.0f} inserts/s")
+    print(f"update: {args.updates / upd:,.0f} updates/s ({upd / args.updates * 1e6:.2f} µs each)")
+    print(f"nearest: {args.queries / qtime:,.0f} queries/s; µs p50={pct(latencies, 50):.0f} "
+          f"p95={pct(latencies, 95):.0f} p99={pct(latencies, 99):.0f} max={max(latencies):.0f} "
+          f"mean={statistics.mean(latencies):.0f}")
+    print(f"brute-force check: {args.check - mismatches}/{args.check} identical")
+    sys.exit(0 if mismatches == 0 else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,524 @@
+# -*- coding: utf-8 -*-
+"""
+load_test.py
+bot.py dispatcherini sintetik Telegram updatelari bilan yuklash.
+- to'liq oqimlar: haydovchi ro'yxatdan o'tishi, mijoz /start → "👤 Мижоз" → NewOrder qadamlari →
+  order_phone, admin `setfee:`, taklif kelgan haydovchilar to'dasi `accept:`, "📜 Бўш буюртмалар",
+  kvitansiya (rasm) + admin tasdig'i, broadcast
+- aktorlar botning o'z xabarlaridagi tugmalarga javob beradi (buyurtma id si, taklif, kvitansiya)
+- updatelar `dp.feed_update` ga umumiy tezlik chegarasi (--rate) bilan beriladi
+- Bot API o'rniga soxta sessiya: chaqiruvlarni sanaydi, tarmoq kechikishini simulyatsiya qiladi;
+  `--fake-api` bilan esa haqiqiy aiohttp sessiya fake_telegram.py serveriga boradi (429/403 bilan)
+- hisobot: o'tkazuvchanlik, handler bo'yicha p50/p95/p99, update ga DB round trip va Bot API chaqiruvlari
+  (handler ichida ochilgan tasklar ham o'sha updatega yoziladi; outbox/broadcast workerlari — "background")
+
+    DATABASE_URL=postgresql://localhost/cargobot python bench/load_test.py --drivers 200 --customers 50 --rate 300
+    python bench/load_test.py --latency-ms 0 --rate 0     # faqat bot + Postgres narxi
+    python bench/load_test.py --fake-api --blocked 0.05   # HTTP orqali, flood limit va bloklar bilan
+
+Hamma jadvallar alohida `bench_load` sxemasida yaratiladi, asosiy ma'lumotlarga tegilmaydi.
+"""
+import argparse
+import asyncio
+import contextvars
+import io
+import itertools
+import os
+import random
+import statistics
+import sys
+import time
+from collections import Counter, defaultdict
+from typing import get_args
+
+import asyncpg
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+SCHEMA = "bench_load"
+BENCH_TOKEN = "123456:BENCH-load-test"
+FEE = 10000
+RECEIPT_AMOUNT = 10000
+DRIVER_BASE = 10_000_000
+CUSTOMER_BASE = 20_000_000
+CARS = [("Labo", "🚐 Лабо"), ("Bongo", "🚛 Бонго"), ("Isuzi", "🚚 Исузи")]
+
+# joriy update statistikasi; handler ochgan tasklarga ham o'tadi (context nusxalanadi)
+current = contextvars.ContextVar("bench_update", default=None)
+
+
+class UpdateStats:
+    __slots__ = ("handler", "elapsed", "db", "api", "error")
+
+    def __init__(self):
+        self.handler = "no_handler"   # filtr mos kelmadi yoki middleware (idem) to'xtatdi
+        self.elapsed = 0.0
+        self.db = 0
+        self.api = 0
+        self.error = None
+
+
+class Recorder:
+    def __init__(self):
+        self.updates = []
+        self.db_total = 0
+        self.api_total = 0
+        self.api_methods = Counter()
+
+    def db_query(self):
+        self.db_total += 1
+        stats = current.get()
+        if stats is not None:
+            stats.db += 1
+
+    def api_call(self, name: str):
+        self.api_total += 1
+        self.api_methods[name] += 1
+        stats = current.get()
+        if stats is not None:
+            stats.api += 1
+
+
+recorder = Recorder()
+
+
+class CountCalls:
+    """Bot sessiyasi request middleware: har bir Bot API chaqiruvi (qaysi sessiya bo'lishidan qat'i nazar)."""
+    async def __call__(self, make_request, bot, method):
+        recorder.api_call(method.__api_method__)
+        return await make_request(bot, method)
+
+
+class HandlerName:
+    """Router inner middleware: update qaysi handlerga tushganini yozadi."""
+    async def __call__(self, handler, event, data):
+        stats = current.get()
+        if stats is not None:
+            callback = getattr(data.get("handler"), "callback", None)
+            stats.handler = getattr(callback, "__name__", "unknown")
+        return await handler(event, data)
+
+
+def photo_bytes(seed: str) -> bytes:
+    """Har bir fayl uchun boshqa rasm (Pillow bo'lsa dHash haqiqatan hisoblanadi)."""
+    try:
+        from PIL import Image
+    except ImportError:
+        return b""
+    rng = random.Random(seed)
+    img = Image.new("L", (64, 64))
+    img.putdata([rng.randrange(256) for _ in range(64 * 64)])
+    buf = io.BytesIO()
+    img.save(buf, "PNG")
+    return buf.getvalue()
+
+
+def buttons(msg: dict) -> list:
+    markup = msg.get("reply_markup") or {}
+    return [b["callback_data"] for row in markup.get("inline_keyboard", []) for b in row if b.get("callback_data")]
+
+
+def deliver(inboxes: dict, msg: dict):
+    """Inline tugmali xabar qabul qiluvchi aktor navbatiga tushadi."""
+    inbox = inboxes.get(msg["chat"]["id"])
+    if inbox is not None and msg.get("reply_markup"):
+        inbox.put_nowait(msg)
+
+
+def make_session_class():
+    from aiogram.client.session.base import BaseSession
+    from aiogram.methods.base import Response
+    from aiogram.types import File, InlineKeyboardMarkup, Message, MessageId, User
+
+    class FakeSession(BaseSession):
+        """
+        Bot API o'rniga. Har bir chaqiruv sanaladi va `latency` (±50%) kutadi.
+        Inline tugmali xabarlar qabul qiluvchi aktorning `inboxes[chat_id]` navbatiga tushadi.
+        """
+        def __init__(self, latency: float, inboxes: dict, seed: int = 0):
+            super().__init__()
+            self.latency = latency
+            self.inboxes = inboxes
+            self.rng = random.Random(seed)
+            self._message_ids = itertools.count(1)
+
+        def _message(self, method) -> dict:
+            chat_id = getattr(method, "chat_id", None)
+            msg = {
+                "message_id": getattr(method, "message_id", None) or next(self._message_ids),
+                "date": int(time.time()),
+                "chat": {"id": int(chat_id) if chat_id is not None else 0, "type": "private"},
+            }
+            text = getattr(method, "text", None) or getattr(method, "caption", None)
+            if text:
+                msg["text" if getattr(method, "text", None) else "caption"] = text
+            photo = getattr(method, "photo", None)
+            if isinstance(photo, str):
+                msg["photo"] = [{"file_id": photo, "file_unique_id": photo, "width": 720, "height": 1280}]
+            markup = getattr(method, "reply_markup", None)
+            if isinstance(markup, InlineKeyboardMarkup):
+                msg["reply_markup"] = markup.model_dump(exclude_none=True)
+            deliver(self.inboxes, msg)
+            return msg
+
+        def _result(self, method):
+            ret = method.__returning__
+            types = get_args(ret) or (ret,)
+            if Message in types:
+                return self._message(method)
+            if ret is MessageId:
+                return {"message_id": next(self._message_ids)}
+            if ret is File:
+                return {"file_id": method.file_id, "file_unique_id": method.file_id,
+                        "file_path": f"photos/{method.file_id}.png"}
+            if ret is User:
+                return {"id": int(BENCH_TOKEN.split(":")[0]), "is_bot": True, "first_name": "bench"}
+            if bool in types:
+                return True
+            raise NotImplementedError(f"{method.__api_method__} is not simulated")
+
+        async def make_request(self, bot, method, timeout=None):
+            if self.latency:
+                await asyncio.sleep(self.latency * self.rng.uniform(0.5, 1.5))
+            response = Response[method.__returning__].model_validate(
+                {"ok": True, "result": self._result(method)}, context={"bot": bot})
+            return response.result
+
+        async def stream_content(self, url, headers=None, timeout=30, chunk_size=65536, raise_for_status=True):
+            yield photo_bytes(url.rsplit("/", 1)[-1])
+
+        async def close(self):
+            pass
+
+    return FakeSession
+
+
+class Updates:
+    """Telegram Update JSON lari (webhook kabi `Update.model_validate` dan o'tadi)."""
+    def __init__(self):
+        self._update_ids = itertools.count(1)
+        self._message_ids = itertools.count(1_000_000)
+        self._query_ids = itertools.count(1)
+        self._files = itertools.count(1)
+
+    @staticmethod
+    def user(uid: int) -> dict:
+        return {"id": uid, "is_bot": False, "first_name": f"user{uid}", "username": f"user{uid}"}
+
+    def message(self, uid: int, text: str = None, **fields) -> dict:
+        msg = {"message_id": next(self._message_ids), "date": int(time.time()),
+               "chat": {"id": uid, "type": "private"}, "from": self.user(uid), **fields}
+        if text is not None:
+            msg["text"] = text
+            if text.startswith("/"):
+                msg["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+        return {"update_id": next(self._update_ids), "message": msg}
+
+    def contact(self, uid: int, phone: str) -> dict:
+        return self.message(uid, contact={"phone_number": phone, "first_name": f"user{uid}", "user_id": uid})
+
+    def photo(self, uid: int) -> dict:
+        n = next(self._files)
+        return self.message(uid, photo=[
+            {"file_id": f"rcpt{n}s", "file_unique_id": f"rcpt{n}s", "width": 90, "height": 160},
+            {"file_id": f"rcpt{n}", "file_unique_id": f"rcpt{n}", "width": 720, "height": 1280},
+        ])
+
+    def callback(self, uid: int, data: str, message: dict) -> dict:
+        return {"update_id": next(self._update_ids), "callback_query": {
+            "id": str(next(self._query_ids)), "from": self.user(uid), "chat_instance": "bench",
+            "data": data, "message": message}}
+
+
+class Pacer:
+    """Umumiy tezlik: sekundiga `rate` ta update (0 — cheklovsiz)."""
+    def __init__(self, rate: float):
+        self.interval = 1.0 / rate if rate > 0 else 0.0
+        self._next = 0.0
+
+    async def wait(self):
+        if not self.interval:
+            return
+        now = time.perf_counter()
+        slot = max(self._next, now)
+        self._next = slot + self.interval
+        if slot > now:
+            await asyncio.sleep(slot - now)
+
+
+class Harness:
+    def __init__(self, app, args):
+        self.app = app
+        self.args = args
+        self.u = Updates()
+        self.pacer = Pacer(args.rate)
+        self.inboxes = {}
+        self.rng = random.Random(args.seed)
+        self.stop = asyncio.Event()
+
+    def inbox(self, uid: int) -> asyncio.Queue:
+        return self.inboxes.setdefault(uid, asyncio.Queue())
+
+    async def feed(self, raw: dict):
+        from aiogram.types import Update
+        await self.pacer.wait()
+        stats = UpdateStats()
+        token = current.set(stats)
+        started = time.perf_counter()
+        try:
+            update = Update.model_validate(raw, context={"bot": self.app.bot})
+            await self.app.dp.feed_update(self.app.bot, update)
+        except Exception as e:
+            stats.error = type(e).__name__
+        finally:
+            stats.elapsed = time.perf_counter() - started
+            current.reset(token)
+        recorder.updates.append(stats)
+
+    async def button(self, uid: int, prefix: str, timeout: float = 10.0):
+        """Aktorga kelgan, `prefix` bilan boshlanadigan tugmali xabar: (msg, callback_data)."""
+        inbox = self.inbox(uid)
+        deadline = time.perf_counter() + timeout
+        while True:
+            msg = await asyncio.wait_for(inbox.get(), max(deadline - time.perf_counter(), 0.001))
+            for data in buttons(msg):
+                if data.startswith(prefix):
+                    return msg, data
+
+    # --- aktorlar ---
+    async def driver_signup(self, uid: int, car: str, receipt: bool) -> bool:
+        """Mashina tanlash tugmasi kelmasa (--blocked: bot xabari 403 oldi) False."""
+        u = self.u
+        await self.feed(u.message(uid, "/start"))
+        await self.feed(u.message(uid, "🚖 Ҳайдовчи"))
+        await self.feed(u.contact(uid, f"+99890{uid % 10_000_000:07d}"))
+        await self.feed(u.message(uid, f"Driver {uid}"))
+        try:
+            msg, _ = await self.button(uid, "car_")
+        except asyncio.TimeoutError:
+            return False
+        await self.feed(u.callback(uid, f"car_{car}", msg))
+        if receipt:
+            await self.feed(u.message(uid, "💳 Баланс тўлдириш (квитансия)"))
+            await self.feed(u.photo(uid))
+        return True
+
+    async def driver_work(self, uid: int):
+        u, args, inbox = self.u, self.args, self.inbox(uid)
+        rng = random.Random(uid)
+        while not self.stop.is_set():
+            try:
+                msg = await asyncio.wait_for(inbox.get(), 0.5)
+            except asyncio.TimeoutError:
+                if rng.random() < args.browse:
+                    await self.feed(u.message(uid, "📜 Бўш буюртмалар"))
+                continue
+            offers = [d for d in buttons(msg) if d.startswith("accept:")]
+            if offers and rng.random() < args.accept_prob:
+                await asyncio.sleep(rng.uniform(0, args.think))
+                await self.feed(u.callback(uid, rng.choice(offers), msg))
+
+    async def customer(self, uid: int):
+        u, rng = self.u, random.Random(uid)
+        await self.feed(u.message(uid, "/start"))
+        await self.feed(u.message(uid, "👤 Мижоз"))
+        await self.feed(u.contact(uid, f"+99891{uid % 10_000_000:07d}"))
+        await self.feed(u.message(uid, f"Customer {uid}"))
+        for _ in range(self.args.orders):
+            await self.feed(u.message(uid, "📝 Янгидан буюртма"))
+            await self.feed(u.message(uid, f"Тошкент, {rng.randint(1, 200)}-уй"))
+            await self.feed(u.message(uid, f"Самарқанд, {rng.randint(1, 200)}-уй"))
+            await self.feed(u.message(uid, "Мебель"))
+            await self.feed(u.message(uid, rng.choice(CARS)[1]))
+            await self.feed(u.message(uid, str(rng.randint(50, 1500))))
+            await self.feed(u.contact(uid, f"+99891{uid % 10_000_000:07d}"))
+
+    async def admin(self, uid: int):
+        """Komissiya, kvitansiya va broadcast tugmalariga javob beradi."""
+        u, inbox = self.u, self.inbox(uid)
+        if self.args.broadcast:
+            await self.feed(u.message(uid, "📢 Хабар юбориш"))
+        while not self.stop.is_set():
+            try:
+                msg = await asyncio.wait_for(inbox.get(), 0.5)
+            except asyncio.TimeoutError:
+                continue
+            for data in buttons(msg):
+                if data.startswith("setfee:") and data.endswith(f":{FEE}"):
+                    await self.feed(u.callback(uid, data, msg))
+                    break
+                if data.startswith("approve_receipt:") and data.endswith(f":{RECEIPT_AMOUNT}"):
+                    await self.feed(u.callback(uid, data, msg))
+                    break
+                if data == "broadcast_drivers":
+                    await self.feed(u.callback(uid, data, msg))
+                    await self.feed(u.message(uid, "📢 Юклама синови: эътибор берманг."))
+                    break
+
+    async def settle(self):
+        """Mijozlar tugagach: ochiq/komissiyasiz buyurtma qolmaguncha (yoki --settle gacha) kutadi."""
+        deadline = time.perf_counter() + self.args.settle
+        while time.perf_counter() < deadline:
+            async with self.app.pool.acquire() as conn:
+                left = await conn.fetchval("SELECT count(*) FROM orders WHERE status IN ('open', 'pending_fee')")
+            if not left:
+                return
+            await asyncio.sleep(0.5)
+
+
+def pct(values, p):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    k = min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))
+    return values[k]
+
+
+def report(wall: float):
+    ups = recorder.updates
+    by_handler = defaultdict(list)
+    for s in ups:
+        by_handler[s.handler].append(s)
+    print(f"updates: {len(ups)} in {wall:.2f}s ({len(ups) / wall:.0f}/s), "
+          f"errors: {dict(Counter(s.error for s in ups if s.error)) or 0}")
+    print(f"{'handler':32} {'count':>6} {'p50':>8} {'p95':>8} {'p99':>8} {'max':>8} {'db/upd':>7} {'api/upd':>8}")
+    for name, items in sorted(by_handler.items(), key=lambda kv: -len(kv[1])):
+        ms = [s.elapsed * 1000 for s in items]
+        print(f"{name:32} {len(items):6d} {pct(ms, 50):8.2f} {pct(ms, 95):8.2f} {pct(ms, 99):8.2f} "
+              f"{max(ms):8.2f} {statistics.mean(s.db for s in items):7.2f} "
+              f"{statistics.mean(s.api for s in items):8.2f}")
+    ms = [s.elapsed * 1000 for s in ups]
+    print(f"{'ALL':32} {len(ups):6d} {pct(ms, 50):8.2f} {pct(ms, 95):8.2f} {pct(ms, 99):8.2f} {max(ms):8.2f}")
+    db_upd = sum(s.db for s in ups)
+    api_upd = sum(s.api for s in ups)
+    print(f"DB round trips: {recorder.db_total} total, {db_upd / len(ups):.2f} per update, "
+          f"{recorder.db_total - db_upd} background")
+    print(f"Bot API calls: {recorder.api_total} total, {api_upd / len(ups):.2f} per update, "
+          f"{recorder.api_total - api_upd} background")
+    print("  by method:", dict(recorder.api_methods.most_common()))
+
+
+async def run(args):
+    dsn = args.dsn or os.getenv("DATABASE_URL")
+    if not dsn:
+        raise SystemExit("DATABASE_URL yoki --dsn kerak")
+    if dsn.startswith("postgres://"):
+        dsn = dsn.replace("postgres://", "postgresql://", 1)
+    conn = await asyncpg.connect(dsn)
+    await conn.execute(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE")
+    await conn.execute(f"CREATE SCHEMA {SCHEMA}")
+    await conn.close()
+
+    # bot.py sozlamalarni import paytida o'qiydi
+    os.environ["BOT_TOKEN"] = BENCH_TOKEN
+    os.environ["DATABASE_URL"] = dsn + ("&" if "?" in dsn else "?") + f"options=-csearch_path%3D{SCHEMA}"
+    os.environ["DB_POOL_MAX"] = str(args.pool)
+    os.environ.setdefault("DISPATCH_WAVE_TIMEOUT", "5")
+    import dbstats
+    original_log = dbstats.QueryStats.log
+
+    def log_query(self, record):
+        original_log(self, record)
+        recorder.db_query()
+    dbstats.QueryStats.log = log_query
+
+    inboxes = {}
+    api_server = api_runner = None
+    if args.fake_api:
+        import fake_telegram
+        api_server = fake_telegram.FakeTelegram(global_rate=args.api_rate, per_chat_interval=args.api_chat_interval,
+                                                latency=args.latency_ms / 1000, blocked=args.blocked,
+                                                seed=args.seed)
+        api_server.on_message = lambda msg: deliver(inboxes, msg)
+        api_runner = await fake_telegram.start(api_server, "127.0.0.1", args.api_port)
+        os.environ["TELEGRAM_API_BASE"] = f"http://127.0.0.1:{args.api_port}"
+
+    import bot as app
+    app.create_bot()   # on_startup ham chaqiradi; sessiyani almashtirish uchun oldinroq
+    if not args.fake_api:
+        session = make_session_class()(args.latency_ms / 1000, inboxes, args.seed)
+        session.middleware = app.bot.session.middleware   # metrics/idem request middlewarelari
+        app.bot.session = session
+    app.bot.session.middleware(CountCalls())
+    app.router.message.middleware(HandlerName())
+    app.router.callback_query.middleware(HandlerName())
+    await app.on_startup()
+
+    h = Harness(app, args)
+    h.inboxes = inboxes
+    admin_id = min(app.ADMIN_IDS)
+    drivers = [DRIVER_BASE + i for i in range(args.drivers)]
+    customers = [CUSTOMER_BASE + i for i in range(args.customers)]
+    for uid in drivers + [admin_id]:
+        h.inbox(uid)
+
+    started = time.perf_counter()
+    rng = random.Random(args.seed)
+    signed = await asyncio.gather(*(h.driver_signup(uid, rng.choice(CARS)[0], rng.random() < args.receipts)
+                                    for uid in drivers))
+    workers = [asyncio.create_task(h.driver_work(uid)) for uid, ok in zip(drivers, signed) if ok]
+    workers.append(asyncio.create_task(h.admin(admin_id)))
+    await asyncio.gather(*(h.customer(uid) for uid in customers))
+    await h.settle()
+    h.stop.set()
+    await asyncio.gather(*workers)
+    wall = time.perf_counter() - started
+
+    async with app.pool.acquire() as conn:
+        statuses = dict(await conn.fetch("SELECT status, count(*) FROM orders GROUP BY status"))
+        receipts = dict(await conn.fetch("SELECT status, count(*) FROM receipts GROUP BY status"))
+    import ledger
+    recon = await ledger.reconcile(app.pool)
+    await app.on_shutdown()
+    if api_runner is not None:
+        await api_runner.cleanup()
+
+    print(f"drivers={args.drivers} customers={args.customers} orders/customer={args.orders} "
+          f"rate={args.rate or 'unlimited'} latency={args.latency_ms}ms pool={args.pool}")
+    report(wall)
+    print(f"orders: {statuses}, receipts: {receipts}, balance reconcile: {recon}")
+    if api_server is not None:
+        print(f"fake Bot API: {api_server.stats()}")
+
+    if not args.keep:
+        conn = await asyncpg.connect(dsn)
+        await conn.execute(f"DROP SCHEMA {SCHEMA} CASCADE")
+        await conn.close()
+    errors = sum(1 for s in recorder.updates if s.error)
+    return 1 if errors or recon.mismatched else 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay synthetic Telegram updates against bot.dp")
+    parser.add_argument("--drivers", type=int, default=100)
+    parser.add_argument("--customers", type=int, default=30)
+    parser.add_argument("--orders", type=int, default=2, help="har bir mijoz nechta buyurtma beradi")
+    parser.add_argument("--rate", type=float, default=200.0, help="update/s, 0 — cheklovsiz")
+    parser.add_argument("--latency-ms", type=float, default=50.0, help="Bot API javob vaqti (±50%%)")
+    parser.add_argument("--accept-prob", type=float, default=0.3, help="taklifni qabul qilish ehtimoli")
+    parser.add_argument("--think", type=float, default=0.5, help="qabul qilishdan oldin maks. kutish, s")
+    parser.add_argument("--browse", type=float, default=0.02,
+                        help="bo'sh haydovchi har 0.5s da «Бўш буюртмалар» ni bosish ehtimoli")
+    parser.add_argument("--receipts", type=float, default=0.2, help="kvitansiya yuboradigan haydovchilar ulushi")
+    parser.add_argument("--no-broadcast", dest="broadcast", action="store_false")
+    parser.add_argument("--settle", type=float, default=30.0, help="buyurtmalar olinishini kutish chegarasi, s")
+    parser.add_argument("--fake-api", action="store_true",
+                        help="soxta sessiya o'rniga fake_telegram.py serveri (HTTP, flood limit, 403)")
+    parser.add_argument("--api-port", type=int, default=8081)
+    parser.add_argument("--blocked", type=float, default=0.0, help="--fake-api: botni bloklaganlar ulushi")
+    parser.add_argument("--api-rate", type=float, default=30,
+                        help="--fake-api: sekundiga xabar limiti (haqiqiy Telegram ~30)")
+    # simulyatsiya qilingan foydalanuvchi javobni kutmay keyingi qadamni bosadi — odamdan tezroq,
+    # shuning uchun chat limiti sukut bo'yicha o'chiq
+    parser.add_argument("--api-chat-interval", type=float, default=0.0,
+                        help="--fake-api: bitta chatga xabarlar orasidagi min. s (0 — limitsiz)")
+    parser.add_argument("--pool", type=int, default=10, help="DB pool hajmi")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--dsn", default=None)
+    parser.add_argument("--keep", action="store_true", help="sxemani o'chirmaslik")
+    sys.exit(asyncio.run(run(parser.parse_args())))
+
+
+if __name__ == "__main__":
+    main()
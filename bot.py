@@ -10,13 +10,21 @@ Asl kod postgresga moslashtirildi:
 """
 import asyncio
 import asyncpg
+import hashlib
+import html
+import logging
 import re
 import os
+import sys
+import time
+from contextlib import contextmanager, nullcontext
 from datetime import datetime
 
 from aiogram import Bot, Dispatcher, Router, F
 from aiogram.client.default import DefaultBotProperties
-from aiogram.filters import CommandStart
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+from aiogram.filters import CommandStart, Command
 from aiogram.types import (
     Message, ReplyKeyboardMarkup, KeyboardButton,
     InlineKeyboardMarkup, InlineKeyboardButton,
@@ -26,6 +34,26 @@ from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import StatesGroup, State
 from aiogram.utils.keyboard import InlineKeyboardBuilder
 
+from fanout import engine as fanout
+import broadcasts
+import bus
+import cache
+import dbstats
+import geo
+import idem
+import ledger
+import metrics
+import repo
+import matching
+import waves
+import migrate
+import offers
+import orderbook
+import outbox
+import reach
+import receipt_dedup
+from fsm_storage import PgStorage
+
 # --------------------------
 # SETTINGS: edit these
 # --------------------------
@@ -33,81 +61,140 @@ BOT_TOKEN = os.getenv("BOT_TOKEN")
 # add your admin IDs here (integers)
 ADMIN_IDS = {1262207928, 7370665741}
 DATABASE_URL = os.getenv("DATABASE_URL")  # must be set in env
+# Bot API manzili: bo'sh — api.telegram.org; masalan http://127.0.0.1:8081 (bench/fake_telegram.py
+# yoki o'zimizning telegram-bot-api serveri)
+TELEGRAM_API_BASE = os.getenv("TELEGRAM_API_BASE")
+# transport: "polling" (default) yoki "webhook" (ping.py dagi FastAPI app orqali)
+BOT_MODE = os.getenv("BOT_MODE", "polling")
+WEBHOOK_URL = os.getenv("WEBHOOK_URL")  # masalan https://cargo-bot.up.railway.app
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/webhook")
+WEB_CONCURRENCY = int(os.getenv("WEB_CONCURRENCY", "1"))  # webhook rejimida uvicorn workerlari
+# polling faqat bitta jarayonda bo'ladi; webhookda bir nechta worker bo'lishi mumkin
+SINGLE_PROCESS = BOT_MODE != "webhook" or WEB_CONCURRENCY <= 1
+# polling rejimida ping.py app (/ping, /metrics, /dbstats) shu jarayonda shu portda; 0 — o'chiq
+METRICS_PORT = int(os.getenv("METRICS_PORT") or os.getenv("PORT") or "8000")
+# hamma workerlarda bir xil bo'lishi kerak; berilmasa tokendan hosil qilinadi
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET") or (hashlib.sha256(BOT_TOKEN.encode()).hexdigest()[:32] if BOT_TOKEN else None)
+# FSM_WRITE_BEHIND=1: update_data larni yig'ib yozish (faqat bitta jarayon bo'lsa)
+FSM_WRITE_BEHIND = os.getenv("FSM_WRITE_BEHIND") == "1"
+# DB pool: Railway Postgres ulanishlar limiti past, max ni shunga qarab tanlang
+DB_POOL_MIN = int(os.getenv("DB_POOL_MIN", "2"))
+DB_POOL_MAX = int(os.getenv("DB_POOL_MAX", "10"))
+DB_ACQUIRE_TIMEOUT = float(os.getenv("DB_ACQUIRE_TIMEOUT", "10"))  # pool bo'shashini kutish, s
+DB_COMMAND_TIMEOUT = float(os.getenv("DB_COMMAND_TIMEOUT", "15"))  # client tomoni, s
+DB_STATEMENT_TIMEOUT_MS = int(os.getenv("DB_STATEMENT_TIMEOUT_MS", "15000"))  # server tomoni
+DB_CONN_IDLE_LIFETIME = float(os.getenv("DB_CONN_IDLE_LIFETIME", "300"))  # bo'sh connection yopiladi, s
+DB_CONN_MAX_QUERIES = int(os.getenv("DB_CONN_MAX_QUERIES", "50000"))  # shundan keyin connection yangilanadi
+# yangi buyurtma kimga boradi: "empty" — mos mashina yo'q bo'lsa hammaga, "none" — faqat mosiga, "all" — hammaga
+DISPATCH_FALLBACK = os.getenv("DISPATCH_FALLBACK", matching.FALLBACK_EMPTY)
+# mashinasi tanilmagan (erkin matn) haydovchilar ham har bir buyurtmani oladi
+DISPATCH_INCLUDE_UNKNOWN = os.getenv("DISPATCH_INCLUDE_UNKNOWN", "1") == "1"
+# buyurtmada olib ketish nuqtasi bo'lsa, shuncha eng yaqin mos haydovchi birinchi bo'lib oladi
+DISPATCH_NEAREST_K = int(os.getenv("DISPATCH_NEAREST_K", "20"))
+# live location har necha sekundda DB ga yoziladi (xotiradagi indeks har safar yangilanadi)
+LOCATION_SAVE_EVERY = float(os.getenv("LOCATION_SAVE_EVERY", "60"))
+# bir nechta jarayon: o'zgarishlar LISTEN/NOTIFY orqali keladi (bitta qo'shimcha DB connection)
+CHANGE_BUS = os.getenv("CHANGE_BUS", "1") == "1"
+# xotiradagi ochiq buyurtmalarni DB bilan solishtirish oralig'i, s
+ORDER_BOOK_CHECK_EVERY = float(os.getenv("ORDER_BOOK_CHECK_EVERY", "300"))
+# balans jurnali bilan solishtirish oralig'i, s
+BALANCE_RECONCILE_EVERY = float(os.getenv("BALANCE_RECONCILE_EVERY", str(6 * 3600)))
+# start (pool + sxema + keshlar) shundan uzoq cho'zilsa ogohlantirish, s
+STARTUP_TARGET = float(os.getenv("STARTUP_TARGET", "5"))
+# taklif to'lqinlari: "10,30,100" — 10 ta, keyin 30 ta, keyin 100 ta, keyin qolgan hamma; "" — hammaga birdan
+DISPATCH_WAVES = tuple(int(x) for x in os.getenv("DISPATCH_WAVES", "10,30,100").split(",") if x.strip())
+DISPATCH_WAVE_TIMEOUT = float(os.getenv("DISPATCH_WAVE_TIMEOUT", "60"))  # hech kim olmasa keyingi to'lqin, s
+# eng yaqinlardan keyingi tartib: balance, recent (vergul bilan, ustuvorlik tartibida)
+DISPATCH_RANK = tuple(x.strip() for x in os.getenv("DISPATCH_RANK", "balance,recent").split(",")
+                      if x.strip() in waves.RANK_CRITERIA)
 
 # --------------------------
 # BOT INIT
 # --------------------------
-bot = Bot(token=BOT_TOKEN, default=DefaultBotProperties(parse_mode="HTML"))
-dp = Dispatcher()
+# Bot create_bot() da (on_startup) yaratiladi: modulni import qilish (ping.py, bench, tooling) token talab qilmaydi
+bot: Bot = None
+# FSM holatlari PostgreSQL da (pool init_db da ulanadi)
+fsm_storage = PgStorage(write_behind=FSM_WRITE_BEHIND)
+dp = Dispatcher(storage=fsm_storage)
 router = Router()
 dp.include_router(router)
+# update/handler/Bot API metrikalari (ping.py: /metrics)
+metrics.setup(dp, router)
+# tugmani qayta bosish handlerga (va DB ga) yetmaydi
+callback_idem = idem.setup(router)
+# haydovchilarni faollik bo'yicha saralash uchun
+last_seen = waves.LastSeen()
+dp.update.outer_middleware(last_seen)
+# botni bloklab, keyin yana yozgan foydalanuvchi yuborish ro'yxatlariga qaytadi
+dp.update.outer_middleware(reach.RestoreOnUpdate(reach.tracker))
 
 # --------------------------
 # DATABASE HELPERS
 # --------------------------
-pool: asyncpg.Pool = None
+def create_bot() -> Bot:
+    global bot
+    if bot is None:
+        if not BOT_TOKEN:
+            raise RuntimeError("BOT_TOKEN is not set in environment variables.")
+        session = AiohttpSession(api=TelegramAPIServer.from_base(TELEGRAM_API_BASE)) if TELEGRAM_API_BASE else None
+        bot = Bot(token=BOT_TOKEN, default=DefaultBotProperties(parse_mode="HTML"), session=session)
+        metrics.setup_bot(bot)
+        idem.setup_bot(bot, callback_idem)
+    return bot
+
+pool: dbstats.InstrumentedPool = None
+broadcast_worker: broadcasts.BroadcastWorker = None
+outbox_dispatcher: outbox.OutboxDispatcher = None
+wave_scheduler: waves.WaveScheduler = None
+offer_retractor: offers.OfferRetractor = None
+reconciler: ledger.Reconciler = None
+change_bus: bus.ChangeBus = None
+# faol haydovchilar mashina sinfi bo'yicha (on_startup da yuklanadi)
+driver_index = matching.DriverIndex(include_unknown=DISPATCH_INCLUDE_UNKNOWN, fallback=DISPATCH_FALLBACK)
+# ochiq buyurtmalar ("Бўш буюртмалар" va qabul qilish tekshiruvi shu yerdan)
+order_book = orderbook.OrderBook(check_every=ORDER_BOOK_CHECK_EVERY)
+# haydovchilarning oxirgi joylashuvi (on_startup da DB dan, keyin location xabarlaridan)
+driver_positions = geo.GeoGrid()
+# yetib bo'lmaydigan haydovchi indeksdan chiqadi, botga yozsa qaytadi
+reach.tracker.on_marked = driver_index.remove
+reach.tracker.on_restored = driver_index.update
+_location_saved = {}  # driver_id -> oxirgi DB yozuvi (monotonic)
+
+def database_url() -> str:
+    if not DATABASE_URL:
+        raise RuntimeError("DATABASE_URL is not set in environment variables.")
+    # ensure prefix is postgresql:// (asyncpg prefers this)
+    if DATABASE_URL.startswith("postgres://"):
+        return DATABASE_URL.replace("postgres://", "postgresql://", 1)
+    return DATABASE_URL
 
 async def init_db():
     """
-    Init connection pool and create tables if not exists.
+    Init connection pool and apply pending schema migrations.
     """
     global pool
-    if not DATABASE_URL:
-        raise RuntimeError("DATABASE_URL is not set in environment variables.")
-    # ensure prefix is postgresql:// (asyncpg prefers this)
-    dburl = DATABASE_URL
-    if dburl.startswith("postgres://"):
-        dburl = dburl.replace("postgres://", "postgresql://", 1)
-    # create pool
+    dburl = database_url()
+    # create pool (acquire kutishi va har bir so'rov vaqti dbstats da yig'iladi);
+    # asyncpg min_size ta connectionni shu yerda parallel ochadi — birinchi updatelar connect kutmaydi
     # if you have issues with SSL, you may add ssl=False parameter
-    pool = await asyncpg.create_pool(dsn=dburl)
+    with startup_phase("pool"):
+        pool = await dbstats.create_pool(
+            dburl,
+            min_size=DB_POOL_MIN,
+            max_size=DB_POOL_MAX,
+            acquire_timeout=DB_ACQUIRE_TIMEOUT,
+            command_timeout=DB_COMMAND_TIMEOUT,
+            max_inactive_connection_lifetime=DB_CONN_IDLE_LIFETIME,
+            max_queries=DB_CONN_MAX_QUERIES,
+            server_settings={"statement_timeout": str(DB_STATEMENT_TIMEOUT_MS)},
+        )
+    fsm_storage.bind(pool)
 
-    async with pool.acquire() as conn:
-        # create tables (adapted from original sqlite schemas)
-        await conn.execute("""
-        CREATE TABLE IF NOT EXISTS drivers(
-            driver_id BIGINT PRIMARY KEY,
-            username TEXT,
-            phone TEXT,
-            full_name TEXT,
-            car_model TEXT,
-            balance NUMERIC DEFAULT 0,
-            status TEXT DEFAULT 'active'
-        )""")
-        await conn.execute("""
-        CREATE TABLE IF NOT EXISTS customers(
-            user_id BIGINT PRIMARY KEY,
-            username TEXT,
-            phone TEXT,
-            full_name TEXT,
-            status TEXT DEFAULT 'active'
-        )""")
-        await conn.execute("""
-        CREATE TABLE IF NOT EXISTS orders(
-            id SERIAL PRIMARY KEY,
-            customer_id BIGINT,
-            from_address TEXT,
-            to_address TEXT,
-            cargo_type TEXT,
-            car_type TEXT,
-            cargo_weight NUMERIC,
-            date TEXT,
-            status TEXT DEFAULT 'pending_fee',
-            driver_id BIGINT,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            customer_username TEXT,
-            customer_phone TEXT,
-            commission INTEGER,
-            creator_role TEXT DEFAULT 'customer'
-        )""")
-        await conn.execute("""
-        CREATE TABLE IF NOT EXISTS receipts(
-            id SERIAL PRIMARY KEY,
-            driver_id BIGINT,
-            file_id TEXT,
-            status TEXT DEFAULT 'pending',
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )""")
+    # versiyalangan migratsiyalar (migrations/*.sql); sxema joriy bo'lsa bitta SELECT, DDL yo'q
+    with startup_phase("schema"):
+        applied = await migrate.migrate(pool)
+    if applied:
+        logging.info("migrations applied: %s", applied)
     # pool ready
     return pool
 
@@ -154,6 +241,7 @@ def driver_menu_kb():
             [KeyboardButton(text="📝 Янгидан буюртма")],
             [KeyboardButton(text="📜 Бўш буюртмалар")],
             [KeyboardButton(text="📝 Профиль"), KeyboardButton(text="💳 Баланс тўлдириш (квитансия)")],
+            [KeyboardButton(text="📍 Локацияни юбориш", request_location=True)],
             [KeyboardButton(text="📞 Админ билан боғланиш")],
             [KeyboardButton(text="🏠 Бош меню")]
         ],
@@ -175,6 +263,9 @@ def admin_menu_kb():
 def phone_request_kb():
     return ReplyKeyboardMarkup(keyboard=[[KeyboardButton(text="📱 Телефон рақамни юбориш", request_contact=True)]], resize_keyboard=True)
 
+def pickup_location_kb():
+    return ReplyKeyboardMarkup(keyboard=[[KeyboardButton(text="📍 Жойлашувни юбориш", request_location=True)]], resize_keyboard=True)
+
 
 # --------------------------
 # FSM STATES
@@ -207,16 +298,8 @@ async def customer_fullname(message: Message, state: FSMContext):
     username = message.from_user.username
 
     async with pool.acquire() as conn:
-        # insert or update customer
-        await conn.execute("""
-            INSERT INTO customers (user_id, username, phone, full_name, status)
-            VALUES($1, $2, $3, $4, 'active')
-            ON CONFLICT (user_id) DO UPDATE
-              SET username = EXCLUDED.username,
-                  phone = EXCLUDED.phone,
-                  full_name = EXCLUDED.full_name,
-                  status = COALESCE(customers.status, 'active')
-        """, user_id, f"@{username}" if username else None, phone, full_name)
+        await repo.upsert_customer_profile(conn, user_id, f"@{username}" if username else None, phone, full_name)
+    cache.customers.invalidate(user_id)
 
     await message.answer("✅ Сиз мижоз сифатида рўйхатдан ўтдингиз!", reply_markup=customer_menu_kb())
     await state.clear()
@@ -277,75 +360,266 @@ class Broadcast(StatesGroup):
 # --------------------------
 # HELPERS
 # --------------------------
-async def list_active_driver_ids() -> list:
-    async with pool.acquire() as conn:
-        rows = await conn.fetch("SELECT driver_id FROM drivers WHERE status='active'")
-        return [r["driver_id"] for r in rows]
-
-async def push_new_order_to_drivers(order_row):
-    fee = order_row["commission"] or 0
-    kb = InlineKeyboardMarkup(inline_keyboard=[[InlineKeyboardButton(text="✅ Қабул қилиш", callback_data=f"accept:{order_row['id']}"),
-                                               InlineKeyboardButton(text="❌ Рад этиш", callback_data=f"reject:{order_row['id']}")]])
+async def get_driver(user_id: int):
+    # keshdan, bo'lmasa DB dan (yo'q bo'lsa None ham keshlanadi)
+    row = cache.drivers.get(user_id)
+    if row is cache.MISSING:
+        token = cache.drivers.begin(user_id)
+        async with pool.acquire() as conn:
+            row = await repo.get_driver(conn, user_id)
+        cache.drivers.set(user_id, row, token)
+    return row
+
+async def get_customer(user_id: int):
+    row = cache.customers.get(user_id)
+    if row is cache.MISSING:
+        token = cache.customers.begin(user_id)
+        async with pool.acquire() as conn:
+            row = await repo.get_customer(conn, user_id)
+        cache.customers.set(user_id, row, token)
+    return row
+
+async def push_new_order_to_drivers(order: repo.Order):
+    fee = order.commission or 0
+    kb = InlineKeyboardMarkup(inline_keyboard=[[InlineKeyboardButton(text="✅ Қабул қилиш", callback_data=f"accept:{order.id}"),
+                                               InlineKeyboardButton(text="❌ Рад этиш", callback_data=f"reject:{order.id}")]])
     text = (
         f"📢 <b>Янги буюртма!</b>\n\n"
-        f"🆔 {order_row['id']} | {order_row['date']}\n"
-        f"📍 {order_row['from_address']} ➜ {order_row['to_address']}\n"
-        f"📦 {order_row['cargo_type']}\n"
-        f"🚘 {order_row['car_type']}\n"
-        f"⚖️ {order_row['cargo_weight']} кг\n"
+        f"🆔 {order.id} | {order.date}\n"
+        f"📍 {order.from_address} ➜ {order.to_address}\n"
+        f"📦 {order.cargo_type}\n"
+        f"🚘 {order.car_type}\n"
+        f"⚖️ {order.cargo_weight} кг\n"
         f"💵 Комиссия: <b>{format_sum(fee)}</b> сўм\n\n"
         f"Биринчи бўлиб қабул қилган ҳайдовчига бириктирилади."
     )
-    for did in await list_active_driver_ids():
+    await driver_index.refresh(pool)
+    targets = driver_index.candidates(order.car_type)
+    nearest = []
+    if order.pickup_lat is not None and len(driver_positions):
+        nearest = driver_positions.nearest(order.pickup_lat, order.pickup_lon, DISPATCH_NEAREST_K,
+                                           allowed=set(targets))
+    balances = None
+    if waves.RANK_BALANCE in DISPATCH_RANK and DISPATCH_WAVES:
+        async with pool.acquire() as conn:
+            balances = await repo.driver_balances(conn, targets)
+    # eng yaqinlar birinchi, qolganlar DISPATCH_RANK bo'yicha; har bir to'lqin ichida ham shu tartib
+    ranked = waves.rank(targets, DISPATCH_RANK, balances=balances, fee=fee, last_seen=last_seen.seen,
+                        first=[did for _, did in nearest])
+    logging.info("order #%s (%s): %s/%s drivers (%s nearest, up to %.1f km)", order.id, order.car_type,
+                 len(ranked), len(driver_index), len(nearest), nearest[-1][0] if nearest else 0.0)
+
+    async def send(driver_ids):
+        # buyurtma olingach offer_retractor shu xabarlardagi tugmalarni olib tashlaydi;
+        # takliflar yuborilishi bilan yoziladi, to'lqin oxirini kutmaydi
+        recorded = offers.OfferBuffer(pool, order.id)
         try:
-            await bot.send_message(did, text, reply_markup=kb)
-        except Exception:
-            pass
-
-def format_order_row(r) -> str:
-    fee = r["commission"] if r["commission"] is not None else "—"
-    driver_line = f"🚖 Haydovchi: {r['driver_id']}" if r["driver_id"] else "🚖 Haydovchi: —"
-    username = r["customer_username"] or "—"
-    phone = r["customer_phone"] or "—"
+            result = await fanout.send_message(bot, driver_ids, text, reply_markup=kb,
+                                               on_sent=lambda chat_id, m: recorded.add(chat_id, m.message_id))
+        finally:
+            await recorded.close()
+        # to'lqin davomida olingan bo'lsa, oxirgi partiyadagi tugmalar ham qaytarib olinsin
+        offer_retractor.wake()
+        return result
+
+    return await wave_scheduler.dispatch(order.id, waves.split_waves(ranked, DISPATCH_WAVES), send)
+
+def order_book_trusted() -> bool:
+    """
+    Boshqa jarayondagi o'zgarishlar faqat bus orqali keladi: bus uzilgan bo'lsa,
+    yoki bus o'chiq (CHANGE_BUS=0) va worker bittadan ko'p bo'lsa DB dan o'qiladi.
+    """
+    if change_bus is not None:
+        return change_bus.connected
+    return SINGLE_PROCESS
+
+async def order_still_open(order_id: int) -> bool:
+    async with pool.acquire() as conn:
+        return await repo.get_order_status(conn, order_id) == "open"
+
+def format_order_row(r: repo.Order) -> str:
+    fee = r.commission if r.commission is not None else "—"
+    driver_line = f"🚖 Haydovchi: {r.driver_id}" if r.driver_id else "🚖 Haydovchi: —"
+    username = r.customer_username or "—"
+    phone = r.customer_phone or "—"
     return (
-        f"🆔 {r['id']} | {r['date']}\n"
-        f"   {r['from_address']} ➜ {r['to_address']}\n"
-        f"📦 {r['cargo_type']}\n"
-        f"🚘 {r['car_type']}\n"
-        f"⚖️ {r['cargo_weight']} кг\n"
-        f"📊 Холат: {r['status']}\n"
+        f"🆔 {r.id} | {r.date}\n"
+        f"   {r.from_address} ➜ {r.to_address}\n"
+        f"📦 {r.cargo_type}\n"
+        f"🚘 {r.car_type}\n"
+        f"⚖️ {r.cargo_weight} кг\n"
+        f"📊 Холат: {r.status}\n"
         f"💸 Комиссия: {format_sum(fee)}\n"
         f"👤 {username}\n"
         f"📞 {phone}\n"
         f"{driver_line}"
     )
 
-async def top_up_balance_and_notify(driver_id: int, amount: int):
+# --------------------------
+# PAGINATION (keyset, bitta xabar = bitta sahifa)
+# --------------------------
+PAGE_SIZE = 10
+# view -> (record, jadval, kalit, filtr)
+PAGE_VIEWS = {
+    "drv": (repo.Driver, "drivers", "driver_id", None),
+    "cust": (repo.Customer, "customers", "user_id", None),
+    "ord": (repo.Order, "orders", "id", None),
+    "free": (repo.Order, "orders", "id", "status='open'"),
+}
+PAGE_TITLES = {
+    "drv": "🚖 <b>Ҳайдовчилар</b>",
+    "cust": "👥 <b>Мижозлар</b>",
+    "ord": "📊 <b>Барча буюртмалар</b>",
+    "free": "📜 <b>Бўш буюртмалар</b>",
+}
+
+def format_driver_short(r: repo.Driver) -> str:
+    return (
+        f"🆔 {r.driver_id} | 📱 {r.username or '—'} | 📞 {r.phone or '—'}\n"
+        f"💰 {format_sum(int(r.balance or 0))} сўм | 💤 <b>{r.status or 'active'}</b>\n"
+        f"👤 {r.full_name or '—'} | 🚘 {r.car_model or '—'}"
+    )
+
+def format_customer_short(r: repo.Customer) -> str:
+    return (
+        f"🆔 {r.user_id} | 📱 {r.username or '—'} | 📞 {r.phone or '—'}\n"
+        f"💤 <b>{r.status or 'active'}</b>"
+    )
+
+def page_row_button(view: str, r):
+    if view == "drv":
+        if (r.status or "active") == "active":
+            return InlineKeyboardButton(text=f"🔒 {r.driver_id}", callback_data=f"drv_block:{r.driver_id}")
+        return InlineKeyboardButton(text=f"✅ {r.driver_id}", callback_data=f"drv_unblock:{r.driver_id}")
+    if view == "cust":
+        if (r.status or "active") == "active":
+            return InlineKeyboardButton(text=f"🔒 {r.user_id}", callback_data=f"cust_block:{r.user_id}")
+        return InlineKeyboardButton(text=f"✅ {r.user_id}", callback_data=f"cust_unblock:{r.user_id}")
+    if view == "free":
+        return InlineKeyboardButton(text=f"✅ #{r.id} Қабул қилиш", callback_data=f"accept:{r.id}")
+    return None
+
+async def render_page(view: str, anchor: int = None, direction: str = "next"):
+    """
+    Returns (text, kb) yoki sahifa bo'sh bo'lsa (None, None).
+    """
+    record, table, key, where = PAGE_VIEWS[view]
+    # "at": joriy sahifa joyida qayta chiziladi — undan yangiroq qator bo'lmasa ⬅️ hech qayerga olib bormaydi
+    has_newer = None
+    if view == "free" and order_book_trusted():
+        rows, has_more = order_book.page(anchor, direction, PAGE_SIZE)
+        if direction == "at":
+            has_newer = order_book.has_newer(anchor)
+    else:
+        async with pool.acquire() as conn:
+            rows, has_more = await repo.keyset_page(conn, record, table, key, where,
+                                                    anchor=anchor, direction=direction, limit=PAGE_SIZE)
+            if direction == "at" and rows:
+                has_newer = await repo.keyset_has_newer(conn, table, key, where, anchor)
+    if not rows:
+        return None, None
+    if direction == "prev":
+        has_prev, has_next = has_more, True
+    elif direction == "at":
+        has_prev, has_next = has_newer, has_more
+    else:
+        has_prev, has_next = anchor is not None, has_more
+
+    fmt = {"drv": format_driver_short, "cust": format_customer_short}.get(view, format_order_row)
+    text = PAGE_TITLES[view] + "\n\n" + "\n\n".join(fmt(r) for r in rows)
+
+    buttons = [b for b in (page_row_button(view, r) for r in rows) if b]
+    kb_rows = [buttons[i:i + 2] for i in range(0, len(buttons), 2)] if view in ("drv", "cust") else [[b] for b in buttons]
+    first, last = getattr(rows[0], key), getattr(rows[-1], key)
+    nav = []
+    if has_prev:
+        nav.append(InlineKeyboardButton(text="⬅️", callback_data=f"pg:{view}:p:{first}"))
+    # 🔄 joriy sahifani qayta chizadi (blok/qabul qilishdan keyin ham shu ishlatiladi)
+    nav.append(InlineKeyboardButton(text="🔄", callback_data=f"pg:{view}:r:{first}"))
+    if has_next:
+        nav.append(InlineKeyboardButton(text="➡️", callback_data=f"pg:{view}:n:{last}"))
+    kb_rows.append(nav)
+    return text, InlineKeyboardMarkup(inline_keyboard=kb_rows)
+
+def find_page_refresh(markup):
+    """
+    Xabar ro'yxat sahifasi bo'lsa (view, anchor) qaytaradi.
+    """
+    if not markup:
+        return None
+    for row in markup.inline_keyboard:
+        for b in row:
+            if b.callback_data and b.callback_data.startswith("pg:"):
+                _, view, action, anchor = b.callback_data.split(":")
+                if action == "r":
+                    return view, int(anchor)
+    return None
+
+async def remember_free_page(chat_id: int, message_id: int, kb):
+    """"Бўш буюртмалар" sahifasidagi buyurtma olinganda offer_retractor sahifani qayta chizadi."""
+    page = find_page_refresh(kb)
+    if not page or page[0] != "free":
+        return
+    order_ids = [int(b.callback_data.split(":")[1]) for row in kb.inline_keyboard for b in row
+                 if b.callback_data and b.callback_data.startswith("accept:")]
     async with pool.acquire() as conn:
-        await conn.execute("UPDATE drivers SET balance = COALESCE(balance,0) + $1 WHERE driver_id=$2", amount, driver_id)
-        row = await conn.fetchrow("SELECT balance FROM drivers WHERE driver_id=$1", driver_id)
-        new_bal_value = int(row["balance"]) if row and row["balance"] is not None else amount
+        await offers.record_page(conn, chat_id, message_id, page[1], order_ids)
+
+async def refresh_free_page(chat_id: int, message_id: int, anchor: int):
+    text, kb = await render_page("free", anchor, "at")
+    if text is None:
+        text, kb = await render_page("free")
+    if text is None:
+        await bot.edit_message_text("📭 Ҳозирча бўш буюртма йўқ.", chat_id=chat_id, message_id=message_id)
+        return
+    await bot.edit_message_text(text, chat_id=chat_id, message_id=message_id, reply_markup=kb)
+    await remember_free_page(chat_id, message_id, kb)
+
+async def refresh_or_strip_markup(callback: CallbackQuery):
+    """
+    Sahifa xabarini joyida yangilaydi; oddiy xabarda esa tugmalarni olib tashlaydi.
+    """
+    page = find_page_refresh(callback.message.reply_markup if callback.message else None)
     try:
-        await bot.send_message(driver_id, f"💳 <b>Balansingiz to‘ldirildi!</b>\n\nSizga +<b>{format_sum(amount)}</b> сўм қўшилди ✅\n📊 Жорий баланс: <b>{new_bal_value}</b> сўм")
+        if page:
+            view, anchor = page
+            text, kb = await render_page(view, anchor, "at")
+            if text is None:
+                text, kb = await render_page(view)
+            if text is None:
+                await callback.message.edit_text("📭 Бўш.")
+            else:
+                await callback.message.edit_text(text, reply_markup=kb)
+                await remember_free_page(callback.message.chat.id, callback.message.message_id, kb)
+        else:
+            await callback.message.edit_reply_markup(reply_markup=None)
     except Exception:
         pass
 
+async def top_up_balance_and_notify(driver_id: int, amount: int):
+    async with pool.acquire() as conn:
+        async with conn.transaction():
+            new_balance = await repo.add_driver_balance(conn, driver_id, amount, repo.LEDGER_ADMIN_TOPUP)
+            new_bal_value = int(new_balance) if new_balance is not None else amount
+            await outbox.enqueue(conn, driver_id, f"💳 <b>Balansingiz to‘ldirildi!</b>\n\nSizga +<b>{format_sum(amount)}</b> сўм қўшилди ✅\n📊 Жорий баланс: <b>{new_bal_value}</b> сўм")
+    cache.drivers.invalidate(driver_id)
+    outbox_dispatcher.wake()
+
 # --------------------------
 # START HANDLER
 # --------------------------
 @router.message(CommandStart())
 async def start_cmd(message: Message, state: FSMContext):
     await state.clear()
-    async with pool.acquire() as conn:
-        driver = await conn.fetchrow("SELECT * FROM drivers WHERE driver_id=$1", message.from_user.id)
-        customer = await conn.fetchrow("SELECT * FROM customers WHERE user_id=$1", message.from_user.id)
-
     if message.from_user.id in ADMIN_IDS:
         await message.answer("<b>👑 Админ интерфейс</b>\n\nАдмин менюдан бирор бўлимни танланг:", reply_markup=admin_menu_kb())
         return
 
+    driver = await get_driver(message.from_user.id)
+    customer = None if driver else await get_customer(message.from_user.id)
+
     if driver:
-        if driver["status"] == "blocked":
+        if driver.status == "blocked":
             await message.answer("❗ Сиз ҳозирча блоклангансиз. Илтимос админ билан боғланинг.")
             return
         await message.answer("👋 Салом, ҳайдовчи!", reply_markup=driver_menu_kb())
@@ -363,15 +637,15 @@ async def start_cmd(message: Message, state: FSMContext):
 @router.message(F.text == "👤 Мижоз")
 async def role_customer(message: Message):
     async with pool.acquire() as conn:
-        await conn.execute("INSERT INTO customers(user_id, username, phone, status) VALUES($1,$2,$3,$4) ON CONFLICT (user_id) DO NOTHING",
-                           message.from_user.id, f"@{message.from_user.username}" if message.from_user.username else None, None, "active")
+        await repo.ensure_customer(conn, message.from_user.id,
+                                   f"@{message.from_user.username}" if message.from_user.username else None)
+    cache.customers.invalidate(message.from_user.id)
     await message.answer("✅ Сиз мижоз сифатида рўйхатдан ўтдингиз!", reply_markup=customer_menu_kb())
 
 @router.message(F.text == "🚖 Ҳайдовчи")
 async def role_driver(message: Message, state: FSMContext):
-    async with pool.acquire() as conn:
-        drv = await conn.fetchrow("SELECT status FROM drivers WHERE driver_id=$1", message.from_user.id)
-    if drv and drv["status"] == "blocked":
+    drv = await get_driver(message.from_user.id)
+    if drv and drv.status == "blocked":
         await message.answer("❗ Сиз блоклангансиз. Админга мурожаат қилинг.")
         return
     await state.set_state(DriverRegistration.ask_phone)
@@ -413,21 +687,12 @@ async def driver_choose_car(callback: CallbackQuery, state: FSMContext):
         phone = data.get("phone")
         full_name = data.get("full_name")
         async with pool.acquire() as conn:
-            # upsert driver
-            await conn.execute("""
-                INSERT INTO drivers(driver_id, username, phone, full_name, car_model, balance, status)
-                VALUES($1,$2,$3,$4,$5,$6,$7)
-                ON CONFLICT (driver_id) DO UPDATE SET
-                    username = EXCLUDED.username,
-                    phone = EXCLUDED.phone,
-                    full_name = EXCLUDED.full_name,
-                    car_model = EXCLUDED.car_model
-            """, callback.from_user.id, uname, phone, full_name, choice, 99000, "active")
-        for aid in ADMIN_IDS:
-            try:
-                await bot.send_message(aid, f"🚨 Янги ҳайдовчи рўйхатдан ўтди:\n 📱 {uname or callback.from_user.id}\n 🆔 ID: {callback.from_user.id}\n👤 {full_name}\n🚘 {choice}")
-            except Exception:
-                pass
+            async with conn.transaction():
+                status = await repo.upsert_driver(conn, callback.from_user.id, uname, phone, full_name, choice, 99000)
+                await outbox.enqueue_many(conn, ADMIN_IDS, f"🚨 Янги ҳайдовчи рўйхатдан ўтди:\n 📱 {uname or callback.from_user.id}\n 🆔 ID: {callback.from_user.id}\n👤 {full_name}\n🚘 {choice}")
+        cache.drivers.invalidate(callback.from_user.id)
+        driver_index.update(callback.from_user.id, choice, status)
+        outbox_dispatcher.wake()
         await state.clear()
         await callback.message.answer(f"✅ Рўйхатдан ўтдингиз!\n👤 {full_name}\n🚘 {choice}\n💰 Bonus: 99 000 сўм", reply_markup=driver_menu_kb())
     await callback.answer()
@@ -440,20 +705,12 @@ async def driver_custom_car(message: Message, state: FSMContext):
     phone = data.get("phone")
     full_name = data.get("full_name")
     async with pool.acquire() as conn:
-        await conn.execute("""
-            INSERT INTO drivers(driver_id, username, phone, full_name, car_model, balance, status)
-            VALUES($1,$2,$3,$4,$5,$6,$7)
-            ON CONFLICT (driver_id) DO UPDATE SET
-                username = EXCLUDED.username,
-                phone = EXCLUDED.phone,
-                full_name = EXCLUDED.full_name,
-                car_model = EXCLUDED.car_model
-        """, message.from_user.id, uname, phone, full_name, car_model, 99000, "active")
-    for aid in ADMIN_IDS:
-        try:
-            await bot.send_message(aid, f"🚨 Янги ҳайдовчи рўйхатдан ўтди: 📱 @{uname or message.from_user.id}\n 🆔 ID: {message.from_user.id}\n👤 {full_name}\n🚘 {car_model}")
-        except Exception:
-            pass
+        async with conn.transaction():
+            status = await repo.upsert_driver(conn, message.from_user.id, uname, phone, full_name, car_model, 99000)
+            await outbox.enqueue_many(conn, ADMIN_IDS, f"🚨 Янги ҳайдовчи рўйхатдан ўтди: 📱 @{uname or message.from_user.id}\n 🆔 ID: {message.from_user.id}\n👤 {full_name}\n🚘 {car_model}")
+    cache.drivers.invalidate(message.from_user.id)
+    driver_index.update(message.from_user.id, car_model, status)
+    outbox_dispatcher.wake()
     await state.clear()
     await message.answer(f"✅ Рўйхатдан ўтдингиз!\n👤 {full_name}\n🚘 {car_model}\n💰 Bonus: 99 000 сўм", reply_markup=driver_menu_kb())
 
@@ -462,19 +719,26 @@ async def driver_custom_car(message: Message, state: FSMContext):
 # --------------------------
 @router.message(F.text == "📝 Янгидан буюртма")
 async def new_order(message: Message, state: FSMContext):
-    async with pool.acquire() as conn:
-        drv = await conn.fetchrow("SELECT status FROM drivers WHERE driver_id=$1", message.from_user.id)
-        cust = await conn.fetchrow("SELECT status FROM customers WHERE user_id=$1", message.from_user.id)
-    if drv and drv["status"] == "blocked":
+    drv = await get_driver(message.from_user.id)
+    cust = await get_customer(message.from_user.id)
+    if drv and drv.status == "blocked":
         await message.answer("❗ Сиз блокланган ҳайдовчисиз. Админга мурожаат қилинг.")
         return
-    if cust and cust["status"] == "blocked":
+    if cust and cust.status == "blocked":
         await message.answer("❗ Сиз блоклангансиз. Админга мурожаат қилинг.")
         return
     creator_role = "driver" if drv else "customer"
     await state.update_data(creator_role=creator_role)
     await state.set_state(NewOrder.from_address)
-    await message.answer("📍 Қаердан юк олинади? Манзилни киритинг:", reply_markup=ReplyKeyboardRemove())
+    await message.answer("📍 Қаердан юк олинади? Манзилни киритинг ёки жойлашувни юборинг:",
+                         reply_markup=pickup_location_kb())
+
+@router.message(NewOrder.from_address, F.location)
+async def order_from_location(message: Message, state: FSMContext):
+    # nuqta yaqin haydovchilarni topish uchun; manzil matni baribir so'raladi
+    await state.update_data(pickup_lat=message.location.latitude, pickup_lon=message.location.longitude)
+    await message.answer("✅ Жойлашув олинди. Энди манзилни матн билан киритинг (шаҳар, кўча):",
+                         reply_markup=ReplyKeyboardRemove())
 
 @router.message(NewOrder.from_address, F.text)
 async def order_from(message: Message, state: FSMContext):
@@ -484,7 +748,7 @@ async def order_from(message: Message, state: FSMContext):
         return
     await state.update_data(from_address=text)
     await state.set_state(NewOrder.to_address)
-    await message.answer("📍 Қаерга юборилади? Манзилни киритинг:")
+    await message.answer("📍 Қаерга юборилади? Манзилни киритинг:", reply_markup=ReplyKeyboardRemove())
 
 @router.message(NewOrder.to_address, F.text)
 async def order_to(message: Message, state: FSMContext):
@@ -507,8 +771,7 @@ async def order_cargo(message: Message, state: FSMContext):
 async def order_car(message: Message, state: FSMContext):
     if message.text == "⬅️ Бекор қилиш":
         await state.clear()
-        async with pool.acquire() as conn:
-            drv = await conn.fetchrow("SELECT * FROM drivers WHERE driver_id=$1", message.from_user.id)
+        drv = await get_driver(message.from_user.id)
         await message.answer("❌ Буюртма бекор қилинди.", reply_markup=driver_menu_kb() if drv else customer_menu_kb())
         return
     if message.text not in ["🚐 Лабо", "🚛 Бонго", "🚚 Исузи"]:
@@ -549,44 +812,63 @@ async def order_phone(message: Message, state: FSMContext):
     creator_role = data.get("creator_role", "customer")
 
     async with pool.acquire() as conn:
-        # Use RETURNING id to obtain order id
-        rec = await conn.fetchrow("""
-            INSERT INTO orders(customer_id, from_address, to_address, cargo_type, car_type, cargo_weight, date, status, customer_username, customer_phone, creator_role)
-            VALUES($1,$2,$3,$4,$5,$6,$7,$8,$9,$10,$11)
-            RETURNING id
-        """, message.from_user.id, data["from_address"], data["to_address"], data["cargo_type"], data["car_type"], data["cargo_weight"], now, "pending_fee", customer_username, phone, creator_role)
-        order_id = rec["id"] if rec else None
-
-        # upsert customer record
-        await conn.execute("""
-            INSERT INTO customers(user_id, username, phone, status)
-            VALUES($1,$2,$3, COALESCE((SELECT status FROM customers WHERE user_id=$1), 'active'))
-            ON CONFLICT (user_id) DO UPDATE SET
-                username = EXCLUDED.username,
-                phone = EXCLUDED.phone
-        """, message.from_user.id, customer_username, phone)
+        async with conn.transaction():
+            order = await repo.create_order(conn, message.from_user.id, data["from_address"], data["to_address"],
+                                            data["cargo_type"], data["car_type"], data["cargo_weight"], now,
+                                            customer_username, phone, creator_role,
+                                            data.get("pickup_lat"), data.get("pickup_lon"))
+            await repo.upsert_customer_contact(conn, message.from_user.id, customer_username, phone)
+            text_admin = (
+                f"🆕 <b>Янги буюртма!</b>\n\n"
+                f"🆔 {order.id} | {order.date}\n"
+                f"📍 {order.from_address} ➜ {order.to_address}\n"
+                f"📦 {order.cargo_type}\n"
+                f"🚘 {order.car_type}\n"
+                f"⚖️ {order.cargo_weight} кг\n"
+                f"👤 {order.customer_username}\n"
+                f"📞 {order.customer_phone}\n\n"
+                f"Комиссияни танланг:"
+            )
+            await outbox.enqueue_many(conn, ADMIN_IDS, text_admin, reply_markup=commission_kb(order.id),
+                                      dedup_key=f"order_new:{order.id}")
+    cache.customers.invalidate(message.from_user.id)
+    outbox_dispatcher.wake()
 
     await state.clear()
+    order_id = order.id
     await message.answer(f"✅ Буюртмангиз #{order_id} қабул қилинди!\nАдмин томонидан комиссия белгиланади.", reply_markup=driver_menu_kb() if creator_role=="driver" else customer_menu_kb())
 
-    async with pool.acquire() as conn:
-        order = await conn.fetchrow("SELECT * FROM orders WHERE id=$1", order_id)
-    text_admin = (
-        f"🆕 <b>Янги буюртма!</b>\n\n"
-        f"🆔 {order['id']} | {order['date']}\n"
-        f"📍 {order['from_address']} ➜ {order['to_address']}\n"
-        f"📦 {order['cargo_type']}\n"
-        f"🚘 {order['car_type']}\n"
-        f"⚖️ {order['cargo_weight']} кг\n"
-        f"👤 {order['customer_username']}\n"
-        f"📞 {order['customer_phone']}\n\n"
-        f"Комиссияни танланг:"
-    )
-    for aid in ADMIN_IDS:
-        try:
-            await bot.send_message(aid, text_admin, reply_markup=commission_kb(order_id))
-        except Exception:
-            pass
+# --------------------------
+# DRIVER LOCATION (oddiy va live location)
+# --------------------------
+async def save_driver_location(driver_id: int, lat: float, lon: float) -> bool:
+    """Indeksni yangilaydi; DB ga LOCATION_SAVE_EVERY da bir marta yozadi. Haydovchi bo'lmasa False."""
+    drv = await get_driver(driver_id)
+    if not drv or drv.status != "active":
+        return False
+    driver_positions.update(driver_id, lat, lon)
+    now = time.monotonic()
+    if now - _location_saved.get(driver_id, 0.0) >= LOCATION_SAVE_EVERY:
+        _location_saved[driver_id] = now
+        async with pool.acquire() as conn:
+            await repo.set_driver_location(conn, driver_id, lat, lon)
+    return True
+
+@router.message(F.location)
+async def driver_location(message: Message):
+    loc = message.location
+    if not await save_driver_location(message.from_user.id, loc.latitude, loc.longitude):
+        await message.answer("❌ Жойлашув фақат фаол ҳайдовчилар учун сақланади.")
+        return
+    if loc.live_period:
+        await message.answer("📍 Жонли локация уланди. Яқин буюртмалар сизга биринчи юборилади.", reply_markup=driver_menu_kb())
+    else:
+        await message.answer("📍 Локация сақланди. Яқин буюртмалар сизга биринчи юборилади.", reply_markup=driver_menu_kb())
+
+@router.edited_message(F.location)
+async def driver_live_location(message: Message):
+    # live location yangilanishi: javob yozilmaydi
+    await save_driver_location(message.from_user.id, message.location.latitude, message.location.longitude)
 
 # --------------------------
 # ADMIN set commission
@@ -603,21 +885,21 @@ async def set_fee(callback: CallbackQuery):
         await callback.answer("Нотўғри маълумот.", show_alert=True)
         return
     async with pool.acquire() as conn:
-        row = await conn.fetchrow("SELECT * FROM orders WHERE id=$1", order_id)
-        if not row:
+        order = await repo.set_order_fee(conn, order_id, fee)
+        if order is None:
+            current = await repo.get_order(conn, order_id)
+    if order is None:
+        if current is None:
             await callback.answer("Буюртма топилмади.", show_alert=True)
-            return
-        if row["status"] != "pending_fee":
+        else:
             await callback.answer("Комиссия аллақачон белгиланган.", show_alert=True)
-            return
-        await conn.execute("UPDATE orders SET commission=$1, status='open' WHERE id=$2", fee, order_id)
+        return
+    order_book.put(order)
     await callback.answer("Комиссия ўрнатилди ва ҳайдовчиларга юборилди.", show_alert=True)
     try:
         await callback.message.edit_reply_markup(reply_markup=None)
     except Exception:
         pass
-    async with pool.acquire() as conn:
-        order = await conn.fetchrow("SELECT * FROM orders WHERE id=$1", order_id)
     await push_new_order_to_drivers(order)
 
 # --------------------------
@@ -625,78 +907,89 @@ async def set_fee(callback: CallbackQuery):
 # --------------------------
 @router.message(F.text == "📜 Бўш буюртмалар")
 async def free_orders(message: Message):
-    async with pool.acquire() as conn:
-        d = await conn.fetchrow("SELECT status FROM drivers WHERE driver_id=$1", message.from_user.id)
+    d = await get_driver(message.from_user.id)
     if not d:
         await message.answer("❌ Ҳайдовчи сифатида рўйхатдан ўтинг.", reply_markup=role_kb())
         return
-    if d["status"] == "blocked":
+    if d.status == "blocked":
         await message.answer("❗ Сиз блоклангансиз. Админга мурожаат қилинг.")
         return
-    async with pool.acquire() as conn:
-        rows = await conn.fetch("SELECT * FROM orders WHERE status='open' ORDER BY id DESC LIMIT 20")
-    if not rows:
+    text, kb = await render_page("free")
+    if text is None:
         await message.answer("📭 Ҳозирча бўш буюртма йўқ.")
         return
-    for r in rows:
-        kb = InlineKeyboardMarkup(inline_keyboard=[[InlineKeyboardButton(text="✅ Қабул қилиш", callback_data=f"accept:{r['id']}"),
-            InlineKeyboardButton(text="❌ Рад этиш", callback_data=f"reject:{r['id']}")]])
-        await message.answer(format_order_row(r), reply_markup=kb)
+    sent = await message.answer(text, reply_markup=kb)
+    await remember_free_page(sent.chat.id, sent.message_id, kb)
 
 @router.callback_query(F.data.startswith("accept:"))
 async def accept_order(callback: CallbackQuery):
     order_id = int(callback.data.split(":")[1])
-    async with pool.acquire() as conn:
-        d = await conn.fetchrow("SELECT balance, phone, username, status FROM drivers WHERE driver_id=$1", callback.from_user.id)
-        order = await conn.fetchrow("SELECT * FROM orders WHERE id=$1", order_id)
-    if not d:
-        await callback.answer("❌ Ҳайдовчи сифатида рўйхатдан ўтинг.", show_alert=True); return
-    if d["status"] == "blocked":
+    d = await get_driver(callback.from_user.id)
+    if not d or d.status == "blocked":
+        # ro'yxatdan o'tgach / blokdan chiqqach qayta bosish ishlashi kerak
+        callback_idem.no_replay(callback.id)
+        if not d:
+            await callback.answer("❌ Ҳайдовчи сифатида рўйхатдан ўтинг.", show_alert=True); return
         await callback.answer("❗ Сиз блоклангансиз.", show_alert=True); return
-    if not order or order["status"] != "open":
+    # olingan buyurtmaning eski tugmasi: DB ga bormaymiz
+    if order_id not in order_book and order_book_trusted():
         await callback.answer("❌ Буюртма қолмаган ёки олган.", show_alert=True); return
 
-    fee = int(order["commission"] or 0)
-    if (d["balance"] or 0) < fee:
-        await callback.answer(f"❌ Балансингиз етарли эмас. Керак: {format_sum(fee)} сўм.", show_alert=True); return
-
-    # Assign order to driver atomically
+    # balans, status va buyurtma bitta atomar statementda tekshiriladi
     async with pool.acquire() as conn:
-        # ensure still open
-        row = await conn.fetchrow("SELECT status FROM orders WHERE id=$1", order_id)
-        if not row or row["status"] != "open":
-            await callback.answer("❌ Кечикдингиз, буюртма банд бўлди.", show_alert=True); return
-        await conn.execute("UPDATE orders SET status='taken', driver_id=$1 WHERE id=$2 AND status='open'", callback.from_user.id, order_id)
-        await conn.execute("UPDATE drivers SET balance = balance - $1 WHERE driver_id=$2", fee, callback.from_user.id)
+        async with conn.transaction():
+            res = await repo.accept_order(conn, callback.from_user.id, order_id)
+            if res.outcome == repo.ACCEPTED:
+                await enqueue_accept_notifications(conn, res, callback.from_user.id)
+    outcome, order = res.outcome, res.order
+    if outcome in (repo.ACCEPTED, repo.NOT_OPEN, repo.TOO_LATE):
+        order_book.remove(order_id)
+    if outcome != repo.ACCEPTED:
+        cache.drivers.invalidate(callback.from_user.id)
+        if outcome in (repo.NOT_DRIVER, repo.BLOCKED, repo.NO_BALANCE):
+            # balans to'ldirilsa / holat o'zgarsa keyingi bosish qayta tekshiriladi
+            callback_idem.no_replay(callback.id)
+        if outcome == repo.NOT_DRIVER:
+            await callback.answer("❌ Ҳайдовчи сифатида рўйхатдан ўтинг.", show_alert=True)
+        elif outcome == repo.BLOCKED:
+            await callback.answer("❗ Сиз блоклангансиз.", show_alert=True)
+        elif outcome == repo.NOT_OPEN:
+            await callback.answer("❌ Буюртма қолмаган ёки олган.", show_alert=True)
+        elif outcome == repo.NO_BALANCE:
+            await callback.answer(f"❌ Балансингиз етарли эмас. Керак: {format_sum(res.fee)} сўм.", show_alert=True)
+        else:
+            await callback.answer("❌ Кечикдингиз, буюртма банд бўлди.", show_alert=True)
+        return
+    cache.drivers.invalidate(callback.from_user.id)
+    wave_scheduler.cancel(order_id)
+    outbox_dispatcher.wake()
+    offer_retractor.wake()
 
     await callback.answer("✅ Буюртма қабул қилинди!", show_alert=True)
-    try:
-        await callback.message.edit_reply_markup(reply_markup=None)
-    except Exception:
-        pass
+    await refresh_or_strip_markup(callback)
 
+
+async def enqueue_accept_notifications(conn, res: repo.AcceptResult, driver_id: int):
+    order = res.order
     # notify customer
-    try:
-        await bot.send_message(
-            order["customer_id"],
-            f"✅ Сизнинг буюртмангиз #{order_id} ҳайдовчи томонидан қабул қилинди!\n👤 {d['username'] or callback.from_user.id}\n📞 {d['phone'] or '—'}"
-        )
-    except Exception:
-        pass
+    await outbox.enqueue(
+        conn, order.customer_id,
+        f"✅ Сизнинг буюртмангиз #{order.id} ҳайдовчи томонидан қабул қилинди!\n👤 {res.driver_username or driver_id}\n📞 {res.driver_phone or '—'}",
+        dedup_key=f"order_accepted:{order.id}:customer")
 
     # send details to driver with complete button
     kb = InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="🚚 Buyurtmani yakunlash", callback_data=f"complete:{order_id}")]
+        [InlineKeyboardButton(text="🚚 Buyurtmani yakunlash", callback_data=f"complete:{order.id}")]
     ])
     text_driver = (
         f"🆕 Сизга буюртма бириктирилди!\n\n"
-        f"📍 {order['from_address']} ➜ {order['to_address']}\n"
-        f"📦 {order['cargo_type']}\n"
-        f"⚖️ {order['cargo_weight']} кг\n"
-        f"👤 Buyurtmachi: {order['customer_username'] or '—'}\n"
-        f"📞 Телефон: {order['customer_phone'] or '—'}"
+        f"📍 {order.from_address} ➜ {order.to_address}\n"
+        f"📦 {order.cargo_type}\n"
+        f"⚖️ {order.cargo_weight} кг\n"
+        f"👤 Buyurtmachi: {order.customer_username or '—'}\n"
+        f"📞 Телефон: {order.customer_phone or '—'}"
     )
-    await bot.send_message(callback.from_user.id, text_driver, reply_markup=kb)
+    await outbox.enqueue(conn, driver_id, text_driver, reply_markup=kb, dedup_key=f"order_accepted:{order.id}:driver")
 
 
 @router.callback_query(F.data.startswith("reject:"))
@@ -710,19 +1003,22 @@ async def reject_order(callback: CallbackQuery):
 async def complete_order(callback: CallbackQuery):
     order_id = int(callback.data.split(":")[1])
     async with pool.acquire() as conn:
-        order = await conn.fetchrow("SELECT * FROM orders WHERE id=$1", order_id)
-        if not order:
+        async with conn.transaction():
+            order = await repo.complete_order(conn, order_id, callback.from_user.id)
+            if order is not None:
+                await outbox.enqueue(conn, order.customer_id, f"🚚 Сизнинг буюртмангиз #{order_id} якунланди.",
+                                     dedup_key=f"order_done:{order_id}")
+        if order is None:
+            current = await repo.get_order(conn, order_id)
+    if order is None:
+        if not current:
             await callback.answer("❌ Буюртма топилмади.", show_alert=True); return
-        if order["driver_id"] != callback.from_user.id:
+        if current.driver_id != callback.from_user.id:
             await callback.answer("❌ Фақат ушбу ҳайдовчи якунлайди.", show_alert=True); return
-        if order["status"] != "taken":
-            await callback.answer("❌ Ҳолат мос эмас.", show_alert=True); return
-        await conn.execute("UPDATE orders SET status='done' WHERE id=$1", order_id)
+        await callback.answer("❌ Ҳолат мос эмас.", show_alert=True); return
+    order_book.remove(order_id)
+    outbox_dispatcher.wake()
     await callback.answer("✅ Буюртма якунланди!", show_alert=True)
-    try:
-        await bot.send_message(order["customer_id"], f"🚚 Сизнинг буюртмангиз #{order_id} якунланди.")
-    except Exception:
-        pass
 
 # --------------------------
 # BALANCE & RECEIPTS
@@ -730,8 +1026,7 @@ async def complete_order(callback: CallbackQuery):
 # --- Профиль ---
 @router.message(F.text == "💳 Баланс тўлдириш (квитансия)")
 async def send_receipt_instructions(message: Message):
-    async with pool.acquire() as conn:
-        drv = await conn.fetchrow("SELECT driver_id FROM drivers WHERE driver_id=$1", message.from_user.id)
+    drv = await get_driver(message.from_user.id)
     if not drv and message.from_user.id not in ADMIN_IDS:
         await message.answer("❗ Фақат ҳайдовчилар ва админлар учун.")
         return
@@ -751,30 +1046,56 @@ async def send_receipt_instructions(message: Message):
 
 @router.message(F.photo)
 async def handle_receipt_and_forward(message: Message):
-    async with pool.acquire() as conn:
-        drv = await conn.fetchrow("SELECT driver_id, username FROM drivers WHERE driver_id=$1", message.from_user.id)
+    drv = await get_driver(message.from_user.id)
     if not drv:
         return
-    file_id = message.photo[-1].file_id
+    photo = message.photo[-1]
+    file_id = photo.file_id
+    # aynan o'sha fayl: yuklab olmasdan, adminlarga yubormasdan
     async with pool.acquire() as conn:
-        rec = await conn.fetchrow("INSERT INTO receipts(driver_id, file_id, status) VALUES($1,$2,'pending') RETURNING id", message.from_user.id, file_id)
-        receipt_id = rec["id"] if rec else None
-    caption = (f"🧾 Квитанция #{receipt_id}\n"
-               f"🧑‍✈️ Haydovchi: @{drv['username'] or message.from_user.id}\n"
-               f"📞 ID: {message.from_user.id}\n\n"
-               "Қабул қилинган квитанцияни тасдиқланг ёки рад этинг.")
-    kb = InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="+5 000", callback_data=f"approve_receipt:{receipt_id}:5000"),
-         InlineKeyboardButton(text="+10 000", callback_data=f"approve_receipt:{receipt_id}:10000"),
-         InlineKeyboardButton(text="+15 000", callback_data=f"approve_receipt:{receipt_id}:15000")],
-        [InlineKeyboardButton(text="✍️ Бошқа сумма", callback_data=f"approve_receipt_other:{receipt_id}"),
-         InlineKeyboardButton(text="❌ Рад этиш", callback_data=f"reject_receipt:{receipt_id}")]
-    ])
-    for aid in ADMIN_IDS:
-        try:
-            await bot.send_photo(aid, file_id, caption=caption, reply_markup=kb)
-        except Exception:
-            pass
+        dup = await repo.get_receipt_by_unique_id(conn, photo.file_unique_id)
+    if dup is not None:
+        metrics.RECEIPT_DUPLICATES.labels("exact").inc()
+        await message.answer(f"❗ Бу квитанция аввал юборилган (#{dup.id}, ҳолати: {dup.status}).")
+        return
+    # qayta yuklangan skrinshot: hash uchun eng kichik o'lcham yetarli.
+    # Bir bank ilovasining skrinshotlari bir-biriga o'xshaydi — yaqin hash faqat ogohlantirish, qarorni admin qiladi
+    phash = await receipt_dedup.compute(bot, message.photo[0].file_id)
+    receipt_id = None
+    async with pool.acquire() as conn:
+        near = await receipt_dedup.find_near(conn, phash) if phash is not None else None
+        async with conn.transaction():
+            receipt_id = await repo.create_receipt(conn, message.from_user.id, file_id, photo.file_unique_id, phash)
+            if receipt_id is not None:
+                if phash is not None:
+                    await receipt_dedup.index(conn, receipt_id, phash)
+                warning = ""
+                if near:
+                    distance, prev = near
+                    own_pending = prev["driver_id"] == message.from_user.id and prev["status"] == "pending"
+                    metrics.RECEIPT_DUPLICATES.labels("pending" if own_pending else "near").inc()
+                    warning = (f"\n⚠️ Ўхшаш квитанция: #{prev['id']} ({prev['status']}, ID {prev['driver_id']}), "
+                               f"фарқ {distance}/64\n")
+                caption = (f"🧾 Квитанция #{receipt_id}\n"
+                           f"🧑‍✈️ Haydovchi: @{drv.username or message.from_user.id}\n"
+                           f"📞 ID: {message.from_user.id}\n"
+                           f"{warning}\n"
+                           "Қабул қилинган квитанцияни тасдиқланг ёки рад этинг.")
+                kb = InlineKeyboardMarkup(inline_keyboard=[
+                    [InlineKeyboardButton(text="+5 000", callback_data=f"approve_receipt:{receipt_id}:5000"),
+                     InlineKeyboardButton(text="+10 000", callback_data=f"approve_receipt:{receipt_id}:10000"),
+                     InlineKeyboardButton(text="+15 000", callback_data=f"approve_receipt:{receipt_id}:15000")],
+                    [InlineKeyboardButton(text="✍️ Бошқа сумма", callback_data=f"approve_receipt_other:{receipt_id}"),
+                     InlineKeyboardButton(text="❌ Рад этиш", callback_data=f"reject_receipt:{receipt_id}")]
+                ])
+                await outbox.enqueue_many(conn, ADMIN_IDS, caption, photo=file_id, reply_markup=kb,
+                                          dedup_key=f"receipt_new:{receipt_id}")
+    if receipt_id is None:
+        # file_unique_id poygasi: parallel yuborilgan aynan o'sha fayl
+        metrics.RECEIPT_DUPLICATES.labels("exact").inc()
+        await message.answer("❗ Бу квитанция аввал юборилган.")
+        return
+    outbox_dispatcher.wake()
     await message.answer("📩 Квитанция админга юборилди. Тез орада текширилади.")
 
 def get_driver_info(user_id):
@@ -792,17 +1113,19 @@ async def approve_receipt_fixed(callback: CallbackQuery):
     except Exception:
         await callback.answer("Нотўғри маълумот.", show_alert=True); return
     async with pool.acquire() as conn:
-        rec = await conn.fetchrow("SELECT * FROM receipts WHERE id=$1", receipt_id)
-        if not rec:
+        async with conn.transaction():
+            rec = await repo.approve_receipt(conn, receipt_id, amount, callback.from_user.id)
+            if rec is not None:
+                await outbox.enqueue(conn, rec.driver_id, f"✅ Сиз юборган квитанция тасдиқланди. Балансингизга +{format_sum(amount)} сўм қўшилди.",
+                                     dedup_key=f"receipt_done:{receipt_id}")
+        if rec is None:
+            exists = await repo.get_receipt(conn, receipt_id)
+    if rec is None:
+        if not exists:
             await callback.answer("Квитанция топилмади.", show_alert=True); return
-        if rec["status"] != "pending":
-            await callback.answer("Квитанция аллақачон кўриб чиқилган.", show_alert=True); return
-        await conn.execute("UPDATE receipts SET status='approved' WHERE id=$1", receipt_id)
-        await conn.execute("UPDATE drivers SET balance = COALESCE(balance,0) + $1 WHERE driver_id=$2", amount, rec["driver_id"])
-    try:
-        await bot.send_message(rec["driver_id"], f"✅ Сиз юборган квитанция тасдиқланди. Балансингизга +{format_sum(amount)} сўм қўшилди.")
-    except Exception:
-        pass
+        await callback.answer("Квитанция аллақачон кўриб чиқилган.", show_alert=True); return
+    cache.drivers.invalidate(rec.driver_id)
+    outbox_dispatcher.wake()
     await callback.answer(f"✅ {format_sum(amount)} сўм — қўшилди.", show_alert=True)
     try:
         await callback.message.edit_reply_markup(reply_markup=None)
@@ -839,21 +1162,22 @@ async def receipt_custom_amount_input(message: Message, state: FSMContext):
         await state.clear()
         return
     async with pool.acquire() as conn:
-        rec = await conn.fetchrow("SELECT * FROM receipts WHERE id=$1", receipt_id)
-        if not rec:
+        async with conn.transaction():
+            rec = await repo.approve_receipt(conn, receipt_id, amount, message.from_user.id)
+            if rec is not None:
+                await outbox.enqueue(conn, rec.driver_id, f"✅ Сиз юборган квитанция тасдиқланди. Балансингизга +{format_sum(amount)} сўм қўшилди.",
+                                     dedup_key=f"receipt_done:{receipt_id}")
+        if rec is None:
+            exists = await repo.get_receipt(conn, receipt_id)
+    if rec is None:
+        if not exists:
             await message.answer("Квитанция топилмади.")
-            await state.clear()
-            return
-        if rec["status"] != "pending":
+        else:
             await message.answer("Квитанция аллақачон кўриб чиқилган.")
-            await state.clear()
-            return
-        await conn.execute("UPDATE receipts SET status='approved' WHERE id=$1", receipt_id)
-        await conn.execute("UPDATE drivers SET balance = COALESCE(balance,0) + $1 WHERE driver_id=$2", amount, rec["driver_id"])
-    try:
-        await bot.send_message(rec["driver_id"], f"✅ Сиз юборган квитанция тасдиқланди. Балансингизга +{format_sum(amount)} сўм қўшилди.")
-    except Exception:
-        pass
+        await state.clear()
+        return
+    cache.drivers.invalidate(rec.driver_id)
+    outbox_dispatcher.wake()
     await message.answer(f"✅ Квитанция тасдиқланди ва {format_sum(amount)} сўм қўшилди.")
     await state.clear()
 
@@ -867,16 +1191,18 @@ async def reject_receipt_callback(callback: CallbackQuery):
     except Exception:
         await callback.answer("Нотўғри маълумот.", show_alert=True); return
     async with pool.acquire() as conn:
-        rec = await conn.fetchrow("SELECT * FROM receipts WHERE id=$1", receipt_id)
-        if not rec:
+        async with conn.transaction():
+            rec = await repo.reject_receipt(conn, receipt_id)
+            if rec is not None:
+                await outbox.enqueue(conn, rec.driver_id, "❌ Сиз юборган квитанция рад этилди. Илтимос, қайта юборинг.",
+                                     dedup_key=f"receipt_done:{receipt_id}")
+        if rec is None:
+            exists = await repo.get_receipt(conn, receipt_id)
+    if rec is None:
+        if not exists:
             await callback.answer("Квитанция топилмади.", show_alert=True); return
-        if rec["status"] != "pending":
-            await callback.answer("Квитанция аллақачон кўриб чиқилган.", show_alert=True); return
-        await conn.execute("UPDATE receipts SET status='rejected' WHERE id=$1", receipt_id)
-    try:
-        await bot.send_message(rec["driver_id"], "❌ Сиз юборган квитанция рад этилди. Илтимос, қайта юборинг.")
-    except Exception:
-        pass
+        await callback.answer("Квитанция аллақачон кўриб чиқилган.", show_alert=True); return
+    outbox_dispatcher.wake()
     await callback.answer("❌ Квитанция рад этилди.", show_alert=True)
     try:
         await callback.message.edit_reply_markup(reply_markup=None)
@@ -890,39 +1216,21 @@ async def reject_receipt_callback(callback: CallbackQuery):
 async def all_orders(message: Message):
     if message.from_user.id not in ADMIN_IDS:
         return
-    async with pool.acquire() as conn:
-        rows = await conn.fetch("SELECT * FROM orders ORDER BY id DESC LIMIT 50")
-    if not rows:
+    text, kb = await render_page("ord")
+    if text is None:
         await message.answer("📭 Буюртмалар йўқ.")
         return
-    for r in rows:
-        await message.answer(format_order_row(r))
+    await message.answer(text, reply_markup=kb)
 
 @router.message(F.text == "🚖 Ҳайдовчилар")
 async def list_drivers_admin(message: Message):
     if message.from_user.id not in ADMIN_IDS:
         return
-    async with pool.acquire() as conn:
-        rows = await conn.fetch("SELECT * FROM drivers ORDER BY driver_id DESC")
-    if not rows:
+    text, kb = await render_page("drv")
+    if text is None:
         await message.answer("📭 Ҳайдовчилар йўқ.")
         return
-    for r in rows:
-        status = r["status"] or "active"
-        text = (
-        f"🆔 {r['driver_id']}\n"
-        f"📱 {r['username'] or '—'}\n"
-        f"📞 {r['phone'] or '—'}\n"
-        f"💰 {format_sum(int(r['balance'] or 0))} сўм\n"
-        f"💤 Статус: <b>{status}</b>\n"
-        f"👤 {r['full_name'] or '—'}\n"
-        f"🚘 {r['car_model'] or '—'}"
-        )
-        if status == "active":
-            kb = InlineKeyboardMarkup(inline_keyboard=[[InlineKeyboardButton(text="🔒 Блоклаш", callback_data=f"drv_block:{r['driver_id']}")]])
-        else:
-            kb = InlineKeyboardMarkup(inline_keyboard=[[InlineKeyboardButton(text="✅ Блокдан чиқариш", callback_data=f"drv_unblock:{r['driver_id']}")]])
-        await message.answer(text, reply_markup=kb)
+    await message.answer(text, reply_markup=kb)
 
 @router.callback_query(F.data.startswith("drv_block:"))
 async def drv_block(callback: CallbackQuery):
@@ -930,16 +1238,15 @@ async def drv_block(callback: CallbackQuery):
         await callback.answer(); return
     driver_id = int(callback.data.split(":")[1])
     async with pool.acquire() as conn:
-        await conn.execute("UPDATE drivers SET status='blocked' WHERE driver_id=$1", driver_id)
-    try:
-        await bot.send_message(driver_id, "🚫 Сиз админ томонидан блокландингиз. Илтимос админ билан боғланинг.")
-    except Exception:
-        pass
+        async with conn.transaction():
+            car_model = await repo.set_driver_status(conn, driver_id, "blocked")
+            await outbox.enqueue(conn, driver_id, "🚫 Сиз админ томонидан блокландингиз. Илтимос админ билан боғланинг.")
+    cache.drivers.invalidate(driver_id)
+    driver_index.update(driver_id, car_model, "blocked")
+    driver_positions.remove(driver_id)
+    outbox_dispatcher.wake()
     await callback.answer(f"🔒 {driver_id} блокланди.", show_alert=True)
-    try:
-        await callback.message.edit_reply_markup(reply_markup=None)
-    except Exception:
-        pass
+    await refresh_or_strip_markup(callback)
 
 @router.callback_query(F.data.startswith("drv_unblock:"))
 async def drv_unblock(callback: CallbackQuery):
@@ -947,39 +1254,55 @@ async def drv_unblock(callback: CallbackQuery):
         await callback.answer(); return
     driver_id = int(callback.data.split(":")[1])
     async with pool.acquire() as conn:
-        await conn.execute("UPDATE drivers SET status='active' WHERE driver_id=$1", driver_id)
-    try:
-        await bot.send_message(driver_id, "✅ Сиз блокдан чиқарилдингиз. Ботдан фойдаланинг.")
-    except Exception:
-        pass
+        async with conn.transaction():
+            car_model = await repo.set_driver_status(conn, driver_id, "active")
+            await outbox.enqueue(conn, driver_id, "✅ Сиз блокдан чиқарилдингиз. Ботдан фойдаланинг.")
+    cache.drivers.invalidate(driver_id)
+    driver_index.update(driver_id, car_model, "active")
+    outbox_dispatcher.wake()
     await callback.answer(f"✅ {driver_id} блокдан чиқарилди.", show_alert=True)
-    try:
-        await callback.message.edit_reply_markup(reply_markup=None)
-    except Exception:
-        pass
+    await refresh_or_strip_markup(callback)
 
 @router.message(F.text == "👥 Мижозлар")
 async def list_customers_admin(message: Message):
     if message.from_user.id not in ADMIN_IDS:
         return
-    async with pool.acquire() as conn:
-        rows = await conn.fetch("SELECT * FROM customers ORDER BY user_id DESC")
-    if not rows:
+    text, kb = await render_page("cust")
+    if text is None:
         await message.answer("📭 Мижозлар йўқ.")
         return
-    for r in rows:
-        status = r["status"] or "active"
-        text = ( 
-        f"🆔 {r['user_id']}\n"
-        f"📱 {r['username'] or '—'}\n"
-        f"📞 {r['phone'] or '—'}\n" 
-        f"💤 Статус: <b>{status}</b>"
-        )
-        if status == "active":
-            kb = InlineKeyboardMarkup(inline_keyboard=[[InlineKeyboardButton(text="🔒 Блоклаш", callback_data=f"cust_block:{r['user_id']}")]])
-        else:
-            kb = InlineKeyboardMarkup(inline_keyboard=[[InlineKeyboardButton(text="✅ Блокдан чиқариш", callback_data=f"cust_unblock:{r['user_id']}")]])
-        await message.answer(text, reply_markup=kb)
+    await message.answer(text, reply_markup=kb)
+
+@router.callback_query(F.data.startswith("pg:"))
+async def page_nav(callback: CallbackQuery):
+    try:
+        _, view, action, anchor_s = callback.data.split(":")
+        anchor = int(anchor_s)
+    except Exception:
+        await callback.answer("Нотўғри маълумот.", show_alert=True); return
+    if view not in PAGE_VIEWS:
+        await callback.answer(); return
+    if view == "free":
+        d = await get_driver(callback.from_user.id)
+        if not d or d.status == "blocked":
+            await callback.answer("❗ Фақат ҳайдовчилар учун.", show_alert=True); return
+    elif callback.from_user.id not in ADMIN_IDS:
+        await callback.answer("Фақат админлар учун.", show_alert=True); return
+
+    direction = {"n": "next", "p": "prev", "r": "at"}.get(action, "next")
+    text, kb = await render_page(view, anchor, direction)
+    if text is None and direction == "prev":
+        text, kb = await render_page(view)
+    if text is None:
+        await callback.answer("📭 Бошқа саҳифа йўқ.", show_alert=True); return
+    try:
+        await callback.message.edit_text(text, reply_markup=kb)
+    except Exception:
+        # "message is not modified"
+        pass
+    else:
+        await remember_free_page(callback.message.chat.id, callback.message.message_id, kb)
+    await callback.answer()
 
 @router.callback_query(F.data.startswith("cust_block:"))
 async def cust_block(callback: CallbackQuery):
@@ -987,16 +1310,13 @@ async def cust_block(callback: CallbackQuery):
         await callback.answer(); return
     user_id = int(callback.data.split(":")[1])
     async with pool.acquire() as conn:
-        await conn.execute("UPDATE customers SET status='blocked' WHERE user_id=$1", user_id)
-    try:
-        await bot.send_message(user_id, "🚫 Сиз админ томонидан блокландингиз. Илтимос админ билан боғланинг.")
-    except Exception:
-        pass
+        async with conn.transaction():
+            await repo.set_customer_status(conn, user_id, "blocked")
+            await outbox.enqueue(conn, user_id, "🚫 Сиз админ томонидан блокландингиз. Илтимос админ билан боғланинг.")
+    cache.customers.invalidate(user_id)
+    outbox_dispatcher.wake()
     await callback.answer("🔒 Мижоз блокланди.", show_alert=True)
-    try:
-        await callback.message.edit_reply_markup(reply_markup=None)
-    except Exception:
-        pass
+    await refresh_or_strip_markup(callback)
 
 @router.callback_query(F.data.startswith("cust_unblock:"))
 async def cust_unblock(callback: CallbackQuery):
@@ -1004,16 +1324,80 @@ async def cust_unblock(callback: CallbackQuery):
         await callback.answer(); return
     user_id = int(callback.data.split(":")[1])
     async with pool.acquire() as conn:
-        await conn.execute("UPDATE customers SET status='active' WHERE user_id=$1", user_id)
-    try:
-        await bot.send_message(user_id, "✅ Сиз блокдан чиқарилдингиз. Ботдан фойдаланинг.")
-    except Exception:
-        pass
+        async with conn.transaction():
+            await repo.set_customer_status(conn, user_id, "active")
+            await outbox.enqueue(conn, user_id, "✅ Сиз блокдан чиқарилдингиз. Ботдан фойдаланинг.")
+    cache.customers.invalidate(user_id)
+    outbox_dispatcher.wake()
     await callback.answer("✅ Мижоз блокдан чиқарилди.", show_alert=True)
-    try:
-        await callback.message.edit_reply_markup(reply_markup=None)
-    except Exception:
-        pass
+    await refresh_or_strip_markup(callback)
+
+@router.message(Command("cachestats"))
+async def cache_stats_admin(message: Message):
+    if message.from_user.id not in ADMIN_IDS:
+        return
+    d = cache.drivers.stats()
+    c = cache.customers.stats()
+    await message.answer(
+        f"🗂 <b>Кеш</b>\n\n"
+        f"🚖 drivers: {d['size']} | hit {d['hits']} / miss {d['misses']} ({d['hit_rate']})\n"
+        f"👥 customers: {c['size']} | hit {c['hits']} / miss {c['misses']} ({c['hit_rate']})\n"
+        f"📜 open orders: {len(order_book)} {order_book.sizes()}"
+    )
+
+@router.message(Command("dbstats"))
+async def db_stats_admin(message: Message):
+    if message.from_user.id not in ADMIN_IDS:
+        return
+    s = pool.stats(top=5)
+    p, w = s["pool"], s["acquire_wait"]
+    lines = [
+        "🗄 <b>База пули</b>\n",
+        f"size: {p['size']} (min {p['min']} / max {p['max']}) | idle {p['idle']}",
+        f"in use: {p['in_use']} (peak {p['peak_in_use']}) | waiting {p['waiting']} | acquire timeouts {p['acquire_failures']}",
+        f"acquire wait ms: p50 {w['p50_ms']} / p95 {w['p95_ms']} / p99 {w['p99_ms']} / max {w['max_ms']} ({w['count']})",
+        f"query errors: {s['query_errors']}\n",
+    ]
+    for q in s["queries"]:
+        lines.append(f"• <code>{html.escape(q['query'][:70])}</code>\n"
+                     f"  {q['count']}× p50 {q['p50_ms']} / p95 {q['p95_ms']} / max {q['max_ms']} ms")
+    await message.answer("\n".join(lines))
+
+@router.message(Command("reconcile"))
+async def reconcile_admin(message: Message):
+    if message.from_user.id not in ADMIN_IDS:
+        return
+    await message.answer("⏳ Баланслар журнал билан солиштирилмоқда...")
+    report = await reconciler.run_once()
+    lines = [
+        "📒 <b>Баланс журнали</b>\n",
+        f"текширилди: {report.checked} | мос эмас: {report.mismatched} | snapshot: {report.snapshots}",
+        f"вақт: {report.elapsed:.2f} s",
+    ]
+    for driver_id, balance, expected in report.mismatches[:20]:
+        lines.append(f"• {driver_id}: баланс {format_sum(int(balance))}, журнал {format_sum(int(expected))}")
+    await message.answer("\n".join(lines))
+
+@router.message(Command("ledger"))
+async def ledger_admin(message: Message):
+    if message.from_user.id not in ADMIN_IDS:
+        return
+    parts = (message.text or "").split()
+    if len(parts) < 2 or not parts[1].isdigit():
+        await message.answer("Фойдаланиш: /ledger &lt;driver_id&gt;")
+        return
+    async with pool.acquire() as conn:
+        rows = await ledger.history(conn, int(parts[1]))
+    if not rows:
+        await message.answer("📭 Ёзувлар йўқ.")
+        return
+    lines = [f"📒 <b>{parts[1]}</b> — охирги {len(rows)} ёзув\n"]
+    for r in rows:
+        ref = f"#{r['order_id']}" if r["order_id"] else (f"🧾{r['receipt_id']}" if r["receipt_id"] else "")
+        sign = "+" if r["amount"] >= 0 else "-"
+        lines.append(f"{r['created_at']:%Y-%m-%d %H:%M} {sign}{format_sum(abs(r['amount']))} {r['reason']} {ref} → "
+                     f"{format_sum(r['balance_after'])}")
+    await message.answer("\n".join(lines))
 
 # --------------------------
 # ADMIN: BROADCAST
@@ -1047,28 +1431,11 @@ async def send_broadcast(message: Message, state: FSMContext):
     text = message.text
     await state.clear()
 
-    async with pool.acquire() as conn:
-        drivers = await conn.fetch("SELECT driver_id FROM drivers")
-        customers = await conn.fetch("SELECT user_id FROM customers")
-
-    targets = []
-    if group == "drivers":
-        targets = [r["driver_id"] for r in drivers]
-    elif group == "customers":
-        targets = [r["user_id"] for r in customers]
-    else:
-        targets = [r["driver_id"] for r in drivers] + [r["user_id"] for r in customers]
-
-    sent = 0
-    failed = 0
-    for uid in targets:
-        try:
-            await bot.send_message(uid, f"📢 <b>Админ хабар:</b>\n\n{text}")
-            sent += 1
-            await asyncio.sleep(0.03)
-        except Exception:
-            failed += 1
-    await message.answer(f"✅ Хабар юборилди.\n📨 Жами: {sent} та\n❌ Юборилмади: {failed} та", reply_markup=admin_menu_kb())
+    # broadcast fon workerida yuriladi, admin darhol menyuga qaytadi
+    job = await broadcasts.create_job(pool, message.from_user.id, group, text)
+    status_msg = await message.answer(broadcasts.progress_text(job))
+    await broadcasts.attach_status_message(pool, job["id"], status_msg.chat.id, status_msg.message_id)
+    broadcast_worker.wake()
 
 # --------------------------
 # ADMIN: BALANCE TOPUP (choose driver -> amount)
@@ -1080,14 +1447,14 @@ async def admin_topup_start(message: Message, state: FSMContext):
         return
 
     async with pool.acquire() as conn:
-        rows = await conn.fetch("SELECT driver_id, username FROM drivers ORDER BY driver_id DESC")
+        rows = await repo.list_driver_choices(conn)
 
     if not rows:
         await message.answer("📭 Ҳайдовчилар йўқ.")
         return
 
     kb = InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text=f"{r['username'] or r['driver_id']}", callback_data=f"adm_topup_driver:{r['driver_id']}")] for r in rows
+        [InlineKeyboardButton(text=f"{username or driver_id}", callback_data=f"adm_topup_driver:{driver_id}")] for driver_id, username in rows
     ])
 
     await state.set_state(AdminTopUp.choose_driver)
@@ -1124,13 +1491,13 @@ async def adm_topup_amount_choice(callback: CallbackQuery, state: FSMContext):
 
     amount = int(choice)
     async with pool.acquire() as conn:
-        await conn.execute("UPDATE drivers SET balance = COALESCE(balance,0) + $1 WHERE driver_id=$2", amount, driver_id)
+        async with conn.transaction():
+            await repo.add_driver_balance(conn, driver_id, amount, repo.LEDGER_ADMIN_TOPUP, callback.from_user.id)
+            await outbox.enqueue(conn, driver_id, f"💳 Балансингизга +{format_sum(amount)} сўм қўшилди (админ).")
+    cache.drivers.invalidate(driver_id)
+    outbox_dispatcher.wake()
 
     await callback.answer(f"✅ Баланс {format_sum(amount)} сўм қўшилди.", show_alert=True)
-    try:
-        await bot.send_message(driver_id, f"💳 Балансингизга +{format_sum(amount)} сўм қўшилди (админ).")
-    except Exception:
-        pass
     await state.clear()
 
 @router.message(AdminTopUp.custom_amount, F.text)
@@ -1150,13 +1517,13 @@ async def adm_topup_custom_amount(message: Message, state: FSMContext):
         return
 
     async with pool.acquire() as conn:
-        await conn.execute("UPDATE drivers SET balance = COALESCE(balance,0) + $1 WHERE driver_id=$2", amount, driver_id)
+        async with conn.transaction():
+            await repo.add_driver_balance(conn, driver_id, amount, repo.LEDGER_ADMIN_TOPUP, message.from_user.id)
+            await outbox.enqueue(conn, driver_id, f"💳 Админ томонидан балансингизга +{format_sum(amount)} сўм қўшилди.")
+    cache.drivers.invalidate(driver_id)
+    outbox_dispatcher.wake()
 
     await message.answer(f"✅ Баланс {driver_id} учун +{format_sum(amount)} сўм қўшилди.", reply_markup=admin_menu_kb())
-    try:
-        await bot.send_message(driver_id, f"💳 Админ томонидан балансингизга +{format_sum(amount)} сўм қўшилди.")
-    except Exception:
-        pass
     await state.clear()
 
 # --------------------------
@@ -1177,8 +1544,7 @@ async def contact_admin(message: Message):
 async def go_home(message: Message):
     if message.from_user.id in ADMIN_IDS:
         await message.answer("👑 Админ меню:", reply_markup=admin_menu_kb()); return
-    async with pool.acquire() as conn:
-        drv = await conn.fetchrow("SELECT * FROM drivers WHERE driver_id=$1", message.from_user.id)
+    drv = await get_driver(message.from_user.id)
     if drv:
         await message.answer("👋 Салом, ҳайдовчи!", reply_markup=driver_menu_kb())
     else:
@@ -1187,47 +1553,214 @@ async def go_home(message: Message):
 @router.message(F.text == "📝 Профиль")
 async def show_profile(message: Message):
     user_id = message.from_user.id
-    async with pool.acquire() as conn:
-        # Haydovchi profil
-        driver = await conn.fetchrow("SELECT * FROM drivers WHERE driver_id=$1", user_id)
-        if driver:
-            text = (
-                f"👤 <b>Ҳайдовчи профили</b>\n\n"
-                f"🆔 ID: <code>{driver['driver_id']}</code>\n"
-                f"👤 Исм: {driver['full_name'] or '—'}\n"
-                f"📞 Телефон: {driver['phone'] or '—'}\n"
-                f"🚗 Машина: {driver['car_model'] or '—'}\n"
-                f"💳 Баланс: {format_sum(driver['balance'] or 0)} сўм\n"
-                f"📌 Статус: {driver['status'] or '—'}\n"
-            )
-            await message.answer(text, reply_markup=driver_menu_kb())
-            return
+    # Haydovchi profil
+    driver = await get_driver(user_id)
+    if driver:
+        text = (
+            f"👤 <b>Ҳайдовчи профили</b>\n\n"
+            f"🆔 ID: <code>{driver.driver_id}</code>\n"
+            f"👤 Исм: {driver.full_name or '—'}\n"
+            f"📞 Телефон: {driver.phone or '—'}\n"
+            f"🚗 Машина: {driver.car_model or '—'}\n"
+            f"💳 Баланс: {format_sum(driver.balance or 0)} сўм\n"
+            f"📌 Статус: {driver.status or '—'}\n"
+        )
+        await message.answer(text, reply_markup=driver_menu_kb())
+        return
 
-        # Mijoz profil
-        customer = await conn.fetchrow("SELECT * FROM customers WHERE user_id=$1", user_id)
-        if customer:
-            text = (
-                f"👤 <b>Мижоз профили</b>\n\n"
-                f"🆔 ID: <code>{customer['user_id']}</code>\n"
-                f"👤 Исм: {customer['full_name'] or '—'}\n"
-                f"👤 Username: @{message.from_user.username or '-'}\n"
-                f"📞 Телефон: {customer['phone'] or '—'}\n"
-                f"📌 Статус: {customer['status'] or '—'}\n"
-            )
-            await message.answer(text, reply_markup=customer_menu_kb())
-            return
+    # Mijoz profil
+    customer = await get_customer(user_id)
+    if customer:
+        text = (
+            f"👤 <b>Мижоз профили</b>\n\n"
+            f"🆔 ID: <code>{customer.user_id}</code>\n"
+            f"👤 Исм: {customer.full_name or '—'}\n"
+            f"👤 Username: @{message.from_user.username or '-'}\n"
+            f"📞 Телефон: {customer.phone or '—'}\n"
+            f"📌 Статус: {customer.status or '—'}\n"
+        )
+        await message.answer(text, reply_markup=customer_menu_kb())
+        return
 
     await message.answer("❌ Сиз рўйхатдан ўтмагансиз!", reply_markup=role_kb())
 
 # --------------------------
-# START POLLING
+# STARTUP / SHUTDOWN (polling va webhook uchun umumiy)
 # --------------------------
-async def main():
+async def load_driver_positions():
+    async with pool.acquire() as conn:
+        rows = await repo.list_driver_locations(conn, geo.POSITION_TTL)
+    now = time.time()
+    for driver_id, lat, lon, age in rows:
+        driver_positions.update(driver_id, lat, lon, now - age)
+    logging.info("driver positions loaded: %s", len(driver_positions))
+
+# --- boshqa jarayonlardagi o'zgarishlar (bus.py) ---
+def on_driver_changed(ch: bus.DriverChanged):
+    cache.drivers.invalidate(ch.driver_id)
+    if ch.status == "active" and ch.reachable:
+        driver_index.update(ch.driver_id, ch.car_model, "active")
+    else:
+        driver_index.remove(ch.driver_id)
+    if ch.status == "blocked":
+        driver_positions.remove(ch.driver_id)
+    if ch.reachable is False:
+        reach.tracker.unreachable.add(ch.driver_id)
+    elif ch.reachable:
+        reach.tracker.unreachable.discard(ch.driver_id)
+
+def on_customer_changed(ch: bus.CustomerChanged):
+    cache.customers.invalidate(ch.user_id)
+    if ch.reachable is False:
+        reach.tracker.unreachable.add(ch.user_id)
+    elif ch.reachable:
+        reach.tracker.unreachable.discard(ch.user_id)
+
+async def on_order_changed(ch: bus.OrderChanged):
+    if ch.status != "open":
+        # yangi buyurtma (pending_fee) va taken -> done ham shu yerga keladi: faqat ochiqdan chiqqani kerak.
+        # O'zimiz olgan bo'lsa accept allaqachon tozalagan
+        if ch.order_id not in order_book and ch.order_id not in wave_scheduler:
+            return
+        # boshqa jarayonda olingan: keyingi to'lqinlar bekor, takliflar qaytarib olinadi
+        order_book.remove(ch.order_id)
+        wave_scheduler.cancel(ch.order_id)
+        offer_retractor.wake()
+        return
+    current = order_book.get(ch.order_id)
+    if current is None or current.commission != ch.commission:
+        await order_book.fetch(ch.order_id)
+
+async def on_resync(ch: bus.Resync):
+    cache.drivers.clear()
+    cache.customers.clear()
+    await reach.tracker.load()
+    await driver_index.refresh(pool, force=True)
+    await order_book.refresh(pool)
+    offer_retractor.wake()
+
+async def start_change_bus():
+    global change_bus
+    change_bus = bus.ChangeBus(database_url())
+    change_bus.subscribe(bus.DriverChanged, on_driver_changed)
+    change_bus.subscribe(bus.CustomerChanged, on_customer_changed)
+    change_bus.subscribe(bus.OrderChanged, on_order_changed)
+    change_bus.subscribe(bus.Resync, on_resync)
+    await change_bus.start()
+    # indeks endi hodisalar bilan yangilanadi; davriy qayta o'qish faqat ehtiyot uchun
+    driver_index.refresh_every = 3600.0
+
+_startup_times = {}  # faza -> s (oxirgi start)
+
+@contextmanager
+def startup_phase(name: str):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        _startup_times[name] = elapsed = time.perf_counter() - started
+        metrics.STARTUP_SECONDS.labels(name).set(elapsed)
+
+async def preload():
+    """Xotiradagi holat: bir-biriga bog'liq emas, har biri o'z connectionida parallel yuklanadi."""
+    await asyncio.gather(
+        reach.tracker.start(pool),
+        driver_index.refresh(pool, force=True),
+        order_book.refresh(pool),
+        load_driver_positions(),
+    )
+
+async def on_startup():
+    started = time.perf_counter()
+    _startup_times.clear()
+    create_bot()
     # init db and pool
     await init_db()
+    global broadcast_worker, outbox_dispatcher, wave_scheduler, offer_retractor, reconciler
+    broadcast_worker = broadcasts.BroadcastWorker(bot, pool, database_url())
+    broadcast_worker.start()
+    outbox_dispatcher = outbox.OutboxDispatcher(bot, pool)
+    outbox_dispatcher.start()
+    wave_scheduler = waves.WaveScheduler(order_still_open, timeout=DISPATCH_WAVE_TIMEOUT)
+    wave_scheduler.start()
+    offer_retractor = offers.OfferRetractor(bot, pool, refresh_free_page)
+    offer_retractor.start()
+    reconciler = ledger.Reconciler(pool, every=BALANCE_RECONCILE_EVERY)
+    reconciler.start()
+    # xotiradagi holat yuklanishidan oldin tinglash boshlanadi: oradagi o'zgarish yo'qolmaydi
+    if CHANGE_BUS:
+        with startup_phase("bus"):
+            await start_change_bus()
+    with startup_phase("preload"):
+        await preload()
+    order_book.start()
+    driver_positions.start()
+    fsm_storage.start_cleanup()
+    total = time.perf_counter() - started
+    metrics.STARTUP_SECONDS.labels("total").set(total)
+    breakdown = " ".join(f"{name}={t * 1000:.0f}ms" for name, t in _startup_times.items())
+    (logging.warning if total > STARTUP_TARGET else logging.info)(
+        "startup %.0fms (target %.0fms): %s", total * 1000, STARTUP_TARGET * 1000, breakdown)
+
+async def on_shutdown():
+    if broadcast_worker is not None:
+        await broadcast_worker.stop()
+    if change_bus is not None:
+        await change_bus.stop()
+    if wave_scheduler is not None:
+        await wave_scheduler.stop()
+    if offer_retractor is not None:
+        await offer_retractor.stop()
+    if reconciler is not None:
+        await reconciler.stop()
+    await order_book.stop()
+    await driver_positions.stop()
+    if outbox_dispatcher is not None:
+        await outbox_dispatcher.stop()
+    await reach.tracker.stop()
+    await fsm_storage.close()
+    if pool is not None:
+        await pool.close()
+    if bot is not None:
+        await bot.session.close()
+
+async def start_http_server():
+    """
+    Metrikalar registri va pool shu jarayonda: alohida `uvicorn ping:app` ularni ko'rmaydi.
+    Signallarni aiogram polling ushlaydi, uvicorn emas.
+    """
+    import uvicorn
+    import ping
+    server = uvicorn.Server(uvicorn.Config(ping.app, host="0.0.0.0", port=METRICS_PORT, log_level="warning"))
+    server.capture_signals = nullcontext
+    task = asyncio.create_task(server.serve())
+    return server, task
+
+async def main():
+    logging.basicConfig(level=logging.INFO)
+    await on_startup()
+    http_server = http_task = None
+    if METRICS_PORT:
+        http_server, http_task = await start_http_server()
     print("🚀 Bot ишга тушди...")
     # start polling
-    await dp.start_polling(bot)
+    try:
+        # webhook o'rnatilgan bo'lsa getUpdates ishlamaydi
+        await bot.delete_webhook()
+        await dp.start_polling(bot)
+    finally:
+        if http_server is not None:
+            http_server.should_exit = True
+            await http_task
+        await on_shutdown()
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    if BOT_MODE == "webhook":
+        # updatelar ping.py dagi app orqali keladi; bir nechta worker bitta URL ortida
+        import uvicorn
+        uvicorn.run("ping:app", host="0.0.0.0", port=int(os.getenv("PORT", "8000")),
+                    workers=WEB_CONCURRENCY)
+    else:
+        # ping.py `import bot` qiladi: __main__ ning ikkinchi nusxasi emas, shu modul (pool, bot) ko'rinsin
+        sys.modules["bot"] = sys.modules[__name__]
+        asyncio.run(main())
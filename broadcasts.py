@@ -0,0 +1,264 @@
+# -*- coding: utf-8 -*-
+"""
+broadcasts.py
+Admin xabarlarini fon rejimida yuborish.
+- har bir broadcast `broadcast_jobs` jadvalida saqlanadi (cursor, sent, failed)
+- worker restartdan keyin to'xtagan joyidan davom etadi
+- tezlik RetryAfter javoblariga qarab moslashadi
+- admin bitta status xabarini tahrirlash orqali jarayonni ko'radi
+- job egasi advisory lock bilan belgilanadi; lock pooldan tashqari alohida connectionda turadi
+"""
+import asyncio
+import logging
+import time
+
+import asyncpg
+from aiogram.exceptions import (
+    TelegramRetryAfter, TelegramNetworkError, TelegramServerError, TelegramBadRequest
+)
+
+import metrics
+import reach
+from fanout import engine as fanout
+
+log = logging.getLogger("broadcasts")
+
+BATCH_SIZE = 100
+STATUS_EVERY = 5.0    # status xabarini necha sekundda yangilash
+IDLE_POLL = 30.0
+LOCK_CLASS = 2  # pg_advisory_lock(LOCK_CLASS, job_id)
+
+# guruh -> ketma-ket yuriladigan (jadval, id ustuni) lar
+PHASES = {
+    "drivers": [("drivers", "driver_id")],
+    "customers": [("customers", "user_id")],
+    "all": [("drivers", "driver_id"), ("customers", "user_id")],
+}
+
+
+class AdaptivePacer:
+    """
+    Xabarlar orasidagi pauza. RetryAfter kelganda sekinlashadi,
+    ketma-ket muvaffaqiyatli yuborishlardan keyin asta-sekin tezlashadi.
+    """
+    def __init__(self, min_delay: float = 0.035, max_delay: float = 1.0):
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self.delay = min_delay
+        self.streak = 0
+
+    def ok(self):
+        self.streak += 1
+        if self.streak >= 50:
+            self.delay = max(self.min_delay, self.delay * 0.9)
+            self.streak = 0
+
+    def flood(self):
+        self.streak = 0
+        self.delay = min(self.max_delay, self.delay * 1.5)
+
+    async def wait(self):
+        await asyncio.sleep(self.delay)
+
+
+def progress_text(job) -> str:
+    done = job["sent"] + job["failed"]
+    total = job["total"] or 0
+    pct = int(done * 100 / total) if total else 100
+    head = "✅ Хабар юборилди." if job["status"] == "done" else "⏳ Хабар юборилмоқда..."
+    return (
+        f"{head}\n"
+        f"📊 {done}/{total} ({pct}%)\n"
+        f"📨 Жами: {job['sent']} та\n"
+        f"❌ Юборилмади: {job['failed']} та"
+    )
+
+
+async def create_job(pool, admin_id: int, group: str, text: str) -> dict:
+    if group not in PHASES:
+        group = "all"
+    async with pool.acquire() as conn:
+        total = 0
+        for table, _ in PHASES[group]:
+            total += await conn.fetchval(f"SELECT count(*) FROM {table} WHERE reachable")
+        job = await conn.fetchrow("""
+            INSERT INTO broadcast_jobs(admin_id, grp, text, total)
+            VALUES($1,$2,$3,$4)
+            RETURNING *
+        """, admin_id, group, text, total)
+    return dict(job)
+
+
+async def attach_status_message(pool, job_id: int, chat_id: int, message_id: int):
+    async with pool.acquire() as conn:
+        await conn.execute("UPDATE broadcast_jobs SET status_chat_id=$1, status_message_id=$2 WHERE id=$3",
+                           chat_id, message_id, job_id)
+
+
+class BroadcastWorker:
+    """
+    Bitta fon task. `wake()` yangi job qo'shilganda chaqiriladi.
+    Job lock'i `dsn` bo'yicha ochilgan alohida connectionda: broadcast davomida pooldan connection band bo'lmaydi.
+    """
+    def __init__(self, bot, pool, dsn: str):
+        self.bot = bot
+        self.pool = pool
+        self.dsn = dsn
+        self.pacer = AdaptivePacer()
+        self._wakeup = asyncio.Event()
+        self._task = None
+        self._lock_conn = None
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._loop())
+        return self._task
+
+    def wake(self):
+        self._wakeup.set()
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        # connection yopilsa session lock'lari ham bo'shaydi
+        conn, self._lock_conn = self._lock_conn, None
+        if conn is not None and not conn.is_closed():
+            try:
+                await conn.close(timeout=5)
+            except Exception:
+                conn.terminate()
+
+    async def _lock_connection(self):
+        if self._lock_conn is None or self._lock_conn.is_closed():
+            self._lock_conn = await asyncpg.connect(self.dsn)
+        return self._lock_conn
+
+    def _lock_lost(self) -> bool:
+        return self._lock_conn is None or self._lock_conn.is_closed()
+
+    async def _claim_job(self):
+        """
+        Bir nechta jarayon ishlasa, har bir job ni faqat bittasi yuritadi:
+        advisory lock job tugaguncha lock connectionida ushlab turiladi.
+        Returns job yoki None.
+        """
+        conn = await self._lock_connection()
+        ids = [r["id"] for r in await conn.fetch("SELECT id FROM broadcast_jobs WHERE status='running' ORDER BY id")]
+        for job_id in ids:
+            if not await conn.fetchval("SELECT pg_try_advisory_lock($1, $2)", LOCK_CLASS, job_id):
+                continue
+            # lock olingunga qadar boshqa jarayon davom ettirgan bo'lishi mumkin
+            row = await conn.fetchrow("SELECT * FROM broadcast_jobs WHERE id=$1", job_id)
+            if row and row["status"] == "running":
+                return dict(row)
+            await conn.execute("SELECT pg_advisory_unlock($1, $2)", LOCK_CLASS, job_id)
+        return None
+
+    async def _unlock(self, job_id: int):
+        if self._lock_lost():
+            return
+        try:
+            await self._lock_conn.execute("SELECT pg_advisory_unlock($1, $2)", LOCK_CLASS, job_id)
+        except Exception:
+            # unlock bo'lmasa connection yopiladi — lock baribir bo'shaydi
+            self._lock_conn.terminate()
+
+    async def _loop(self):
+        while True:
+            try:
+                job = await self._claim_job()
+                if job is None:
+                    self._wakeup.clear()
+                    try:
+                        await asyncio.wait_for(self._wakeup.wait(), IDLE_POLL)
+                    except asyncio.TimeoutError:
+                        pass
+                    continue
+                metrics.BROADCAST_RUNNING.inc()
+                try:
+                    await self._run(job)
+                finally:
+                    metrics.BROADCAST_RUNNING.dec()
+                    await self._unlock(job["id"])
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                log.exception("broadcast worker error")
+                await asyncio.sleep(5)
+
+    async def _send(self, uid: int, text: str) -> bool:
+        for attempt in range(4):
+            await fanout.bucket.acquire()
+            try:
+                await self.bot.send_message(uid, f"📢 <b>Админ хабар:</b>\n\n{text}")
+                self.pacer.ok()
+                return True
+            except TelegramRetryAfter as e:
+                self.pacer.flood()
+                fanout.bucket.pause(e.retry_after)
+            except (TelegramNetworkError, TelegramServerError):
+                await asyncio.sleep(min(2 ** attempt, 10))
+            except Exception as e:
+                reach.tracker.report(uid, e)
+                return False
+        return False
+
+    async def _update_status(self, job):
+        if not job.get("status_message_id"):
+            return
+        try:
+            await self.bot.edit_message_text(progress_text(job), chat_id=job["status_chat_id"],
+                                             message_id=job["status_message_id"])
+        except TelegramBadRequest:
+            # "message is not modified" va h.k.
+            pass
+        except Exception:
+            pass
+
+    async def _save(self, job):
+        async with self.pool.acquire() as conn:
+            await conn.execute("""
+                UPDATE broadcast_jobs SET phase=$1, cursor_id=$2, sent=$3, failed=$4 WHERE id=$5
+            """, job["phase"], job["cursor_id"], job["sent"], job["failed"], job["id"])
+
+    async def _run(self, job):
+        phases = PHASES.get(job["grp"], PHASES["all"])
+        last_status = 0.0
+        while job["phase"] < len(phases):
+            table, col = phases[job["phase"]]
+            async with self.pool.acquire() as conn:
+                rows = await conn.fetch(
+                    f"SELECT {col} AS uid FROM {table} WHERE {col} > $1 AND reachable ORDER BY {col} LIMIT $2",
+                    job["cursor_id"], BATCH_SIZE)
+            if not rows:
+                job["phase"] += 1
+                job["cursor_id"] = 0
+                await self._save(job)
+                continue
+            for r in rows:
+                if self._lock_lost():
+                    # lock bilan birga egalik ham ketdi: job ni boshqa jarayon (yoki keyingi aylanish) davom ettiradi
+                    log.warning("broadcast #%s: lock connection lost, pausing", job["id"])
+                    return
+                if await self._send(r["uid"], job["text"]):
+                    job["sent"] += 1
+                else:
+                    job["failed"] += 1
+                job["cursor_id"] = r["uid"]
+                # har bir yuborishdan keyin: qulash yoki egalik o'tishida qayta yuboriladigani ko'pi bilan bitta
+                await self._save(job)
+                await self.pacer.wait()
+                if time.monotonic() - last_status >= STATUS_EVERY:
+                    last_status = time.monotonic()
+                    await self._update_status(job)
+
+        job["status"] = "done"
+        async with self.pool.acquire() as conn:
+            await conn.execute("UPDATE broadcast_jobs SET status='done', finished_at=CURRENT_TIMESTAMP WHERE id=$1", job["id"])
+        await self._update_status(job)
+        log.info("broadcast #%s done: sent=%s failed=%s", job["id"], job["sent"], job["failed"])
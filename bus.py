@@ -0,0 +1,265 @@
+# -*- coding: utf-8 -*-
+"""
+bus.py
+Bir nechta bot jarayoni orasida o'zgarishlar shinasi (Postgres LISTEN/NOTIFY).
+- drivers/customers/orders dagi o'zgarishlarni trigger `change_events` ga yozadi va
+  commitda NOTIFY qiladi (migrations/011) — qaysi jarayon yoki statement o'zgartirgani muhim emas
+- tinglash pooldan alohida, bitta maxsus connection da
+- hodisalar turlangan: `DriverChanged`, `CustomerChanged`, `OrderChanged`;
+  obunachilar `subscribe(tur, handler)` bilan ro'yxatdan o'tadi
+- connection uzilsa qayta ulanadi va qolib ketgan hodisalarni `change_events` dan o'qiydi;
+  ular allaqachon tozalangan bo'lsa `Resync` yuboriladi (obunachilar hammasini qayta yuklaydi)
+Jarayon o'zi qilgan o'zgarish ham qaytib keladi — handlerlar takror chaqirilishiga chidamli bo'lishi kerak.
+"""
+import asyncio
+import inspect
+import json
+import logging
+import time
+from collections import OrderedDict
+
+import asyncpg
+
+import metrics
+
+log = logging.getLogger("bus")
+
+CHANNEL = "cargo_changes"
+KEEPALIVE = 30.0         # hodisa bo'lmasa connection shuncha sekundda tekshiriladi
+RETENTION_HOURS = 24     # change_events shuncha soat saqlanadi (qayta ulanish oynasi)
+CLEANUP_EVERY = 3600.0
+MAX_CATCHUP = 10000      # bundan ko'p qolib ketgan bo'lsa bittalab emas, Resync
+# id insertda olinadi, commitda ko'rinadi: kichik id kattasidan keyin kelishi mumkin,
+# shuning uchun qayta ulanishda oxirgi id dan biroz oldindan o'qiladi
+CATCHUP_OVERLAP = 1000
+SEEN_SIZE = 5000
+MAX_BACKOFF = 30.0
+
+_MAX_ID = "SELECT COALESCE(max(id), 0) FROM change_events"
+_CATCHUP = """
+SELECT id, kind, entity_id, data::text AS data FROM change_events
+WHERE id > $1 ORDER BY id LIMIT $2
+"""
+_CLEANUP = "DELETE FROM change_events WHERE created_at < CURRENT_TIMESTAMP - make_interval(hours => $1)"
+
+
+class Change:
+    """Barcha hodisalar uchun asos. `id` — change_events.id (Resync da None)."""
+    __slots__ = ("id", "entity_id")
+    KIND = None
+    FIELDS = ()
+
+    def __init__(self, id, entity_id, **fields):
+        self.id = id
+        self.entity_id = entity_id
+        for name in self.FIELDS:
+            setattr(self, name, fields.get(name))
+
+    def __repr__(self):
+        fields = " ".join(f"{n}={getattr(self, n)!r}" for n in self.FIELDS)
+        return f"<{type(self).__name__} #{self.id} {self.entity_id} {fields}>"
+
+
+class DriverChanged(Change):
+    """Haydovchi qo'shildi yoki status/balans/mashina/profil/yetib borish belgisi o'zgardi."""
+    __slots__ = ("status", "balance", "car_model", "reachable")
+    KIND = "driver"
+    FIELDS = __slots__
+
+    @property
+    def driver_id(self):
+        return self.entity_id
+
+
+class CustomerChanged(Change):
+    __slots__ = ("status", "reachable")
+    KIND = "customer"
+    FIELDS = __slots__
+
+    @property
+    def user_id(self):
+        return self.entity_id
+
+
+class OrderChanged(Change):
+    """Buyurtma yaratildi yoki status/haydovchi/komissiya o'zgardi."""
+    __slots__ = ("status", "driver_id", "commission", "car_type")
+    KIND = "order"
+    FIELDS = __slots__
+
+    @property
+    def order_id(self):
+        return self.entity_id
+
+
+class Resync(Change):
+    """Hodisalar yo'qolgan bo'lishi mumkin: xotiradagi holatni to'liq qayta yuklash kerak."""
+    __slots__ = ()
+    KIND = "resync"
+
+
+_TYPES = {cls.KIND: cls for cls in (DriverChanged, CustomerChanged, OrderChanged)}
+
+
+def parse(id, kind: str, entity_id, data) -> Change:
+    """Noma'lum tur (yangi migratsiya, eski kod) uchun None."""
+    cls = _TYPES.get(kind)
+    if cls is None:
+        return None
+    if isinstance(data, str):
+        data = json.loads(data)
+    return cls(id, entity_id, **data)
+
+
+class ChangeBus:
+    """
+    Bitta fon task: LISTEN connection ni ushlab turadi va hodisalarni tartib bilan
+    obunachilarga yetkazadi. Handler sync yoki async bo'lishi mumkin; xatosi boshqalarga ta'sir qilmaydi.
+    """
+    def __init__(self, dsn: str, retention_hours: int = RETENTION_HOURS):
+        self.dsn = dsn
+        self.retention_hours = retention_hours
+        self.last_id = None          # yetkazilgan eng katta id (None — hali ulanmagan)
+        self.connected = False
+        self._handlers = {}
+        self._conn = None
+        self._queue = asyncio.Queue()
+        self._seen = OrderedDict()   # yaqinda yetkazilgan id lar (notify + catch-up takrori)
+        self._task = None
+        self._cleaned_at = 0.0
+        self._lost_at = None         # connection uzilgan vaqt (monotonic)
+
+    def subscribe(self, event_type, handler):
+        self._handlers.setdefault(event_type, []).append(handler)
+
+    async def start(self):
+        """Birinchi ulanish shu yerda: keyingi o'zgarishlar startup yuklashidan keyin yo'qolmaydi."""
+        await self._connect()
+        if self._task is None:
+            self._task = asyncio.create_task(self._loop())
+        return self._task
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self._disconnect()
+
+    async def _connect(self):
+        conn = await asyncpg.connect(self.dsn)
+        try:
+            await conn.add_listener(CHANNEL, self._on_notify)
+            conn.add_termination_listener(self._on_terminated)
+            max_id = await conn.fetchval(_MAX_ID)
+        except Exception:
+            await conn.close()
+            raise
+        self._conn = conn
+        self.connected = True
+        if self.last_id is None:
+            # birinchi ulanish: tarix kerak emas, holat startupda to'liq yuklanadi
+            self.last_id = max_id
+        else:
+            await self._catch_up(max_id)
+        log.info("change bus listening on %s from id %s", CHANNEL, self.last_id)
+
+    async def _disconnect(self):
+        conn, self._conn = self._conn, None
+        if self.connected:
+            self._lost_at = time.monotonic()
+        self.connected = False
+        if conn is not None and not conn.is_closed():
+            try:
+                await conn.close(timeout=5)
+            except Exception:
+                conn.terminate()
+
+    def _on_notify(self, conn, pid, channel, payload):
+        try:
+            d = json.loads(payload)
+            change = parse(d["id"], d["kind"], d["entity_id"], d["data"])
+        except Exception:
+            log.warning("bad change payload: %.200s", payload)
+            return
+        if change is not None:
+            self._queue.put_nowait(change)
+
+    def _on_terminated(self, conn):
+        if conn is self._conn:
+            self._queue.put_nowait(None)   # loop ni uyg'otadi
+
+    async def _catch_up(self, max_id: int):
+        """Uzilish vaqtida kelmay qolganlar. Tozalab yuborilgan bo'lsa yoki juda ko'p bo'lsa — Resync."""
+        start = max(self.last_id - CATCHUP_OVERLAP, 0)
+        # tozalash vaqt bo'yicha: uzilish saqlash muddatiga yaqin bo'lsa hodisalar o'chgan bo'lishi mumkin
+        offline = time.monotonic() - self._lost_at if self._lost_at is not None else 0.0
+        if max_id - start > MAX_CATCHUP or offline > self.retention_hours * 3600 - CLEANUP_EVERY:
+            log.warning("change bus gap (last=%s max=%s offline=%.0fs): resync", self.last_id, max_id, offline)
+            self.last_id = max_id
+            self._queue.put_nowait(Resync(None, 0))
+            return
+        rows = await self._conn.fetch(_CATCHUP, start, MAX_CATCHUP)
+        missed = 0
+        for r in rows:
+            if r["id"] in self._seen:
+                continue
+            change = parse(r["id"], r["kind"], r["entity_id"], r["data"])
+            if change is not None:
+                self._queue.put_nowait(change)
+                missed += 1
+        if missed:
+            log.info("change bus caught up %s events", missed)
+
+    async def _deliver(self, change: Change):
+        if change.id is not None:
+            if change.id in self._seen:
+                return
+            self._seen[change.id] = None
+            while len(self._seen) > SEEN_SIZE:
+                self._seen.popitem(last=False)
+            self.last_id = max(self.last_id or 0, change.id)
+        metrics.BUS_EVENTS.labels(change.KIND).inc()
+        for handler in self._handlers.get(type(change), ()):
+            try:
+                res = handler(change)
+                if inspect.isawaitable(res):
+                    await res
+            except Exception:
+                log.exception("change handler %s failed for %r", getattr(handler, "__name__", handler), change)
+
+    async def _cleanup(self):
+        """Eski hodisalarni tozalash — taymer bo'yicha, hodisalar oqimi to'xtamasa ham."""
+        now = time.monotonic()
+        if now - self._cleaned_at >= CLEANUP_EVERY:
+            self._cleaned_at = now
+            await self._conn.execute(_CLEANUP, self.retention_hours)
+
+    async def _loop(self):
+        backoff = 1.0
+        while True:
+            try:
+                if self._conn is None or self._conn.is_closed():
+                    await self._disconnect()
+                    metrics.BUS_RECONNECTS.inc()
+                    await self._connect()
+                    backoff = 1.0
+                try:
+                    change = await asyncio.wait_for(self._queue.get(), KEEPALIVE)
+                except asyncio.TimeoutError:
+                    # hodisa yo'q: connection tirikligini tekshirish
+                    await self._conn.fetchval("SELECT 1", timeout=10)
+                    change = None
+                if change is not None:
+                    await self._deliver(change)
+                await self._cleanup()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                log.warning("change bus connection error: %s; retry in %.0fs", e, backoff)
+                await self._disconnect()
+                await asyncio.sleep(backoff)
+                backoff = min(backoff * 2, MAX_BACKOFF)
@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+"""
+cache.py
+Foydalanuvchi roli/statusi/profili uchun jarayon ichidagi TTL + LRU kesh.
+Har bir update uchun drivers/customers jadvaliga borishning oldini oladi.
+Yozuvchi handlerlar `invalidate()` chaqirishi shart.
+DB dan o'qish `begin()` tokeni bilan: o'qish davomida invalidate bo'lsa eski qator keshga yozilmaydi.
+"""
+import time
+from collections import OrderedDict
+
+MISSING = object()
+
+
+class TTLCache:
+    """
+    Chegaralangan LRU kesh, har bir yozuv `ttl` sekunddan keyin eskiradi.
+    `None` qiymati ham keshlanadi (foydalanuvchi jadvalda yo'q degani).
+    """
+    def __init__(self, maxsize: int = 10000, ttl: float = 300.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._loading = {}   # key -> token (DB dan o'qilayotgan)
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        item = self._data.get(key)
+        if item is None:
+            self.misses += 1
+            return MISSING
+        expires, value = item
+        if expires < time.monotonic():
+            del self._data[key]
+            self.misses += 1
+            return MISSING
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def begin(self, key):
+        """DB dan o'qishdan oldin. Token `set()` ga beriladi."""
+        if len(self._loading) > self.maxsize:
+            # xato bilan tugagan o'qishlar qoldig'i; tozalash faqat bitta set() ni o'tkazib yuboradi
+            self._loading.clear()
+        token = object()
+        self._loading[key] = token
+        return token
+
+    def set(self, key, value, token=None):
+        if token is not None:
+            # o'qish davomida invalidate (yoki yangiroq o'qish) bo'lgan: bu qator eskirgan bo'lishi mumkin
+            if self._loading.get(key) is not token:
+                return
+            del self._loading[key]
+        self._data[key] = (time.monotonic() + self.ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def invalidate(self, key):
+        self._data.pop(key, None)
+        self._loading.pop(key, None)
+
+    def clear(self):
+        self._data.clear()
+        self._loading.clear()
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 3) if total else 0.0,
+        }
+
+
+drivers = TTLCache()
+customers = TTLCache()
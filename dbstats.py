@@ -0,0 +1,168 @@
+# -*- coding: utf-8 -*-
+"""
+dbstats.py
+asyncpg pool kuzatuvi:
+- acquire kutish vaqti (pool to'lib qolganda o'sadi)
+- har bir SQL uchun latency gistogrammasi (asyncpg query logger orqali)
+- umumiy qiymatlar metrics.py ga ham yoziladi (/metrics)
+- band / bo'sh connectionlar soni va cho'qqi qiymat
+Natija `/dbstats` admin buyrug'i va ping.py dagi HTTP endpoint orqali o'qiladi.
+"""
+import re
+import time
+
+import asyncpg
+
+import metrics
+
+MAX_QUERIES_TRACKED = 200
+
+
+def snapshot(h: metrics.HistogramValue) -> dict:
+    """Admin/JSON ko'rinishi uchun, millisekundlarda."""
+    def ms(v):
+        return round(v * 1000, 2)
+    return {
+        "count": h.count,
+        "mean_ms": ms(h.sum / h.count) if h.count else 0.0,
+        "p50_ms": ms(h.quantile(0.50)),
+        "p95_ms": ms(h.quantile(0.95)),
+        "p99_ms": ms(h.quantile(0.99)),
+        "max_ms": ms(h.max),
+    }
+
+
+def _normalize(sql: str) -> str:
+    return re.sub(r"\s+", " ", sql).strip()[:120]
+
+
+class QueryStats:
+    def __init__(self):
+        self.queries = {}
+        self.errors = 0
+
+    def log(self, record):
+        """asyncpg `Connection.add_query_logger` callback (LoggedQuery)."""
+        key = _normalize(record.query)
+        hist = self.queries.get(key)
+        if hist is None:
+            if len(self.queries) >= MAX_QUERIES_TRACKED:
+                key = "<other>"
+                hist = self.queries.setdefault(key, metrics.HistogramValue())
+            else:
+                hist = self.queries[key] = metrics.HistogramValue()
+        hist.observe(record.elapsed)
+        metrics.DB_QUERY_SECONDS.observe(record.elapsed)
+        if record.exception is not None:
+            self.errors += 1
+            metrics.DB_QUERY_ERRORS.inc()
+
+    def top(self, n: int = 10, by: str = "sum") -> list:
+        items = sorted(self.queries.items(), key=lambda kv: getattr(kv[1], by), reverse=True)
+        return [{"query": q, **snapshot(h)} for q, h in items[:n]]
+
+
+class _Acquire:
+    """`async with pool.acquire()` ham, `await pool.acquire()` ham ishlaydi."""
+    __slots__ = ("owner", "timeout", "conn")
+
+    def __init__(self, owner, timeout):
+        self.owner = owner
+        self.timeout = timeout
+        self.conn = None
+
+    async def _get(self):
+        owner = self.owner
+        owner.waiting += 1
+        started = time.perf_counter()
+        try:
+            conn = await owner.pool.acquire(timeout=self.timeout)
+        except BaseException:
+            owner.acquire_failures += 1
+            metrics.DB_ACQUIRE_TIMEOUTS.inc()
+            raise
+        finally:
+            owner.waiting -= 1
+            waited = time.perf_counter() - started
+            owner.acquire_wait.observe(waited)
+            metrics.DB_ACQUIRE_SECONDS.observe(waited)
+        owner.in_use += 1
+        if owner.in_use > owner.peak_in_use:
+            owner.peak_in_use = owner.in_use
+        return conn
+
+    def __await__(self):
+        return self._get().__await__()
+
+    async def __aenter__(self):
+        self.conn = await self._get()
+        return self.conn
+
+    async def __aexit__(self, *exc):
+        conn, self.conn = self.conn, None
+        await self.owner.release(conn)
+
+
+class InstrumentedPool:
+    """
+    asyncpg.Pool ustidan yupqa o'ram: acquire/release ni o'lchaydi,
+    qolgan hamma narsa (close, get_size, fetch, ...) asl poolga uzatiladi.
+    """
+    def __init__(self, pool, queries: QueryStats, acquire_timeout: float = None):
+        self.pool = pool
+        self.queries = queries
+        self.acquire_timeout = acquire_timeout
+        self.acquire_wait = metrics.HistogramValue()
+        self.acquire_failures = 0
+        self.waiting = 0
+        self.in_use = 0
+        self.peak_in_use = 0
+
+    def acquire(self, *, timeout: float = None) -> _Acquire:
+        return _Acquire(self, timeout if timeout is not None else self.acquire_timeout)
+
+    async def release(self, conn, *, timeout: float = None):
+        self.in_use -= 1
+        await self.pool.release(conn, timeout=timeout)
+
+    def __getattr__(self, name):
+        return getattr(self.pool, name)
+
+    def stats(self, top: int = 10) -> dict:
+        return {
+            "pool": {
+                "size": self.pool.get_size(),
+                "idle": self.pool.get_idle_size(),
+                "min": self.pool.get_min_size(),
+                "max": self.pool.get_max_size(),
+                "in_use": self.in_use,
+                "peak_in_use": self.peak_in_use,
+                "waiting": self.waiting,
+                "acquire_failures": self.acquire_failures,
+            },
+            "acquire_wait": snapshot(self.acquire_wait),
+            "query_errors": self.queries.errors,
+            "queries": self.queries.top(top),
+        }
+
+
+async def create_pool(dsn: str, *, acquire_timeout: float = None, init=None, **kwargs) -> InstrumentedPool:
+    """
+    `asyncpg.create_pool` bilan bir xil, lekin har bir yangi connectionga
+    query logger ulanadi va natija InstrumentedPool ga o'raladi.
+    """
+    queries = QueryStats()
+
+    async def _init(conn):
+        conn.add_query_logger(queries.log)
+        if init is not None:
+            await init(conn)
+
+    pool = InstrumentedPool(await asyncpg.create_pool(dsn=dsn, init=_init, **kwargs), queries,
+                            acquire_timeout=acquire_timeout)
+    metrics.DB_POOL.labels("open").set_function(pool.pool.get_size)
+    metrics.DB_POOL.labels("idle").set_function(pool.pool.get_idle_size)
+    metrics.DB_POOL.labels("in_use").set_function(lambda: pool.in_use)
+    metrics.DB_POOL.labels("waiting").set_function(lambda: pool.waiting)
+    return pool
+
@@ -0,0 +1,179 @@
+# -*- coding: utf-8 -*-
+"""
+fanout.py
+Bir xabarni ko'p chatga tez va Telegram limitlariga mos yuborish.
+- global token bucket (~30 msg/s)
+- har bir chat uchun alohida limit
+- cheklangan parallel workerlar
+- TelegramRetryAfter kelsa bucket to'xtatiladi, xabar tashlab yuborilmaydi
+"""
+import asyncio
+import logging
+import time
+from dataclasses import dataclass, field
+
+from aiogram.exceptions import (
+    TelegramRetryAfter, TelegramNetworkError, TelegramServerError
+)
+
+import metrics
+import reach
+
+log = logging.getLogger("fanout")
+
+# Telegram: ~30 msg/s global, ~1 msg/s bitta chatga. Biroz zaxira bilan: so'rovlar serverga
+# tarmoq kechikishi tebranishi bilan yetadi va server oynasida zichlashadi
+GLOBAL_RATE = 28
+# bucket sig'imi: to'la bucket + bir sekundlik to'ldirish birinchi sekundda `rate` dan oshib ketadi
+BURST = 1
+PER_CHAT_INTERVAL = 1.0
+CONCURRENCY = 20
+MAX_RETRIES = 3
+
+
+class TokenBucket:
+    """
+    Oddiy token bucket. `pause()` RetryAfter vaqtida hamma workerlarni to'xtatadi.
+    Istalgan 1 s oynada `capacity + rate` dan ko'p token berilmaydi.
+    """
+    def __init__(self, rate: float, capacity: float = BURST):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def pause(self, seconds: float):
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+        self.tokens = 0
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self.paused_until:
+                    await asyncio.sleep(self.paused_until - now)
+                    continue
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+@dataclass
+class FanoutResult:
+    delivered: int = 0
+    failed: int = 0
+    retried: int = 0
+    elapsed: float = 0.0
+    errors: dict = field(default_factory=dict)
+
+    def __str__(self):
+        return f"delivered={self.delivered} failed={self.failed} retried={self.retried} elapsed={self.elapsed:.2f}s"
+
+
+class FanoutEngine:
+    """
+    `run(chat_ids, call)` har bir chat uchun `await call(chat_id)` ni bajaradi.
+    Bucket butun jarayon uchun bitta, shuning uchun bir vaqtda ishlayotgan
+    bir nechta fan-out ham umumiy limitga bo'ysunadi.
+    """
+    def __init__(self, rate: float = GLOBAL_RATE, per_chat_interval: float = PER_CHAT_INTERVAL,
+                 concurrency: int = CONCURRENCY, max_retries: int = MAX_RETRIES):
+        self.bucket = TokenBucket(rate)
+        self.per_chat_interval = per_chat_interval
+        self.concurrency = concurrency
+        self.max_retries = max_retries
+        self._last_sent = {}
+        # barcha ishlayotgan run() lardagi navbatdagi chatlar soni
+        self.pending = 0
+
+    async def _wait_chat(self, chat_id):
+        last = self._last_sent.get(chat_id)
+        if last is not None:
+            delay = last + self.per_chat_interval - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+        self._last_sent[chat_id] = time.monotonic()
+
+    def _prune(self):
+        # eski yozuvlar kerak emas, dict cheksiz o'smasin
+        if len(self._last_sent) > 50000:
+            cutoff = time.monotonic() - self.per_chat_interval
+            self._last_sent = {k: v for k, v in self._last_sent.items() if v > cutoff}
+
+    async def _deliver(self, chat_id, call, result: FanoutResult):
+        attempt = 0
+        while True:
+            await self._wait_chat(chat_id)
+            await self.bucket.acquire()
+            try:
+                await call(chat_id)
+                result.delivered += 1
+                metrics.FANOUT_SENT.labels("delivered").inc()
+                return
+            except TelegramRetryAfter as e:
+                # flood limit xabarning aybi emas: urinish sanalmaydi, bucket ochilgach qayta yuboriladi
+                self.bucket.pause(e.retry_after)
+                result.retried += 1
+                metrics.FANOUT_SENT.labels("retried").inc()
+                continue
+            except (TelegramNetworkError, TelegramServerError) as e:
+                await asyncio.sleep(min(2 ** attempt, 10))
+                error = e
+            except Exception as e:
+                result.failed += 1
+                metrics.FANOUT_SENT.labels("failed").inc()
+                reach.tracker.report(chat_id, e)
+                name = type(e).__name__
+                result.errors[name] = result.errors.get(name, 0) + 1
+                return
+            attempt += 1
+            if attempt > self.max_retries:
+                result.failed += 1
+                metrics.FANOUT_SENT.labels("failed").inc()
+                name = type(error).__name__
+                result.errors[name] = result.errors.get(name, 0) + 1
+                return
+            result.retried += 1
+            metrics.FANOUT_SENT.labels("retried").inc()
+
+    async def run(self, chat_ids, call) -> FanoutResult:
+        result = FanoutResult()
+        started = time.monotonic()
+        queue = asyncio.Queue()
+        for cid in dict.fromkeys(chat_ids):
+            queue.put_nowait(cid)
+        self.pending += queue.qsize()
+
+        async def worker():
+            while True:
+                try:
+                    cid = queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    return
+                self.pending -= 1
+                await self._deliver(cid, call, result)
+
+        workers = min(self.concurrency, queue.qsize())
+        if workers:
+            await asyncio.gather(*(worker() for _ in range(workers)))
+        self._prune()
+        result.elapsed = time.monotonic() - started
+        return result
+
+    async def send_message(self, bot, chat_ids, text: str, on_sent=None, **kwargs) -> FanoutResult:
+        """on_sent(chat_id, message) — har bir yetkazilgan xabar uchun (masalan message_id ni saqlash)."""
+        async def call(chat_id):
+            message = await bot.send_message(chat_id, text, **kwargs)
+            if on_sent is not None:
+                on_sent(chat_id, message)
+        return await self.run(chat_ids, call)
+
+
+# jarayon uchun umumiy engine (global limit shu yerda)
+engine = FanoutEngine()
+metrics.FANOUT_PENDING.set_function(lambda: engine.pending)
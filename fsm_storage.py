@@ -0,0 +1,207 @@
+# -*- coding: utf-8 -*-
+"""
+fsm_storage.py
+aiogram FSM holatlarini PostgreSQL da saqlash (mavjud asyncpg pool orqali).
+- restartdan keyin ham NewOrder / DriverRegistration va h.k. davom etadi
+- bir nechta bot jarayoni bitta holatni ko'radi
+- ixtiyoriy write-behind: update_data ketma-ketliklari bitta yozuvga yig'iladi
+  (faqat bitta jarayon ishlaganda yoqish tavsiya etiladi)
+- eskirgan (tashlab ketilgan) holatlar TTL bo'yicha o'chiriladi
+"""
+import asyncio
+import json
+import logging
+from typing import Any, Dict, Mapping, Optional
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, StorageKey, StateType
+
+log = logging.getLogger("fsm_storage")
+
+STATE_TTL_HOURS = 24
+CLEANUP_EVERY = 3600.0
+FLUSH_DELAY = 0.5
+
+_UPSERT_STATE = """
+INSERT INTO fsm_states(bot_id, chat_id, user_id, thread_id, destiny, state)
+VALUES($1,$2,$3,$4,$5,$6)
+ON CONFLICT (bot_id, chat_id, user_id, thread_id, destiny) DO UPDATE
+  SET state = EXCLUDED.state, updated_at = CURRENT_TIMESTAMP
+"""
+_UPSERT_DATA = """
+INSERT INTO fsm_states(bot_id, chat_id, user_id, thread_id, destiny, data)
+VALUES($1,$2,$3,$4,$5,$6::jsonb)
+ON CONFLICT (bot_id, chat_id, user_id, thread_id, destiny) DO UPDATE
+  SET data = EXCLUDED.data, updated_at = CURRENT_TIMESTAMP
+"""
+_MERGE_DATA = """
+INSERT INTO fsm_states(bot_id, chat_id, user_id, thread_id, destiny, data)
+VALUES($1,$2,$3,$4,$5,$6::jsonb)
+ON CONFLICT (bot_id, chat_id, user_id, thread_id, destiny) DO UPDATE
+  SET data = fsm_states.data || EXCLUDED.data, updated_at = CURRENT_TIMESTAMP
+RETURNING data
+"""
+_UPSERT_BOTH = """
+INSERT INTO fsm_states(bot_id, chat_id, user_id, thread_id, destiny, state, data)
+VALUES($1,$2,$3,$4,$5,$6,$7::jsonb)
+ON CONFLICT (bot_id, chat_id, user_id, thread_id, destiny) DO UPDATE
+  SET state = EXCLUDED.state, data = EXCLUDED.data, updated_at = CURRENT_TIMESTAMP
+"""
+_WHERE_KEY = "bot_id=$1 AND chat_id=$2 AND user_id=$3 AND thread_id=$4 AND destiny=$5"
+
+
+def _key(key: StorageKey) -> tuple:
+    return (key.bot_id, key.chat_id, key.user_id, key.thread_id or 0, key.destiny)
+
+
+def _state_name(state: StateType) -> Optional[str]:
+    return state.state if isinstance(state, State) else state
+
+
+def _load(data) -> Dict[str, Any]:
+    if data is None:
+        return {}
+    return json.loads(data) if isinstance(data, str) else dict(data)
+
+
+class PgStorage(BaseStorage):
+    """
+    Pool keyinroq (init_db da) `bind()` orqali beriladi, chunki Dispatcher
+    import vaqtida yaratiladi.
+    """
+    def __init__(self, write_behind: bool = False, ttl_hours: int = STATE_TTL_HOURS):
+        self.pool = None
+        self.write_behind = write_behind
+        self.ttl_hours = ttl_hours
+        # write-behind: key -> [state, data]; hali DB ga yozilmagan
+        self._dirty = {}
+        self._flush_handle = None
+        self._flush_lock = asyncio.Lock()
+        self._cleanup_task = None
+
+    def bind(self, pool):
+        self.pool = pool
+
+    # --- write-behind ---
+    async def _current(self, k: tuple) -> list:
+        item = self._dirty.get(k)
+        if item is None:
+            async with self.pool.acquire() as conn:
+                row = await conn.fetchrow(f"SELECT state, data FROM fsm_states WHERE {_WHERE_KEY}", *k)
+            item = [row["state"], _load(row["data"])] if row else [None, {}]
+            self._dirty[k] = item
+        return item
+
+    def _schedule_flush(self):
+        if self._flush_handle is None:
+            loop = asyncio.get_running_loop()
+            self._flush_handle = loop.call_later(FLUSH_DELAY, lambda: asyncio.ensure_future(self.flush()))
+
+    async def flush(self):
+        self._flush_handle = None
+        async with self._flush_lock:
+            if not self._dirty:
+                return
+            items, self._dirty = self._dirty, {}
+            upserts = [(*k, st, json.dumps(data)) for k, (st, data) in items.items() if st is not None or data]
+            deletes = [k for k, (st, data) in items.items() if st is None and not data]
+            try:
+                async with self.pool.acquire() as conn:
+                    async with conn.transaction():
+                        if upserts:
+                            await conn.executemany(_UPSERT_BOTH, upserts)
+                        if deletes:
+                            await conn.executemany(f"DELETE FROM fsm_states WHERE {_WHERE_KEY}", deletes)
+            except Exception:
+                log.exception("fsm flush failed, retrying")
+                # yangiroq yozuvlarni bosib ketmaslik uchun faqat yo'qlarini qaytaramiz
+                for k, v in items.items():
+                    self._dirty.setdefault(k, v)
+                self._schedule_flush()
+
+    # --- BaseStorage ---
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        k = _key(key)
+        name = _state_name(state)
+        if self.write_behind:
+            (await self._current(k))[0] = name
+            self._schedule_flush()
+            return
+        async with self.pool.acquire() as conn:
+            if name is None:
+                # state.clear(): ma'lumot ham bo'sh bo'lsa qatorni o'chiramiz
+                await conn.execute(f"DELETE FROM fsm_states WHERE {_WHERE_KEY} AND data = '{{}}'::jsonb", *k)
+                await conn.execute(f"UPDATE fsm_states SET state=NULL, updated_at=CURRENT_TIMESTAMP WHERE {_WHERE_KEY}", *k)
+            else:
+                await conn.execute(_UPSERT_STATE, *k, name)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        k = _key(key)
+        if k in self._dirty:
+            return self._dirty[k][0]
+        async with self.pool.acquire() as conn:
+            return await conn.fetchval(f"SELECT state FROM fsm_states WHERE {_WHERE_KEY}", *k)
+
+    async def set_data(self, key: StorageKey, data: Mapping[str, Any]) -> None:
+        k = _key(key)
+        data = dict(data)
+        if self.write_behind:
+            (await self._current(k))[1] = data
+            self._schedule_flush()
+            return
+        async with self.pool.acquire() as conn:
+            if not data:
+                await conn.execute(f"DELETE FROM fsm_states WHERE {_WHERE_KEY} AND state IS NULL", *k)
+                await conn.execute(f"UPDATE fsm_states SET data='{{}}'::jsonb, updated_at=CURRENT_TIMESTAMP WHERE {_WHERE_KEY}", *k)
+            else:
+                await conn.execute(_UPSERT_DATA, *k, json.dumps(data))
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        k = _key(key)
+        if k in self._dirty:
+            return dict(self._dirty[k][1])
+        async with self.pool.acquire() as conn:
+            return _load(await conn.fetchval(f"SELECT data FROM fsm_states WHERE {_WHERE_KEY}", *k))
+
+    async def update_data(self, key: StorageKey, data: Mapping[str, Any]) -> Dict[str, Any]:
+        k = _key(key)
+        if self.write_behind:
+            item = await self._current(k)
+            item[1] = {**item[1], **data}
+            self._schedule_flush()
+            return dict(item[1])
+        # bitta round trip: jsonb || merge
+        async with self.pool.acquire() as conn:
+            return _load(await conn.fetchval(_MERGE_DATA, *k, json.dumps(dict(data))))
+
+    async def close(self) -> None:
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+        if self.pool is not None:
+            await self.flush()
+        if self._cleanup_task is not None:
+            self._cleanup_task.cancel()
+            self._cleanup_task = None
+
+    # --- TTL ---
+    async def cleanup(self) -> int:
+        async with self.pool.acquire() as conn:
+            res = await conn.execute(
+                "DELETE FROM fsm_states WHERE updated_at < CURRENT_TIMESTAMP - make_interval(hours => $1)",
+                self.ttl_hours)
+        return int(res.split()[-1])
+
+    def start_cleanup(self):
+        async def loop():
+            while True:
+                try:
+                    removed = await self.cleanup()
+                    if removed:
+                        log.info("fsm cleanup: %s stale states removed", removed)
+                except asyncio.CancelledError:
+                    raise
+                except Exception:
+                    log.exception("fsm cleanup failed")
+                await asyncio.sleep(CLEANUP_EVERY)
+        if self._cleanup_task is None:
+            self._cleanup_task = asyncio.create_task(loop())
@@ -0,0 +1,189 @@
+# -*- coding: utf-8 -*-
+"""
+geo.py
+Haydovchilarning oxirgi joylashuvi uchun xotiradagi fazoviy indeks (ierarxik kvadrat to'r).
+- `update()` O(1): haydovchi eski katakdan yangisiga ko'chadi
+- `nearest()` ierarxik to'rda best-first: eng yaqin kataklardan boshlab ochiladi
+  va K ta topilib, navbatdagi katak ulardan uzoq bo'lganda to'xtaydi
+- masofa ekvirektangulyar yaqinlashuvda (shahar/viloyat masofalarida yetarli)
+- eskirgan joylashuvlar (`max_age`) hisobga olinmaydi va fon taskda (`start()`) o'chiriladi
+"""
+import asyncio
+import heapq
+import logging
+import math
+import time
+
+log = logging.getLogger("geo")
+
+EARTH_KM = 6371.0088
+CELL_DEG = 0.01                        # eng mayda katak, ~1 km
+LEVELS = 9                             # 0.01 ... 2.56 gradus
+FACTOR = 2                             # har bir yuqori daraja katagi 2x2 mayda katakdan iborat
+LEAF_SIZE = 32                         # shundan kam haydovchili katak maydalanmaydi
+POSITION_TTL = 6 * 3600.0              # joylashuv shuncha sekund eskirmagan deb hisoblanadi
+PRUNE_EVERY = 600.0
+
+
+def distance_km(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    """Ekvirektangulyar masofa; kenglik bo'yicha tuzatish birinchi nuqtada (nearest() bilan bir xil)."""
+    x = math.radians(lon2 - lon1) * math.cos(math.radians(lat1))
+    y = math.radians(lat2 - lat1)
+    return EARTH_KM * math.hypot(x, y)
+
+
+class GeoGrid:
+    """
+    driver_id -> (lat, lon, ts); har bir darajada katak -> {driver_id}.
+    `nearest()` best-first: kataklar nuqtagacha minimal masofa bo'yicha navbatda,
+    yirik katak faqat navbatga chiqqanda maydalarga ochiladi. Zich shaharda ham,
+    siyrak hududda ham faqat javobga yaqin kataklar ko'riladi.
+    """
+    def __init__(self, cell_deg: float = CELL_DEG, max_age: float = POSITION_TTL,
+                 levels: int = LEVELS, factor: int = FACTOR, prune_every: float = PRUNE_EVERY):
+        self.cell_deg = cell_deg
+        self.max_age = max_age
+        self.factor = factor
+        self.prune_every = prune_every
+        self._task = None
+        self._pos = {}
+        # _levels[n] — n-daraja katak -> {driver_id}; 0 — eng mayda
+        self._levels = [{} for _ in range(levels)]
+        self._sizes = [cell_deg * factor ** n for n in range(levels)]
+
+    def __len__(self):
+        return len(self._pos)
+
+    def __contains__(self, driver_id):
+        return driver_id in self._pos
+
+    def _cell(self, lat: float, lon: float) -> tuple:
+        return (math.floor(lat / self.cell_deg), math.floor(lon / self.cell_deg))
+
+    def _link(self, cell, driver_id, add: bool):
+        i, j = cell
+        div = 1
+        for cells in self._levels:
+            key = (i // div, j // div)
+            div *= self.factor
+            if add:
+                ids = cells.get(key)
+                if ids is None:
+                    ids = cells[key] = set()
+                ids.add(driver_id)
+            else:
+                ids = cells.get(key)
+                if ids is not None:
+                    ids.discard(driver_id)
+                    if not ids:
+                        del cells[key]
+
+    def update(self, driver_id: int, lat: float, lon: float, ts: float = None):
+        cell = self._cell(lat, lon)
+        old = self._pos.get(driver_id)
+        self._pos[driver_id] = (lat, lon, ts if ts is not None else time.time())
+        if old is not None:
+            old_cell = self._cell(old[0], old[1])
+            if old_cell == cell:
+                return
+            self._link(old_cell, driver_id, False)
+        self._link(cell, driver_id, True)
+
+    def remove(self, driver_id: int):
+        old = self._pos.pop(driver_id, None)
+        if old is not None:
+            self._link(self._cell(old[0], old[1]), driver_id, False)
+
+    def get(self, driver_id: int):
+        """(lat, lon, ts) yoki None."""
+        return self._pos.get(driver_id)
+
+    def nearest(self, lat: float, lon: float, k: int = 10, allowed=None, max_km: float = None,
+                now: float = None) -> list:
+        """
+        Eng yaqin `k` ta haydovchi: [(masofa_km, driver_id), ...] o'sish tartibida.
+        `allowed` — ruxsat etilgan driver_id lar to'plami (masalan mos mashinalilar).
+        """
+        if not self._pos or k <= 0:
+            return []
+        cutoff = (now if now is not None else time.time()) - self.max_age
+        rad = math.pi / 180
+        kx = EARTH_KM * rad * math.cos(math.radians(lat))
+        ky = EARTH_KM * rad
+        sizes = self._sizes
+        f = self.factor
+        pos = self._pos
+        levels = self._levels
+
+        def mindist(i, j, n):
+            size = sizes[n]
+            lo, hi = i * size, (i + 1) * size
+            dy = lo - lat if lat < lo else (lat - hi if lat > hi else 0.0)
+            lo, hi = j * size, (j + 1) * size
+            dx = lo - lon if lon < lo else (lon - hi if lon > hi else 0.0)
+            return math.sqrt((dx * kx) ** 2 + (dy * ky) ** 2)
+
+        top = len(sizes) - 1
+        queue = [(mindist(i, j, top), top, i, j) for i, j in levels[top]]
+        heapq.heapify(queue)
+        best = []  # max-heap: (-masofa, driver_id)
+        while queue:
+            md, n, i, j = heapq.heappop(queue)
+            if len(best) >= k and md > -best[0][0]:
+                break
+            if max_km is not None and md > max_km:
+                break
+            ids = levels[n][(i, j)]
+            if n and len(ids) > LEAF_SIZE:
+                children = levels[n - 1]
+                for a in range(i * f, i * f + f):
+                    for b in range(j * f, j * f + f):
+                        if (a, b) in children:
+                            heapq.heappush(queue, (mindist(a, b, n - 1), n - 1, a, b))
+                continue
+            # siyrak katakni maydalashdan ko'ra to'g'ridan-to'g'ri ko'rish arzon
+            for did in ids:
+                if allowed is not None and did not in allowed:
+                    continue
+                plat, plon, ts = pos[did]
+                if ts < cutoff:
+                    continue
+                dx = (plon - lon) * kx
+                dy = (plat - lat) * ky
+                d = math.sqrt(dx * dx + dy * dy)
+                if max_km is not None and d > max_km:
+                    continue
+                if len(best) < k:
+                    heapq.heappush(best, (-d, did))
+                elif d < -best[0][0]:
+                    heapq.heapreplace(best, (-d, did))
+        return sorted((-nd, did) for nd, did in best)
+
+    def prune(self, now: float = None) -> int:
+        """Eskirgan joylashuvlarni o'chiradi."""
+        cutoff = (now if now is not None else time.time()) - self.max_age
+        stale = [did for did, (_, _, ts) in self._pos.items() if ts < cutoff]
+        for did in stale:
+            self.remove(did)
+        return len(stale)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._loop())
+        return self._task
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _loop(self):
+        while True:
+            await asyncio.sleep(self.prune_every)
+            removed = self.prune()
+            if removed:
+                log.info("pruned %s stale positions, %s left", removed, len(self))
@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+"""
+idem.py
+Inline tugmani qayta-qayta bosishni bostirish.
+- (user_id, callback_data) bo'yicha: birinchi bosish ishlayotganda keyingilari
+  handlerga yetmaydi, faqat "⏳" javobi qaytadi
+- natijasi o'zgarmaydigan amallar (`ACTIONS`) uchun birinchi javob (answerCallbackQuery
+  matni) saqlanadi va TTL ichida qayta bosilsa Postgresga bormasdan takrorlanadi
+- boshqa tugmalar uchun faqat qisqa oyna (`WINDOW`)
+Javob matni bot sessiyasidagi request middleware orqali olinadi, handlerlar o'zgarmaydi.
+"""
+import time
+
+from aiogram import BaseMiddleware
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.methods import AnswerCallbackQuery
+
+import metrics
+
+WINDOW = 2.0   # har qanday tugma: shu oraliqdagi takroriy bosish tashlab yuboriladi, s
+
+# callback_data prefiksi -> natijani takrorlash muddati, s.
+# Faqat bir yo'nalishli amallar: yakuniy natija (qabul qilindi, olingan, tasdiqlandi) qayta bajarilganda ham
+# bir xil bo'ladi. Foydalanuvchi o'zi tuzata oladigan rad javobini (balans yetmaydi va h.k.) handler
+# `no_replay()` bilan belgilaydi — u takrorlanmaydi.
+# Blok/blokdan chiqarish kabi almashinuvchi amallar va FSM ga bog'liq tugmalar bu yerda yo'q.
+ACTIONS = {
+    "accept": 30.0,
+    "complete": 60.0,
+    "setfee": 300.0,
+    "approve_receipt": 300.0,
+    "reject_receipt": 300.0,
+}
+
+MAX_ENTRIES = 20000
+PRUNE_EVERY = 60.0
+
+
+class CallbackIdempotency(BaseMiddleware):
+    """
+    `router.callback_query.outer_middleware` — filtrlar va handlerdan oldin.
+    _inflight: key -> javob (hali ishlayotgan handler); _done: key -> (muddat, javob).
+    javob — (text, show_alert) yoki None (handler javob bermagan).
+    """
+    def __init__(self, window: float = WINDOW, actions: dict = None):
+        self.window = window
+        self.actions = ACTIONS if actions is None else actions
+        self._inflight = {}
+        self._done = {}
+        self._by_query = {}   # callback_query_id -> key (handler ishlayotganda)
+        self._no_replay = set()   # callback_query_id lar: javobi saqlanmaydi
+        self._pruned_at = time.monotonic()
+
+    def _ttl(self, data: str) -> float:
+        return self.actions.get(data.split(":", 1)[0], self.window)
+
+    def _prune(self, now: float):
+        if now - self._pruned_at < PRUNE_EVERY and len(self._done) < MAX_ENTRIES:
+            return
+        self._pruned_at = now
+        self._done = {k: v for k, v in self._done.items() if v[0] > now}
+
+    async def __call__(self, handler, event, data):
+        if not event.data:
+            return await handler(event, data)
+        key = (event.from_user.id, event.data)
+        now = time.monotonic()
+        self._prune(now)
+        if key in self._inflight:
+            metrics.CALLBACK_SUPPRESSED.labels("inflight").inc()
+            await event.answer("⏳")
+            return None
+        done = self._done.get(key)
+        if done is not None and done[0] > now:
+            metrics.CALLBACK_SUPPRESSED.labels("replayed").inc()
+            text, show_alert = done[1] or (None, None)
+            await event.answer(text, show_alert=show_alert)
+            return None
+
+        self._inflight[key] = None
+        self._by_query[event.id] = key
+        try:
+            result = await handler(event, data)
+        except Exception:
+            # xato natijasi takrorlanmasin, keyingi bosish qayta ishlaydi
+            self._inflight.pop(key, None)
+            self._done.pop(key, None)
+            raise
+        finally:
+            self._by_query.pop(event.id, None)
+        answer = self._inflight.pop(key, None)
+        if event.id in self._no_replay:
+            self._no_replay.discard(event.id)
+            # faqat qisqa oyna: tez qayta bosish baribir bostiriladi
+            self._done[key] = (time.monotonic() + self.window, answer)
+        else:
+            self._done[key] = (time.monotonic() + self._ttl(event.data), answer)
+        return result
+
+    def no_replay(self, callback_query_id: str):
+        """Handler: bu javob yakuniy emas (holat o'zgarsa natija boshqa bo'ladi), TTL davomida takrorlanmasin."""
+        if callback_query_id in self._by_query:
+            self._no_replay.add(callback_query_id)
+
+    def record(self, callback_query_id: str, text, show_alert):
+        key = self._by_query.get(callback_query_id)
+        if key is not None and key in self._inflight:
+            self._inflight[key] = (text, show_alert)
+
+
+class AnswerRecorder(BaseRequestMiddleware):
+    """`bot.session.middleware(...)` — handler yuborgan answerCallbackQuery ni eslab qoladi."""
+    def __init__(self, idem: CallbackIdempotency):
+        self.idem = idem
+
+    async def __call__(self, make_request, bot, method):
+        if isinstance(method, AnswerCallbackQuery):
+            self.idem.record(method.callback_query_id, method.text, method.show_alert)
+        return await make_request(bot, method)
+
+
+def setup(router) -> CallbackIdempotency:
+    idem = CallbackIdempotency()
+    router.callback_query.outer_middleware(idem)
+    return idem
+
+
+def setup_bot(bot, idem: CallbackIdempotency):
+    bot.session.middleware(AnswerRecorder(idem))
@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+"""
+ledger.py
+Haydovchi balansini jurnal (balance_ledger) bilan solishtirish.
+- balans o'zgarishlari repo.py dagi statementlarning o'zida jurnalga yoziladi
+- `drivers.balance` — tayyor (materialised) qiymat, o'qish O(1) bo'lib qoladi
+- `balance_snapshots`: mos kelgan haydovchi uchun (oxirgi ledger id, balans);
+  keyingi solishtirish faqat snapshotdan keyingi yozuvlarni yig'adi
+- `reconcile()` haydovchilarni keyset partiyalari bilan yuradi: xotirada bitta partiya,
+  har bir partiya REPEATABLE READ da (balans va jurnal bir vaqtdagi holatda)
+"""
+import asyncio
+import logging
+import time
+
+log = logging.getLogger("ledger")
+
+BATCH_SIZE = 500
+RECONCILE_EVERY = 6 * 3600.0
+MAX_REPORTED = 50
+
+_BATCH = """
+SELECT d.driver_id,
+       COALESCE(d.balance, 0) AS balance,
+       COALESCE(s.balance, 0) + COALESCE((
+           SELECT sum(l.amount) FROM balance_ledger l
+           WHERE l.driver_id = d.driver_id AND l.id > COALESCE(s.ledger_id, 0)
+       ), 0) AS expected,
+       (SELECT max(l.id) FROM balance_ledger l WHERE l.driver_id = d.driver_id) AS last_id,
+       s.ledger_id AS snapshot_id
+FROM drivers d
+LEFT JOIN balance_snapshots s ON s.driver_id = d.driver_id
+WHERE d.driver_id > $1
+ORDER BY d.driver_id
+LIMIT $2
+"""
+_SNAPSHOT = """
+INSERT INTO balance_snapshots(driver_id, ledger_id, balance)
+SELECT * FROM unnest($1::bigint[], $2::bigint[], $3::numeric[])
+ON CONFLICT (driver_id) DO UPDATE SET
+    ledger_id = EXCLUDED.ledger_id, balance = EXCLUDED.balance, taken_at = CURRENT_TIMESTAMP
+"""
+_HISTORY = """
+SELECT id, amount, reason, order_id, receipt_id, actor_id, balance_after, created_at
+FROM balance_ledger WHERE driver_id = $1
+ORDER BY id DESC LIMIT $2
+"""
+
+
+class ReconcileReport:
+    __slots__ = ("checked", "mismatched", "mismatches", "snapshots", "elapsed")
+
+    def __init__(self):
+        self.checked = 0
+        self.mismatched = 0
+        self.mismatches = []   # (driver_id, balance, expected), birinchi MAX_REPORTED tasi
+        self.snapshots = 0
+        self.elapsed = 0.0
+
+    def __str__(self):
+        return (f"checked={self.checked} mismatched={self.mismatched} "
+                f"snapshots={self.snapshots} elapsed={self.elapsed:.2f}s")
+
+
+async def history(conn, driver_id: int, limit: int = 20) -> list:
+    return await conn.fetch(_HISTORY, driver_id, limit)
+
+
+async def reconcile(pool, batch_size: int = BATCH_SIZE) -> ReconcileReport:
+    """
+    Har bir haydovchi: balance == snapshot + snapshotdan keyingi jurnal yig'indisi.
+    Mos kelganlar uchun snapshot oldinga suriladi.
+    """
+    report = ReconcileReport()
+    started = time.monotonic()
+    cursor = -1
+    while True:
+        async with pool.acquire() as conn:
+            async with conn.transaction(isolation="repeatable_read"):
+                rows = await conn.fetch(_BATCH, cursor, batch_size)
+                if not rows:
+                    break
+                ids, ledger_ids, balances = [], [], []
+                for r in rows:
+                    report.checked += 1
+                    if r["balance"] != r["expected"]:
+                        report.mismatched += 1
+                        if len(report.mismatches) < MAX_REPORTED:
+                            report.mismatches.append((r["driver_id"], r["balance"], r["expected"]))
+                    elif r["last_id"] is not None and r["last_id"] != r["snapshot_id"]:
+                        ids.append(r["driver_id"])
+                        ledger_ids.append(r["last_id"])
+                        balances.append(r["balance"])
+                if ids:
+                    await conn.execute(_SNAPSHOT, ids, ledger_ids, balances)
+                    report.snapshots += len(ids)
+        cursor = rows[-1]["driver_id"]
+    report.elapsed = time.monotonic() - started
+    return report
+
+
+class Reconciler:
+    """Fon task: har `every` sekundda `reconcile()`, nomuvofiqlik bo'lsa log.warning."""
+    def __init__(self, pool, every: float = RECONCILE_EVERY):
+        self.pool = pool
+        self.every = every
+        self.last_report = None
+        self._task = None
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._loop())
+        return self._task
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def run_once(self) -> ReconcileReport:
+        report = await reconcile(self.pool)
+        self.last_report = report
+        if report.mismatched:
+            log.warning("balance reconciliation: %s; first: %s", report, report.mismatches[:10])
+        else:
+            log.info("balance reconciliation: %s", report)
+        return report
+
+    async def _loop(self):
+        while True:
+            try:
+                await asyncio.sleep(self.every)
+                await self.run_once()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                log.exception("balance reconciliation failed")
@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+"""
+matching.py
+Yangi buyurtmani faqat mos mashinali haydovchilarga yuborish.
+- buyurtma `car_type` ("🚐 Лабо") va haydovchi `car_model` ("Labo", erkin matn)
+  bitta lug'atga (mashina sinfi) keltiriladi
+- faol haydovchilar sinf bo'yicha xotiradagi indeksda saqlanadi
+- mos haydovchi topilmasa (yoki sozlamaga ko'ra) butun parkka yuboriladi
+"""
+import logging
+import re
+import time
+
+import repo
+
+log = logging.getLogger("matching")
+
+LABO = "labo"
+BONGO = "bongo"
+GAZEL = "gazel"
+ISUZU = "isuzu"
+
+# lotin/kirill yozuvlar va keng tarqalgan xatolar -> sinf
+ALIASES = {
+    LABO: ("labo", "лабо", "damas", "дамас"),
+    BONGO: ("bongo", "бонго", "porter", "портер"),
+    GAZEL: ("gazel", "газел"),
+    ISUZU: ("isuz", "исуз"),
+}
+
+# buyurtma sinfi -> uni olishi mumkin bo'lgan haydovchi sinflari
+COMPATIBLE = {
+    LABO: {LABO},
+    BONGO: {BONGO, GAZEL},
+    GAZEL: {GAZEL, BONGO},
+    ISUZU: {ISUZU},
+}
+
+# fallback rejimlari
+FALLBACK_NONE = "none"    # faqat mos haydovchilar
+FALLBACK_EMPTY = "empty"  # mos haydovchi yo'q bo'lsa butun park
+FALLBACK_ALL = "all"      # har doim butun park (eski xatti-harakat)
+
+REFRESH_EVERY = 300.0
+
+
+def normalize_vehicle(text) -> str:
+    """Matndan mashina sinfini topadi; tanilmasa None."""
+    if not text:
+        return None
+    t = re.sub(r"[^\w]+", " ", str(text).lower())
+    for cls, names in ALIASES.items():
+        for name in names:
+            if name in t:
+                return cls
+    return None
+
+
+class DriverIndex:
+    """
+    driver_id -> sinf va sinf -> {driver_id}. Faqat faol haydovchilar.
+    Sinfi tanilmagan haydovchilar `None` kalitida turadi.
+    """
+    def __init__(self, include_unknown: bool = True, fallback: str = FALLBACK_EMPTY,
+                 refresh_every: float = REFRESH_EVERY):
+        self.include_unknown = include_unknown
+        self.fallback = fallback
+        self.refresh_every = refresh_every
+        self._class_of = {}
+        self._by_class = {}
+        self.loaded_at = 0.0
+
+    def __len__(self):
+        return len(self._class_of)
+
+    def load(self, rows):
+        """rows: (driver_id, car_model) juftlari."""
+        self._class_of = {}
+        self._by_class = {}
+        for driver_id, car_model in rows:
+            self._add(driver_id, normalize_vehicle(car_model))
+        self.loaded_at = time.monotonic()
+
+    async def refresh(self, pool, force: bool = False):
+        # boshqa jarayonlardagi ro'yxatdan o'tish/bloklar shu yo'l bilan yetib keladi
+        if not force and time.monotonic() - self.loaded_at < self.refresh_every:
+            return
+        async with pool.acquire() as conn:
+            rows = await repo.list_active_driver_vehicles(conn)
+        self.load(rows)
+        log.info("driver index loaded: %s drivers, %s", len(self), self.sizes())
+
+    def _add(self, driver_id, cls):
+        self._class_of[driver_id] = cls
+        self._by_class.setdefault(cls, set()).add(driver_id)
+
+    def update(self, driver_id: int, car_model=None, status: str = "active"):
+        self.remove(driver_id)
+        if status == "active":
+            self._add(driver_id, normalize_vehicle(car_model))
+
+    def remove(self, driver_id: int):
+        cls = self._class_of.pop(driver_id, None)
+        ids = self._by_class.get(cls)
+        if ids is not None:
+            ids.discard(driver_id)
+
+    def all_ids(self) -> list:
+        return list(self._class_of)
+
+    def sizes(self) -> dict:
+        return {cls or "unknown": len(ids) for cls, ids in self._by_class.items()}
+
+    def candidates(self, car_type) -> list:
+        """Buyurtma mashina turi uchun haydovchilar ro'yxati (fallback hisobga olingan)."""
+        cls = normalize_vehicle(car_type)
+        if self.fallback == FALLBACK_ALL or cls is None:
+            return self.all_ids()
+        ids = set()
+        for c in COMPATIBLE.get(cls, {cls}):
+            ids |= self._by_class.get(c, set())
+        if self.include_unknown:
+            ids |= self._by_class.get(None, set())
+        if not ids and self.fallback == FALLBACK_EMPTY:
+            return self.all_ids()
+        return list(ids)
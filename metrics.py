@@ -0,0 +1,329 @@
+# -*- coding: utf-8 -*-
+"""
+metrics.py
+Prometheus text formatidagi metrikalar (tashqi kutubxonasiz).
+- Counter / Gauge / Histogram, label lar bilan
+- Gauge qiymatini o'qish paytida funksiyadan olish mumkin (`set_function`)
+- aiogram middlewarelari: update/handler vaqti va Telegram API chaqiruvlari
+ping.py dagi `/metrics` endpoint `render()` natijasini qaytaradi.
+"""
+import time
+
+from aiogram import BaseMiddleware
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+
+# sekund
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _fmt_labels(names, values, extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _fmt_value(v) -> str:
+    if v == float("inf"):
+        return "+Inf"
+    return repr(float(v)) if isinstance(v, float) else str(v)
+
+
+class HistogramValue:
+    """Bitta label kombinatsiyasi uchun bucketlar; kvantil bucket chegarasi bilan baholanadi."""
+    __slots__ = ("buckets", "counts", "count", "sum", "max")
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value: float):
+        i = 0
+        while i < len(self.buckets) and value > self.buckets[i]:
+            i += 1
+        self.counts[i] += 1
+        self.count += 1
+        self.sum += value
+        if value > self.max:
+            self.max = value
+
+    def quantile(self, q: float) -> float:
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for i, c in enumerate(self.counts):
+            seen += c
+            if seen >= rank:
+                return min(self.buckets[i], self.max) if i < len(self.buckets) else self.max
+        return self.max
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help: str, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        if not self.labelnames:
+            # label siz metrika noldan boshlab ko'rinsin
+            self.labels()
+
+    def _child(self, values: tuple):
+        raise NotImplementedError
+
+    def labels(self, *values, **kw):
+        if kw:
+            values = tuple(kw[n] for n in self.labelnames)
+        key = tuple(str(v) for v in values)
+        child = self._values.get(key)
+        if child is None:
+            child = self._values[key] = self._child(key)
+        return child
+
+    def _samples(self):
+        raise NotImplementedError
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self._samples())
+        return lines
+
+
+class _CounterValue:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def _child(self, values):
+        return _CounterValue()
+
+    def inc(self, amount=1):
+        self.labels().inc(amount)
+
+    def _samples(self):
+        return [f"{self.name}{_fmt_labels(self.labelnames, k)} {_fmt_value(c.value)}"
+                for k, c in self._values.items()]
+
+
+class _GaugeValue:
+    __slots__ = ("value", "fn")
+
+    def __init__(self):
+        self.value = 0
+        self.fn = None
+
+    def set(self, value):
+        self.value = value
+
+    def inc(self, amount=1):
+        self.value += amount
+
+    def dec(self, amount=1):
+        self.value -= amount
+
+    def set_function(self, fn):
+        self.fn = fn
+
+    def get(self):
+        return self.fn() if self.fn is not None else self.value
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def _child(self, values):
+        return _GaugeValue()
+
+    def set(self, value):
+        self.labels().set(value)
+
+    def inc(self, amount=1):
+        self.labels().inc(amount)
+
+    def dec(self, amount=1):
+        self.labels().dec(amount)
+
+    def set_function(self, fn):
+        self.labels().set_function(fn)
+
+    def _samples(self):
+        out = []
+        for k, g in self._values.items():
+            try:
+                value = g.get()
+            except Exception:
+                # manba hali tayyor emas (masalan pool yo'q)
+                continue
+            out.append(f"{self.name}{_fmt_labels(self.labelnames, k)} {_fmt_value(value)}")
+        return out
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        super().__init__(name, help, labelnames)
+
+    def _child(self, values):
+        return HistogramValue(self.buckets)
+
+    def observe(self, value: float):
+        self.labels().observe(value)
+
+    def _samples(self):
+        out = []
+        for k, h in self._values.items():
+            cumulative = 0
+            for bound, c in zip(self.buckets + (float("inf"),), h.counts):
+                cumulative += c
+                le = 'le="' + ("+Inf" if bound == float("inf") else repr(float(bound))) + '"'
+                out.append(f"{self.name}_bucket{_fmt_labels(self.labelnames, k, le)} {cumulative}")
+            out.append(f"{self.name}_sum{_fmt_labels(self.labelnames, k)} {_fmt_value(h.sum)}")
+            out.append(f"{self.name}_count{_fmt_labels(self.labelnames, k)} {h.count}")
+        return out
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+
+    def _add(self, metric):
+        if metric.name in self._metrics:
+            return self._metrics[metric.name]
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, help, labelnames=()) -> Counter:
+        return self._add(Counter(name, help, labelnames))
+
+    def gauge(self, name, help, labelnames=()) -> Gauge:
+        return self._add(Gauge(name, help, labelnames))
+
+    def histogram(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS) -> Histogram:
+        return self._add(Histogram(name, help, labelnames, buckets))
+
+    def render(self) -> str:
+        lines = []
+        for m in self._metrics.values():
+            lines.extend(m.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+render = registry.render
+
+# --- bot metrikalari ---
+UPDATES = registry.counter("cargobot_updates_total", "Updates processed, by type", ["type"])
+HANDLER_CALLS = registry.counter("cargobot_handler_calls_total", "Handler invocations, by handler and outcome",
+                                 ["handler", "outcome"])
+HANDLER_SECONDS = registry.histogram("cargobot_handler_seconds", "Handler duration", ["handler"])
+TELEGRAM_SECONDS = registry.histogram("cargobot_telegram_request_seconds", "Outbound Bot API call latency",
+                                      ["method"])
+TELEGRAM_ERRORS = registry.counter("cargobot_telegram_errors_total", "Failed Bot API calls, by method and error class",
+                                   ["method", "error"])
+DB_QUERY_SECONDS = registry.histogram("cargobot_db_query_seconds", "SQL statement latency")
+DB_QUERY_ERRORS = registry.counter("cargobot_db_query_errors_total", "SQL statements that raised")
+DB_ACQUIRE_SECONDS = registry.histogram("cargobot_db_acquire_seconds", "Time spent waiting for a pool connection")
+DB_ACQUIRE_TIMEOUTS = registry.counter("cargobot_db_acquire_failures_total", "Pool acquires that timed out or failed")
+DB_POOL = registry.gauge("cargobot_db_pool_connections", "Pool connections, by state", ["state"])
+FANOUT_PENDING = registry.gauge("cargobot_fanout_pending", "Chats queued in running fan-outs")
+FANOUT_SENT = registry.counter("cargobot_fanout_messages_total", "Fan-out deliveries, by result", ["result"])
+BROADCAST_RUNNING = registry.gauge("cargobot_broadcast_jobs_running", "Broadcast jobs being sent by this process")
+DISPATCH_WAVES = registry.counter("cargobot_dispatch_waves_total", "Order offer waves sent, by wave number", ["wave"])
+DISPATCH_ACTIVE = registry.gauge("cargobot_dispatch_active_orders", "Orders with further offer waves scheduled")
+UNREACHABLE = registry.gauge("cargobot_unreachable_users", "Users excluded from sends until they message the bot")
+UNREACHABLE_MARKED = registry.counter("cargobot_unreachable_marked_total", "Users marked unreachable, by reason",
+                                      ["reason"])
+CALLBACK_SUPPRESSED = registry.counter("cargobot_callback_suppressed_total",
+                                       "Repeated button taps answered without running the handler, by reason",
+                                       ["reason"])
+RECEIPT_DUPLICATES = registry.counter("cargobot_receipt_duplicates_total",
+                                      "Duplicate receipts detected, by kind (exact: dropped; pending, near: "
+                                      "forwarded with a warning)", ["kind"])
+BUS_EVENTS = registry.counter("cargobot_bus_events_total", "Change bus events delivered to subscribers, by kind",
+                              ["kind"])
+BUS_RECONNECTS = registry.counter("cargobot_bus_reconnects_total", "Change bus LISTEN connection re-established")
+ORDER_BOOK_SIZE = registry.gauge("cargobot_order_book_open_orders", "Open orders held in memory")
+ORDER_BOOK_DRIFT = registry.counter("cargobot_order_book_drift_total",
+                                    "Order book entries corrected by the DB check, by kind", ["kind"])
+STARTUP_SECONDS = registry.gauge("cargobot_startup_seconds", "Duration of the last startup, by phase", ["phase"])
+OUTBOX_SENT = registry.counter("cargobot_outbox_messages_total", "Outbox delivery attempts, by resulting status",
+                               ["status"])
+
+
+def _handler_name(data: dict) -> str:
+    handler = data.get("handler")
+    callback = getattr(handler, "callback", None)
+    return getattr(callback, "__name__", "unknown")
+
+
+class HandlerMetrics(BaseMiddleware):
+    """
+    Router observerlariga (message, callback_query) inner middleware sifatida
+    ulanadi: faqat filtrlar mos kelgan handler o'lchanadi.
+    """
+    async def __call__(self, handler, event, data):
+        name = _handler_name(data)
+        started = time.perf_counter()
+        try:
+            result = await handler(event, data)
+        except Exception:
+            HANDLER_CALLS.labels(name, "error").inc()
+            raise
+        finally:
+            HANDLER_SECONDS.labels(name).observe(time.perf_counter() - started)
+        HANDLER_CALLS.labels(name, "ok").inc()
+        return result
+
+
+class UpdateMetrics(BaseMiddleware):
+    """`dp.update.outer_middleware` — handler topilmagan updatelar ham sanaladi."""
+    async def __call__(self, handler, event, data):
+        UPDATES.labels(getattr(event, "event_type", "unknown")).inc()
+        return await handler(event, data)
+
+
+class RequestMetrics(BaseRequestMiddleware):
+    """`bot.session.middleware(...)` — har bir Bot API chaqiruvi."""
+    async def __call__(self, make_request, bot, method):
+        name = getattr(method, "__api_method__", type(method).__name__)
+        started = time.perf_counter()
+        try:
+            return await make_request(bot, method)
+        except Exception as e:
+            TELEGRAM_ERRORS.labels(name, type(e).__name__).inc()
+            raise
+        finally:
+            TELEGRAM_SECONDS.labels(name).observe(time.perf_counter() - started)
+
+
+def setup(dp, router):
+    dp.update.outer_middleware(UpdateMetrics())
+    router.message.middleware(HandlerMetrics())
+    router.callback_query.middleware(HandlerMetrics())
+
+
+def setup_bot(bot):
+    """Bot alohida (kechroq) yaratiladi, shuning uchun sessiya middleware'i alohida."""
+    bot.session.middleware(RequestMetrics())
@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+"""
+migrate.py
+Versiyalangan sxema migratsiyalari.
+- `migrations/NNN_nomi.sql` fayllari tartib bilan bajariladi
+- qo'llanganlari `schema_version` jadvalida saqlanadi
+- sxema joriy bo'lsa, startda hech qanday DDL bajarilmaydi (bitta SELECT)
+- bir nechta worker bir vaqtda ishga tushsa advisory lock himoya qiladi
+
+    python migrate.py          # DATABASE_URL bo'yicha migratsiyalarni qo'llash
+    python migrate.py --status
+"""
+import asyncio
+import logging
+import os
+import re
+import sys
+
+import asyncpg
+
+log = logging.getLogger("migrate")
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "migrations")
+LOCK_ID = 7260311  # pg_advisory_lock kaliti (ixtiyoriy doimiy son)
+_FILE_RE = re.compile(r"^(\d+)_([\w\-]+)\.sql$")
+
+
+def _scan(directory: str) -> list:
+    """[(version, name, fname), ...] — fayllar o'qilmaydi."""
+    items = []
+    for fname in os.listdir(directory):
+        m = _FILE_RE.match(fname)
+        if m:
+            items.append((int(m.group(1)), m.group(2), fname))
+    items.sort()
+    versions = [v for v, _, _ in items]
+    if len(versions) != len(set(versions)):
+        raise RuntimeError(f"Duplicate migration version in {directory}")
+    return items
+
+
+def load_migrations(directory: str = MIGRATIONS_DIR) -> list:
+    """
+    [(version, name, sql), ...] versiya bo'yicha tartiblangan.
+    """
+    items = []
+    for version, name, fname in _scan(directory):
+        with open(os.path.join(directory, fname), encoding="utf-8") as f:
+            items.append((version, name, f.read()))
+    return items
+
+
+def latest_version(directory: str = MIGRATIONS_DIR) -> int:
+    items = _scan(directory)
+    return items[-1][0] if items else 0
+
+
+async def current_version(conn) -> int:
+    try:
+        return await conn.fetchval("SELECT COALESCE(max(version), 0) FROM schema_version")
+    except asyncpg.UndefinedTableError:
+        return 0
+
+
+async def migrate(pool, directory: str = MIGRATIONS_DIR) -> list:
+    """
+    Qo'llanmagan migratsiyalarni bajaradi. Qo'llangan versiyalar ro'yxatini qaytaradi.
+    """
+    target = latest_version(directory)
+    async with pool.acquire() as conn:
+        # tez yo'l: sxema joriy bo'lsa DDL yo'q (bitta SELECT, SQL fayllar o'qilmaydi)
+        if await current_version(conn) >= target:
+            return []
+        migrations = load_migrations(directory)
+        applied = []
+        # indeks qurish pool dagi statement_timeout dan uzoq cho'zilishi mumkin;
+        # connection poolga qaytganda RESET ALL bilan tiklanadi
+        await conn.execute("SET statement_timeout = 0")
+        await conn.execute("SELECT pg_advisory_lock($1)", LOCK_ID)
+        try:
+            await conn.execute("""
+            CREATE TABLE IF NOT EXISTS schema_version(
+                version INTEGER PRIMARY KEY,
+                name TEXT,
+                applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )""")
+            # lock kutilayotganda boshqa worker qo'llagan bo'lishi mumkin
+            done = {r["version"] for r in await conn.fetch("SELECT version FROM schema_version")}
+            for version, name, sql in migrations:
+                if version in done:
+                    continue
+                async with conn.transaction():
+                    await conn.execute(sql)
+                    await conn.execute("INSERT INTO schema_version(version, name) VALUES($1,$2)", version, name)
+                log.info("migration %03d_%s applied", version, name)
+                applied.append(version)
+        finally:
+            await conn.execute("SELECT pg_advisory_unlock($1)", LOCK_ID)
+    return applied
+
+
+async def _cli():
+    dburl = os.getenv("DATABASE_URL")
+    if not dburl:
+        raise SystemExit("DATABASE_URL is not set in environment variables.")
+    if dburl.startswith("postgres://"):
+        dburl = dburl.replace("postgres://", "postgresql://", 1)
+    pool = await asyncpg.create_pool(dsn=dburl, min_size=1, max_size=1)
+    try:
+        if "--status" in sys.argv:
+            async with pool.acquire() as conn:
+                print(f"schema version: {await current_version(conn)} / latest: {latest_version()}")
+        else:
+            applied = await migrate(pool)
+            print(f"applied: {applied or 'nothing, schema is current'}")
+    finally:
+        await pool.close()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(_cli())
@@ -0,0 +1,45 @@
+-- Boshlang'ich sxema (avval init_db ichida yaratilardi).
+-- IF NOT EXISTS: mavjud bazalarda ham xavfsiz.
+CREATE TABLE IF NOT EXISTS drivers(
+    driver_id BIGINT PRIMARY KEY,
+    username TEXT,
+    phone TEXT,
+    full_name TEXT,
+    car_model TEXT,
+    balance NUMERIC DEFAULT 0,
+    status TEXT DEFAULT 'active'
+);
+
+CREATE TABLE IF NOT EXISTS customers(
+    user_id BIGINT PRIMARY KEY,
+    username TEXT,
+    phone TEXT,
+    full_name TEXT,
+    status TEXT DEFAULT 'active'
+);
+
+CREATE TABLE IF NOT EXISTS orders(
+    id SERIAL PRIMARY KEY,
+    customer_id BIGINT,
+    from_address TEXT,
+    to_address TEXT,
+    cargo_type TEXT,
+    car_type TEXT,
+    cargo_weight NUMERIC,
+    date TEXT,
+    status TEXT DEFAULT 'pending_fee',
+    driver_id BIGINT,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    customer_username TEXT,
+    customer_phone TEXT,
+    commission INTEGER,
+    creator_role TEXT DEFAULT 'customer'
+);
+
+CREATE TABLE IF NOT EXISTS receipts(
+    id SERIAL PRIMARY KEY,
+    driver_id BIGINT,
+    file_id TEXT,
+    status TEXT DEFAULT 'pending',
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
@@ -0,0 +1,17 @@
+-- Fon rejimidagi broadcastlar (broadcasts.py)
+CREATE TABLE IF NOT EXISTS broadcast_jobs(
+    id SERIAL PRIMARY KEY,
+    admin_id BIGINT,
+    grp TEXT,
+    text TEXT,
+    status TEXT DEFAULT 'running',
+    phase INTEGER DEFAULT 0,
+    cursor_id BIGINT DEFAULT 0,
+    total INTEGER DEFAULT 0,
+    sent INTEGER DEFAULT 0,
+    failed INTEGER DEFAULT 0,
+    status_chat_id BIGINT,
+    status_message_id BIGINT,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    finished_at TIMESTAMP
+);
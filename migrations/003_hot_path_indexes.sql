@@ -0,0 +1,21 @@
+-- Tez-tez ishlatiladigan so'rovlar uchun indekslar.
+
+-- free_orders: WHERE status='open' ORDER BY id DESC LIMIT 20
+CREATE INDEX IF NOT EXISTS orders_open_id_idx ON orders (id DESC) WHERE status = 'open';
+-- all_orders va status bo'yicha boshqa filtrlar
+CREATE INDEX IF NOT EXISTS orders_status_id_idx ON orders (status, id DESC);
+CREATE INDEX IF NOT EXISTS orders_customer_id_idx ON orders (customer_id, id DESC);
+CREATE INDEX IF NOT EXISTS orders_driver_id_idx ON orders (driver_id, id DESC) WHERE driver_id IS NOT NULL;
+
+-- push_new_order_to_drivers: SELECT driver_id FROM drivers WHERE status='active'
+-- (partial + covering -> index-only scan)
+CREATE INDEX IF NOT EXISTS drivers_active_idx ON drivers (driver_id) WHERE status = 'active';
+CREATE INDEX IF NOT EXISTS drivers_status_idx ON drivers (status) INCLUDE (driver_id);
+CREATE INDEX IF NOT EXISTS customers_status_idx ON customers (status) INCLUDE (user_id);
+
+-- kutilayotgan kvitansiyalar va haydovchi tarixi
+CREATE INDEX IF NOT EXISTS receipts_pending_idx ON receipts (id) WHERE status = 'pending';
+CREATE INDEX IF NOT EXISTS receipts_driver_id_idx ON receipts (driver_id, id DESC);
+
+-- broadcast worker: WHERE status='running' ORDER BY id
+CREATE INDEX IF NOT EXISTS broadcast_jobs_running_idx ON broadcast_jobs (id) WHERE status = 'running';
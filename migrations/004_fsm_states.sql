@@ -0,0 +1,15 @@
+-- aiogram FSM holatlari (fsm_storage.PgStorage), bir nechta worker uchun umumiy
+CREATE TABLE IF NOT EXISTS fsm_states(
+    bot_id BIGINT NOT NULL,
+    chat_id BIGINT NOT NULL,
+    user_id BIGINT NOT NULL,
+    thread_id BIGINT NOT NULL DEFAULT 0,
+    destiny TEXT NOT NULL DEFAULT 'default',
+    state TEXT,
+    data JSONB NOT NULL DEFAULT '{}'::jsonb,
+    updated_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (bot_id, chat_id, user_id, thread_id, destiny)
+);
+
+-- TTL tozalash uchun
+CREATE INDEX IF NOT EXISTS fsm_states_updated_at_idx ON fsm_states (updated_at);
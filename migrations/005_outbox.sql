@@ -0,0 +1,21 @@
+-- Chiquvchi xabarlar navbati (outbox.py): holat o'zgarishi bilan bitta tranzaksiyada yoziladi
+CREATE TABLE IF NOT EXISTS outbox(
+    id BIGSERIAL PRIMARY KEY,
+    chat_id BIGINT NOT NULL,
+    text TEXT NOT NULL,
+    photo TEXT,
+    reply_markup JSONB,
+    dedup_key TEXT,
+    status TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    last_error TEXT,
+    created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    sent_at TIMESTAMP
+);
+
+-- bitta hodisa uchun xabar ikki marta navbatga tushmasin (NULL kalitlar cheklanmaydi)
+CREATE UNIQUE INDEX IF NOT EXISTS outbox_dedup_key_idx ON outbox (dedup_key);
+
+-- dispatcher faqat navbatdagilarni o'qiydi
+CREATE INDEX IF NOT EXISTS outbox_pending_idx ON outbox (next_attempt_at, id) WHERE status = 'pending';
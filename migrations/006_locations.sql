@@ -0,0 +1,10 @@
+-- Joylashuv bo'yicha dispatch (geo.py): buyurtma olib ketish nuqtasi va haydovchining oxirgi joylashuvi
+ALTER TABLE orders ADD COLUMN IF NOT EXISTS pickup_lat DOUBLE PRECISION;
+ALTER TABLE orders ADD COLUMN IF NOT EXISTS pickup_lon DOUBLE PRECISION;
+
+ALTER TABLE drivers ADD COLUMN IF NOT EXISTS last_lat DOUBLE PRECISION;
+ALTER TABLE drivers ADD COLUMN IF NOT EXISTS last_lon DOUBLE PRECISION;
+ALTER TABLE drivers ADD COLUMN IF NOT EXISTS location_at TIMESTAMP;
+
+-- ishga tushishda faqat yangi joylashuvlar o'qiladi
+CREATE INDEX IF NOT EXISTS drivers_location_at_idx ON drivers (location_at) WHERE location_at IS NOT NULL;
@@ -0,0 +1,13 @@
+-- Haydovchilarga yuborilgan buyurtma takliflari (offers.py): buyurtma olingach tugmalar olib tashlanadi
+CREATE TABLE IF NOT EXISTS order_offers(
+    order_id INTEGER NOT NULL,
+    chat_id BIGINT NOT NULL,
+    message_id BIGINT NOT NULL,
+    kind TEXT NOT NULL DEFAULT 'offer',   -- 'offer' — alohida taklif, 'page' — "Бўш буюртмалар" sahifasi
+    page_anchor INTEGER,                  -- 'page' uchun: sahifani qayta chizish nuqtasi
+    created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (order_id, chat_id, message_id)
+);
+
+-- sahifa boshqa buyurtmalarga o'tganda eski yozuvlar shu bo'yicha almashtiriladi
+CREATE INDEX IF NOT EXISTS order_offers_message_idx ON order_offers (chat_id, message_id);
@@ -0,0 +1,12 @@
+-- Botni bloklagan / o'chirilgan foydalanuvchilar (reach.py): yuborish ro'yxatlariga kirmaydi
+ALTER TABLE drivers ADD COLUMN IF NOT EXISTS reachable BOOLEAN NOT NULL DEFAULT TRUE;
+ALTER TABLE drivers ADD COLUMN IF NOT EXISTS unreachable_at TIMESTAMP;
+ALTER TABLE drivers ADD COLUMN IF NOT EXISTS unreachable_reason TEXT;
+
+ALTER TABLE customers ADD COLUMN IF NOT EXISTS reachable BOOLEAN NOT NULL DEFAULT TRUE;
+ALTER TABLE customers ADD COLUMN IF NOT EXISTS unreachable_at TIMESTAMP;
+ALTER TABLE customers ADD COLUMN IF NOT EXISTS unreachable_reason TEXT;
+
+-- ishga tushishda belgilanganlar ro'yxati
+CREATE INDEX IF NOT EXISTS drivers_unreachable_idx ON drivers (driver_id) WHERE NOT reachable;
+CREATE INDEX IF NOT EXISTS customers_unreachable_idx ON customers (user_id) WHERE NOT reachable;
@@ -0,0 +1,14 @@
+-- Takroriy kvitansiyalarni aniqlash (receipt_dedup.py)
+ALTER TABLE receipts ADD COLUMN IF NOT EXISTS file_unique_id TEXT;
+ALTER TABLE receipts ADD COLUMN IF NOT EXISTS phash BIGINT;
+
+-- aynan o'sha fayl ikkinchi marta yozilmaydi (eski qatorlarda NULL)
+CREATE UNIQUE INDEX IF NOT EXISTS receipts_file_unique_id_idx ON receipts (file_unique_id);
+
+-- dHash ning 8 ta 8-bitlik bo'lagi: yaqin hashlarni qidirish uchun
+CREATE TABLE IF NOT EXISTS receipt_hash_bands(
+    band SMALLINT NOT NULL,
+    value SMALLINT NOT NULL,
+    receipt_id INTEGER NOT NULL REFERENCES receipts(id) ON DELETE CASCADE,
+    PRIMARY KEY (band, value, receipt_id)
+);
@@ -0,0 +1,30 @@
+-- Haydovchi balansi o'zgarishlari jurnali (faqat qo'shiladi) va solishtirish uchun snapshotlar (ledger.py)
+CREATE TABLE IF NOT EXISTS balance_ledger(
+    id BIGSERIAL PRIMARY KEY,
+    driver_id BIGINT NOT NULL,
+    amount NUMERIC NOT NULL,              -- + kirim, - chiqim
+    reason TEXT NOT NULL,                 -- opening, signup_bonus, order_fee, receipt, admin_topup
+    order_id INTEGER,
+    receipt_id INTEGER,
+    actor_id BIGINT,                      -- amalni bajargan admin/haydovchi
+    balance_after NUMERIC NOT NULL,
+    created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+-- haydovchi tarixi va snapshotdan keyingi yig'indi
+CREATE INDEX IF NOT EXISTS balance_ledger_driver_idx ON balance_ledger (driver_id, id);
+
+-- driver_id bo'yicha oxirgi tasdiqlangan holat: shu id gacha jurnal yig'indisi = balance
+CREATE TABLE IF NOT EXISTS balance_snapshots(
+    driver_id BIGINT PRIMARY KEY,
+    ledger_id BIGINT NOT NULL,
+    balance NUMERIC NOT NULL,
+    taken_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+-- mavjud balanslar jurnalning boshlang'ich yozuvi bo'ladi
+INSERT INTO balance_ledger(driver_id, amount, reason, balance_after)
+SELECT driver_id, COALESCE(balance, 0), 'opening', COALESCE(balance, 0)
+FROM drivers
+WHERE COALESCE(balance, 0) <> 0
+  AND NOT EXISTS (SELECT 1 FROM balance_ledger);
@@ -0,0 +1,57 @@
+-- O'zgarishlar shinasi (bus.py): bir nechta bot jarayoni keshlari bir xil bo'lib turishi uchun.
+-- Har bir o'zgarish change_events ga yoziladi va commitda NOTIFY qilinadi;
+-- uzilib qolgan tinglovchi qolib ketganlarini shu jadvaldan o'qiydi.
+CREATE TABLE IF NOT EXISTS change_events(
+    id BIGSERIAL PRIMARY KEY,
+    kind TEXT NOT NULL,
+    entity_id BIGINT NOT NULL,
+    data JSONB NOT NULL,
+    created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+CREATE INDEX IF NOT EXISTS change_events_created_idx ON change_events (created_at);
+
+-- publish_change(kind, kalit ustun, ustunlar...): NEW dan faqat ko'rsatilgan ustunlar olinadi
+CREATE OR REPLACE FUNCTION publish_change() RETURNS trigger AS $$
+DECLARE
+    r JSONB := to_jsonb(NEW);
+    payload JSONB;
+    event_id BIGINT;
+BEGIN
+    SELECT COALESCE(jsonb_object_agg(col, r -> col), '{}'::jsonb) INTO payload
+    FROM unnest(TG_ARGV[2:TG_NARGS - 1]) AS col;
+    INSERT INTO change_events(kind, entity_id, data)
+    VALUES (TG_ARGV[0], (r ->> TG_ARGV[1])::bigint, payload)
+    RETURNING id INTO event_id;
+    PERFORM pg_notify('cargo_changes', json_build_object(
+        'id', event_id, 'kind', TG_ARGV[0], 'entity_id', (r ->> TG_ARGV[1])::bigint, 'data', payload)::text);
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql;
+
+-- jadvaldagi kuzatiladigan ustunlar o'zgarganda (lokatsiya, last_seen kabi yozuvlar hodisa bermaydi)
+DROP TRIGGER IF EXISTS drivers_changed_ins ON drivers;
+CREATE TRIGGER drivers_changed_ins AFTER INSERT ON drivers FOR EACH ROW
+EXECUTE FUNCTION publish_change('driver', 'driver_id', 'status', 'balance', 'car_model', 'reachable');
+DROP TRIGGER IF EXISTS drivers_changed_upd ON drivers;
+CREATE TRIGGER drivers_changed_upd AFTER UPDATE ON drivers FOR EACH ROW
+WHEN ((OLD.status, OLD.balance, OLD.car_model, OLD.reachable, OLD.username, OLD.phone, OLD.full_name)
+      IS DISTINCT FROM (NEW.status, NEW.balance, NEW.car_model, NEW.reachable, NEW.username, NEW.phone, NEW.full_name))
+EXECUTE FUNCTION publish_change('driver', 'driver_id', 'status', 'balance', 'car_model', 'reachable');
+
+-- INSERT ham: boshqa jarayon keshida "yo'q" (None) turgan bo'lishi mumkin
+DROP TRIGGER IF EXISTS customers_changed_ins ON customers;
+CREATE TRIGGER customers_changed_ins AFTER INSERT ON customers FOR EACH ROW
+EXECUTE FUNCTION publish_change('customer', 'user_id', 'status', 'reachable');
+DROP TRIGGER IF EXISTS customers_changed_upd ON customers;
+CREATE TRIGGER customers_changed_upd AFTER UPDATE ON customers FOR EACH ROW
+WHEN ((OLD.status, OLD.reachable, OLD.username, OLD.phone, OLD.full_name)
+      IS DISTINCT FROM (NEW.status, NEW.reachable, NEW.username, NEW.phone, NEW.full_name))
+EXECUTE FUNCTION publish_change('customer', 'user_id', 'status', 'reachable');
+
+DROP TRIGGER IF EXISTS orders_changed_ins ON orders;
+CREATE TRIGGER orders_changed_ins AFTER INSERT ON orders FOR EACH ROW
+EXECUTE FUNCTION publish_change('order', 'id', 'status', 'driver_id', 'commission', 'car_type');
+DROP TRIGGER IF EXISTS orders_changed_upd ON orders;
+CREATE TRIGGER orders_changed_upd AFTER UPDATE ON orders FOR EACH ROW
+WHEN ((OLD.status, OLD.driver_id, OLD.commission) IS DISTINCT FROM (NEW.status, NEW.driver_id, NEW.commission))
+EXECUTE FUNCTION publish_change('order', 'id', 'status', 'driver_id', 'commission', 'car_type');
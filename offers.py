@@ -0,0 +1,203 @@
+# -*- coding: utf-8 -*-
+"""
+offers.py
+Olingan buyurtma takliflarini haydovchilardan qaytarib olish.
+- har bir yuborilgan taklif (chat_id, message_id) `order_offers` ga fan-out davomida
+  kichik partiyalarda yoziladi (`OfferBuffer`)
+- "Бўш буюртмалар" sahifasi ham undagi har bir buyurtma uchun yoziladi
+- buyurtma `open` dan chiqqach `OfferRetractor` xabarlarni tahrirlaydi:
+  taklif "олинди" matniga almashadi, sahifa qayta chiziladi
+- tahrirlar fan-out bilan umumiy token bucket orqali, chat ichida navbat bilan
+Eski tugmani bosish endi DB ga bormaydi, chunki tugma yo'q.
+"""
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+
+from aiogram.exceptions import TelegramRetryAfter, TelegramBadRequest, TelegramForbiddenError
+
+import reach
+from fanout import engine as fanout
+
+log = logging.getLogger("offers")
+
+OFFER = "offer"
+PAGE = "page"
+
+BATCH_SIZE = 200
+IDLE_POLL = 15.0       # wake() bo'lmasa ham shuncha sekundda tekshiriladi (boshqa jarayonlar uchun)
+MAX_RETRIES = 3
+FLUSH_BATCH = 20       # OfferBuffer: shuncha taklif yig'ilsa yoki
+FLUSH_EVERY = 1.0      # shuncha sekund o'tsa yoziladi
+
+_RECORD = """
+INSERT INTO order_offers(order_id, chat_id, message_id, kind, page_anchor)
+VALUES($1, $2, $3, $4, $5)
+ON CONFLICT DO NOTHING
+"""
+_FORGET_MESSAGE = "DELETE FROM order_offers WHERE chat_id=$1 AND message_id=$2"
+# olinganlarini o'chirib qaytaradi: bir nechta jarayon bir qatorni ikki marta tahrirlamaydi
+_CLAIM = """
+DELETE FROM order_offers
+WHERE (order_id, chat_id, message_id) IN (
+    SELECT f.order_id, f.chat_id, f.message_id
+    FROM order_offers f JOIN orders o ON o.id = f.order_id
+    WHERE o.status <> 'open'
+    LIMIT $1
+    FOR UPDATE OF f SKIP LOCKED
+)
+RETURNING order_id, chat_id, message_id, kind, page_anchor
+"""
+
+
+async def record_offers(conn, order_id: int, sent):
+    """sent: (chat_id, message_id) juftlari."""
+    await conn.executemany(_RECORD, [(order_id, chat_id, message_id, OFFER, None) for chat_id, message_id in sent])
+
+
+class OfferBuffer:
+    """
+    Fan-out `on_sent` (sync) dan takliflarni yig'ib, to'lqin tugashini kutmasdan yozadi:
+    katta to'lqin o'rtasida buyurtma olinsa ham retractor yuborilganlarini ko'radi.
+    Oxirida `close()` qolganini yozadi.
+    """
+    def __init__(self, pool, order_id: int, batch_size: int = FLUSH_BATCH, flush_every: float = FLUSH_EVERY):
+        self.pool = pool
+        self.order_id = order_id
+        self.batch_size = batch_size
+        self.flush_every = flush_every
+        self.recorded = 0
+        self._items = []
+        self._flushed_at = time.monotonic()
+        self._lock = asyncio.Lock()
+        self._tasks = set()
+
+    def add(self, chat_id: int, message_id: int):
+        self._items.append((chat_id, message_id))
+        if len(self._items) >= self.batch_size or time.monotonic() - self._flushed_at >= self.flush_every:
+            self._flushed_at = time.monotonic()
+            task = asyncio.create_task(self.flush())
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def flush(self):
+        async with self._lock:
+            items, self._items = self._items, []
+            if not items:
+                return
+            try:
+                async with self.pool.acquire() as conn:
+                    await record_offers(conn, self.order_id, items)
+                self.recorded += len(items)
+            except Exception:
+                log.exception("order #%s: failed to record %s offers", self.order_id, len(items))
+
+    async def close(self):
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+        await self.flush()
+
+
+async def record_page(conn, chat_id: int, message_id: int, anchor: int, order_ids):
+    """Sahifa xabari endi shu buyurtmalarni ko'rsatadi (eskilari almashtiriladi)."""
+    async with conn.transaction():
+        await conn.execute(_FORGET_MESSAGE, chat_id, message_id)
+        await conn.executemany(_RECORD, [(oid, chat_id, message_id, PAGE, anchor) for oid in order_ids])
+
+
+class OfferRetractor:
+    """
+    Bitta fon task. `accept_order` dan keyin `wake()` chaqiriladi.
+    refresh_page(chat_id, message_id, anchor) — "Бўш буюртмалар" sahifasini joyida
+    qayta chizadi (va yangi tarkibini `record_page` bilan yozadi).
+    """
+    def __init__(self, bot, pool, refresh_page, batch_size: int = BATCH_SIZE):
+        self.bot = bot
+        self.pool = pool
+        self.refresh_page = refresh_page
+        self.batch_size = batch_size
+        self._wakeup = asyncio.Event()
+        self._task = None
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._loop())
+        return self._task
+
+    def wake(self):
+        self._wakeup.set()
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _loop(self):
+        while True:
+            try:
+                self._wakeup.clear()
+                if await self.retract_once():
+                    continue
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), IDLE_POLL)
+                except asyncio.TimeoutError:
+                    pass
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                log.exception("offer retractor error")
+                await asyncio.sleep(5)
+
+    async def retract_once(self) -> int:
+        """Bitta partiya. Olingan qatorlar sonini qaytaradi."""
+        async with self.pool.acquire() as conn:
+            rows = await conn.fetch(_CLAIM, self.batch_size)
+        if not rows:
+            return 0
+        # bitta xabar — bitta tahrir (sahifada bir nechta olingan buyurtma bo'lishi mumkin)
+        by_chat = OrderedDict()
+        for r in rows:
+            messages = by_chat.setdefault(r["chat_id"], OrderedDict())
+            messages.setdefault(r["message_id"], r)
+
+        sem = asyncio.Semaphore(fanout.concurrency)
+        edited = 0
+
+        async def chat_worker(chat_id, messages):
+            nonlocal edited
+            async with sem:
+                for i, r in enumerate(messages.values()):
+                    if i:
+                        await asyncio.sleep(fanout.per_chat_interval)
+                    if await self._edit(r):
+                        edited += 1
+
+        await asyncio.gather(*(chat_worker(cid, m) for cid, m in by_chat.items()))
+        log.info("retracted %s offers (%s messages edited)", len(rows), edited)
+        return len(rows)
+
+    async def _edit(self, r) -> bool:
+        for _ in range(MAX_RETRIES):
+            await fanout.bucket.acquire()
+            try:
+                if r["kind"] == PAGE:
+                    await self.refresh_page(r["chat_id"], r["message_id"], r["page_anchor"])
+                else:
+                    await self.bot.edit_message_text(f"🔒 Буюртма #{r['order_id']} олинди.", chat_id=r["chat_id"],
+                                                     message_id=r["message_id"], reply_markup=None)
+                return True
+            except TelegramRetryAfter as e:
+                fanout.bucket.pause(e.retry_after)
+            except (TelegramBadRequest, TelegramForbiddenError) as e:
+                # xabar o'chirilgan / o'zgarmagan / bot bloklangan — qayta urinishdan foyda yo'q
+                reach.tracker.report(r["chat_id"], e)
+                return False
+            except Exception as e:
+                log.warning("offer #%s edit in %s failed: %s", r["order_id"], r["chat_id"], e)
+                return False
+        return False
@@ -0,0 +1,180 @@
+# -*- coding: utf-8 -*-
+"""
+orderbook.py
+Ochiq (`open`) buyurtmalar jarayon xotirasida.
+- id bo'yicha va mashina sinfi bo'yicha (matching.normalize_vehicle) tartiblangan indeks
+- startda DB dan yuklanadi; set_fee / accept / complete va bus.OrderChanged bilan yangilanadi
+- "Бўш буюртмалар" sahifasi va qabul qilishdan oldingi tekshiruv DB ga bormaydi
+- `check()` davriy ravishda DB bilan solishtiradi va farqni tuzatadi (log + metrika)
+Sahifalash `repo.keyset_page` bilan bir xil: id kamayish tartibida, anchor + yo'nalish.
+"""
+import asyncio
+import logging
+from bisect import bisect_left, bisect_right, insort
+
+import matching
+import metrics
+import repo
+
+log = logging.getLogger("orderbook")
+
+CHECK_EVERY = 300.0
+
+OPEN = "open"
+
+
+class OrderBook:
+    def __init__(self, check_every: float = CHECK_EVERY):
+        self.check_every = check_every
+        self.pool = None
+        self._orders = {}      # id -> repo.Order
+        self._ids = []         # o'sish tartibida
+        self._by_class = {}    # sinf -> o'sish tartibidagi id lar
+        self._task = None
+        metrics.ORDER_BOOK_SIZE.set_function(lambda: len(self._orders))
+
+    def __len__(self):
+        return len(self._orders)
+
+    def __contains__(self, order_id):
+        return order_id in self._orders
+
+    def get(self, order_id: int):
+        return self._orders.get(order_id)
+
+    def load(self, orders):
+        self._orders = {}
+        self._ids = []
+        self._by_class = {}
+        for o in sorted(orders, key=lambda o: o.id):
+            self._orders[o.id] = o
+            self._ids.append(o.id)
+            self._by_class.setdefault(matching.normalize_vehicle(o.car_type), []).append(o.id)
+
+    def put(self, order):
+        """Buyurtmaning yangi holati: ochiq bo'lsa qo'shiladi/almashtiriladi, aks holda chiqadi."""
+        if order is None:
+            return
+        if order.status != OPEN:
+            self.remove(order.id)
+            return
+        if order.id not in self._orders:
+            insort(self._ids, order.id)
+            insort(self._by_class.setdefault(matching.normalize_vehicle(order.car_type), []), order.id)
+        self._orders[order.id] = order
+
+    def remove(self, order_id: int):
+        order = self._orders.pop(order_id, None)
+        if order is None:
+            return
+        _discard(self._ids, order_id)
+        ids = self._by_class.get(matching.normalize_vehicle(order.car_type))
+        if ids is not None:
+            _discard(ids, order_id)
+
+    def sizes(self) -> dict:
+        return {cls or "unknown": len(ids) for cls, ids in self._by_class.items() if ids}
+
+    def page(self, anchor: int = None, direction: str = "next", limit: int = 10, car_class: str = None):
+        """
+        `repo.keyset_page` bilan bir xil natija: (rows, has_more).
+        car_class berilsa faqat shu sinfdagi buyurtmalar.
+        """
+        ids = self._ids if car_class is None else self._by_class.get(car_class, [])
+        if direction == "prev":
+            i = bisect_right(ids, anchor) if anchor is not None else len(ids)
+            chunk = ids[i:i + limit + 1]
+            has_more = len(chunk) > limit
+            chunk = chunk[:limit][::-1]
+        else:
+            if anchor is None:
+                i = len(ids)
+            elif direction == "at":
+                i = bisect_right(ids, anchor)
+            else:
+                i = bisect_left(ids, anchor)
+            chunk = ids[max(i - limit - 1, 0):i][::-1]
+            has_more = len(chunk) > limit
+            chunk = chunk[:limit]
+        return [self._orders[i] for i in chunk], has_more
+
+    def has_newer(self, anchor: int = None, car_class: str = None) -> bool:
+        """`repo.keyset_has_newer` bilan bir xil."""
+        if anchor is None:
+            return False
+        ids = self._ids if car_class is None else self._by_class.get(car_class, [])
+        return bool(ids) and ids[-1] > anchor
+
+    async def refresh(self, pool):
+        self.pool = pool
+        async with pool.acquire() as conn:
+            orders = await repo.list_open_orders(conn)
+        self.load(orders)
+        log.info("order book loaded: %s open orders, %s", len(self), self.sizes())
+
+    async def fetch(self, order_id: int):
+        """Boshqa jarayondagi o'zgarish: to'liq qatorni DB dan olib joylaydi."""
+        async with self.pool.acquire() as conn:
+            order = await repo.get_order(conn, order_id)
+        if order is None:
+            self.remove(order_id)
+        else:
+            self.put(order)
+
+    async def check(self) -> dict:
+        """DB dagi ochiq buyurtmalar bilan solishtiradi, farqlarni tuzatadi. {tur: soni}."""
+        async with self.pool.acquire() as conn:
+            versions = dict(await repo.open_order_versions(conn))
+        drift = {"missing": 0, "stale": 0, "changed": 0}
+        for order_id in [i for i in self._orders if i not in versions]:
+            self.remove(order_id)
+            drift["stale"] += 1
+        refetch = []
+        for order_id, commission in versions.items():
+            order = self._orders.get(order_id)
+            if order is None:
+                drift["missing"] += 1
+                refetch.append(order_id)
+            elif order.commission != commission:
+                drift["changed"] += 1
+                refetch.append(order_id)
+        if refetch:
+            async with self.pool.acquire() as conn:
+                for order in await repo.get_orders(conn, refetch):
+                    self.put(order)
+        for kind, n in drift.items():
+            if n:
+                metrics.ORDER_BOOK_DRIFT.labels(kind).inc(n)
+        if any(drift.values()):
+            log.warning("order book drift fixed: %s", drift)
+        return drift
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._loop())
+        return self._task
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _loop(self):
+        while True:
+            try:
+                await asyncio.sleep(self.check_every)
+                await self.check()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                log.exception("order book check failed")
+
+
+def _discard(ids: list, value):
+    i = bisect_left(ids, value)
+    if i < len(ids) and ids[i] == value:
+        del ids[i]
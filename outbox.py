@@ -0,0 +1,198 @@
+# -*- coding: utf-8 -*-
+"""
+outbox.py
+Handlerlardan chiquvchi bildirishnomalarni ajratish.
+- `enqueue()` holat o'zgarishi bilan bitta tranzaksiyada `outbox` ga yozadi
+- handler commitdan keyin darhol qaytadi, Telegramni kutmaydi
+- `OutboxDispatcher` navbatni partiyalab yuboradi, xatoda backoff bilan qayta uradi
+- `dedup_key` bitta hodisa uchun xabar ikki marta navbatga tushishining oldini oladi
+- bir nechta jarayon: qatorlar FOR UPDATE SKIP LOCKED + lease bilan olinadi
+"""
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+
+from aiogram.exceptions import TelegramRetryAfter, TelegramForbiddenError, TelegramBadRequest
+from aiogram.types import InlineKeyboardMarkup
+
+import metrics
+import reach
+from fanout import engine as fanout
+
+log = logging.getLogger("outbox")
+
+BATCH_SIZE = 50
+IDLE_POLL = 5.0        # wake() bo'lmasa ham shuncha sekundda navbat tekshiriladi
+LEASE = 60             # olingan qator shu vaqt ichida boshqa jarayonga berilmaydi, s
+MAX_ATTEMPTS = 8
+MAX_BACKOFF = 300
+RETENTION_DAYS = 7     # yuborilganlar shuncha kun saqlanadi (dedup shu oraliqda ishlaydi)
+CLEANUP_EVERY = 3600.0
+
+SENT = "sent"
+DEAD = "dead"
+PENDING = "pending"
+
+_ENQUEUE = """
+INSERT INTO outbox(chat_id, text, photo, reply_markup, dedup_key)
+VALUES($1, $2, $3, $4::jsonb, $5)
+ON CONFLICT (dedup_key) DO NOTHING
+"""
+_CLAIM = """
+UPDATE outbox SET attempts = attempts + 1,
+                  next_attempt_at = CURRENT_TIMESTAMP + make_interval(secs => $2)
+WHERE id IN (
+    SELECT id FROM outbox
+    WHERE status = 'pending' AND next_attempt_at <= CURRENT_TIMESTAMP
+    ORDER BY next_attempt_at, id
+    LIMIT $1
+    FOR UPDATE SKIP LOCKED
+)
+RETURNING id, chat_id, text, photo, reply_markup, attempts
+"""
+_FINISH = """
+UPDATE outbox SET status = $2,
+                  next_attempt_at = CURRENT_TIMESTAMP + make_interval(secs => $3),
+                  last_error = $4,
+                  attempts = attempts - $5,
+                  sent_at = CASE WHEN $2 = 'sent' THEN CURRENT_TIMESTAMP END
+WHERE id = $1
+"""
+_CLEANUP = """
+DELETE FROM outbox
+WHERE status <> 'pending' AND created_at < CURRENT_TIMESTAMP - make_interval(days => $1)
+"""
+
+
+async def enqueue(conn, chat_id: int, text: str, *, reply_markup: InlineKeyboardMarkup = None,
+                  photo: str = None, dedup_key: str = None) -> bool:
+    """
+    Xabarni navbatga qo'yadi. Chaqiruvchi tranzaksiyasi ichida ishlatiladi.
+    `dedup_key` bilan allaqachon yozilgan bo'lsa False qaytaradi.
+    """
+    markup = reply_markup.model_dump_json(exclude_none=True) if reply_markup is not None else None
+    res = await conn.execute(_ENQUEUE, chat_id, text, photo, markup, dedup_key)
+    return res.endswith(" 1")
+
+
+async def enqueue_many(conn, chat_ids, text: str, *, reply_markup: InlineKeyboardMarkup = None,
+                       photo: str = None, dedup_key: str = None):
+    """Bir xil xabar bir nechta chatga; dedup_key har bir chat uchun `<key>:<chat_id>`."""
+    markup = reply_markup.model_dump_json(exclude_none=True) if reply_markup is not None else None
+    await conn.executemany(_ENQUEUE, [
+        (cid, text, photo, markup, f"{dedup_key}:{cid}" if dedup_key else None) for cid in chat_ids
+    ])
+
+
+def _backoff(attempts: int) -> float:
+    return min(2 ** attempts, MAX_BACKOFF)
+
+
+class OutboxDispatcher:
+    """
+    Bitta fon task. Handler commitdan keyin `wake()` chaqiradi.
+    Bitta chatga ketadigan xabarlar partiya ichida navbat bilan yuboriladi.
+    """
+    def __init__(self, bot, pool, batch_size: int = BATCH_SIZE):
+        self.bot = bot
+        self.pool = pool
+        self.batch_size = batch_size
+        self._wakeup = asyncio.Event()
+        self._task = None
+        self._last_cleanup = 0.0
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._loop())
+        return self._task
+
+    def wake(self):
+        self._wakeup.set()
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _loop(self):
+        while True:
+            try:
+                self._wakeup.clear()
+                if await self.drain_once():
+                    continue
+                if time.monotonic() - self._last_cleanup >= CLEANUP_EVERY:
+                    self._last_cleanup = time.monotonic()
+                    async with self.pool.acquire() as conn:
+                        await conn.execute(_CLEANUP, RETENTION_DAYS)
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), IDLE_POLL)
+                except asyncio.TimeoutError:
+                    pass
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                log.exception("outbox dispatcher error")
+                await asyncio.sleep(5)
+
+    async def drain_once(self) -> int:
+        """Bitta partiyani oladi va yuboradi. Olingan qatorlar sonini qaytaradi."""
+        async with self.pool.acquire() as conn:
+            rows = await conn.fetch(_CLAIM, self.batch_size, LEASE)
+        if not rows:
+            return 0
+        by_chat = OrderedDict()
+        for r in sorted(rows, key=lambda r: r["id"]):
+            by_chat.setdefault(r["chat_id"], []).append(r)
+
+        results = []
+        sem = asyncio.Semaphore(fanout.concurrency)
+
+        async def chat_worker(items):
+            async with sem:
+                for i, r in enumerate(items):
+                    status, delay, error, refund = await self._send(r)
+                    results.append((r["id"], status, delay, error, refund))
+                    if status == PENDING:
+                        # tartib buzilmasin: shu chatning qolganlari ham keyinga qoladi,
+                        # ular yuborilmagani uchun urinish hisoblanmaydi
+                        results.extend((x["id"], PENDING, delay, None, 1) for x in items[i + 1:])
+                        return
+
+        await asyncio.gather(*(chat_worker(items) for items in by_chat.values()))
+        async with self.pool.acquire() as conn:
+            await conn.executemany(_FINISH, results)
+        for _, status, _, error, refund in results:
+            if not refund or error:
+                metrics.OUTBOX_SENT.labels(status).inc()
+        return len(rows)
+
+    async def _send(self, row):
+        """Returns (status, retry_delay, error, attempts_refund)."""
+        await fanout.bucket.acquire()
+        try:
+            markup = InlineKeyboardMarkup.model_validate_json(row["reply_markup"]) if row["reply_markup"] else None
+            if row["photo"]:
+                await self.bot.send_photo(row["chat_id"], row["photo"], caption=row["text"], reply_markup=markup)
+            else:
+                await self.bot.send_message(row["chat_id"], row["text"], reply_markup=markup)
+            return SENT, 0, None, 0
+        except TelegramRetryAfter as e:
+            fanout.bucket.pause(e.retry_after)
+            # flood limit bizning aybimiz emas, urinish sifatida sanalmasin
+            return PENDING, e.retry_after, type(e).__name__, 1
+        except (TelegramForbiddenError, TelegramBadRequest) as e:
+            # bot bloklangan / chat yo'q: qayta urinishdan foyda yo'q
+            reach.tracker.report(row["chat_id"], e)
+            return DEAD, 0, f"{type(e).__name__}: {e}"[:500], 0
+        except Exception as e:
+            # TelegramNetworkError, TelegramServerError va kutilmagan xatolar: backoff
+            error = f"{type(e).__name__}: {e}"[:500]
+            if row["attempts"] >= MAX_ATTEMPTS:
+                log.warning("outbox #%s dropped after %s attempts: %s", row["id"], row["attempts"], error)
+                return DEAD, 0, error, 0
+            return PENDING, _backoff(row["attempts"]), error, 0
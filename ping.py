@@ -1,7 +1,85 @@
-from fastapi import FastAPI
+import asyncio
+import logging
+import secrets
+from contextlib import asynccontextmanager
+
+from fastapi import FastAPI, Request, Response
+
+import bot as cargobot
+import metrics
+
+log = logging.getLogger("webhook")
+
+# webhook rejimida: DB tayyor bo'lmaguncha /ping 503 qaytaradi
+state = {"ready": cargobot.BOT_MODE != "webhook"}
+_background = set()
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    if cargobot.BOT_MODE != "webhook":
+        yield
+        return
+    logging.basicConfig(level=logging.INFO)
+    await cargobot.on_startup()
+    if cargobot.WEBHOOK_URL:
+        # har bir worker chaqiradi, Telegram uchun idempotent
+        await cargobot.bot.set_webhook(
+            url=cargobot.WEBHOOK_URL.rstrip("/") + cargobot.WEBHOOK_PATH,
+            secret_token=cargobot.WEBHOOK_SECRET,
+            allowed_updates=cargobot.dp.resolve_used_update_types(),
+        )
+    state["ready"] = True
+    print("🚀 Bot ишга тушди (webhook)...")
+    try:
+        yield
+    finally:
+        state["ready"] = False
+        if _background:
+            await asyncio.gather(*_background, return_exceptions=True)
+        await cargobot.on_shutdown()
+
+
+app = FastAPI(lifespan=lifespan)
 
-app = FastAPI()
 
 @app.get("/ping")
-async def ping():
+async def ping(response: Response):
+    if not state["ready"]:
+        response.status_code = 503
+        return {"status": "starting"}
     return {"status": "ok"}
+
+
+@app.get("/metrics")
+async def prometheus_metrics():
+    return Response(content=metrics.render(), media_type=metrics.CONTENT_TYPE)
+
+
+@app.get("/dbstats")
+async def db_stats(response: Response):
+    if cargobot.pool is None:
+        response.status_code = 503
+        return {"status": "starting"}
+    return cargobot.pool.stats()
+
+
+@app.post(cargobot.WEBHOOK_PATH)
+async def telegram_webhook(request: Request):
+    if cargobot.BOT_MODE != "webhook" or not state["ready"]:
+        return Response(status_code=503)
+    token = request.headers.get("X-Telegram-Bot-Api-Secret-Token", "")
+    if not cargobot.WEBHOOK_SECRET or not secrets.compare_digest(token, cargobot.WEBHOOK_SECRET):
+        return Response(status_code=401)
+    update = await request.json()
+    # Telegramga darhol 200 qaytaramiz, update fon rejimida ishlanadi
+    task = asyncio.create_task(cargobot.dp.feed_raw_update(cargobot.bot, update))
+    _background.add(task)
+    task.add_done_callback(_task_done)
+    return Response(status_code=200)
+
+
+def _task_done(task: asyncio.Task):
+    _background.discard(task)
+    if not task.cancelled() and task.exception() is not None:
+        log.error("update handling failed", exc_info=task.exception())
@@ -0,0 +1,188 @@
+# -*- coding: utf-8 -*-
+"""
+reach.py
+Botni bloklagan / o'chirilgan foydalanuvchilarni yuborish ro'yxatlaridan chiqarish.
+- yuborish xatosi turiga qarab tasniflanadi (`classify`)
+- doimiy xatoda drivers/customers da `reachable = FALSE` + vaqt va sabab
+- belgilar partiyalab yoziladi (fan-out ichida har bir xato uchun DB ga bormaslik uchun)
+- foydalanuvchi botga yana yozsa (har qanday update) belgi olib tashlanadi
+fanout, outbox, broadcasts va offers xatolarni `tracker.report()` ga beradi.
+"""
+import asyncio
+import logging
+import time
+
+from aiogram import BaseMiddleware
+from aiogram.exceptions import TelegramForbiddenError, TelegramBadRequest
+
+import metrics
+
+log = logging.getLogger("reach")
+
+FORBIDDEN = "forbidden"      # botni bloklagan, akkaunt o'chirilgan, guruhdan chiqarilgan
+NOT_FOUND = "not_found"      # chat yo'q / hech qachon botni ishga tushirmagan
+
+FLUSH_DELAY = 1.0            # belgilar shuncha vaqt yig'ilib bitta statementda yoziladi, s
+REFRESH_EVERY = 300.0        # boshqa jarayonlar belgilagan foydalanuvchilarni qayta o'qish, s
+
+# TelegramBadRequest matnlari, ularda qayta urinish foydasiz
+_GONE_MARKERS = ("chat not found", "user not found", "peer_id_invalid", "user is deactivated")
+
+_MARK = """
+UPDATE {table} t SET reachable = FALSE, unreachable_at = CURRENT_TIMESTAMP, unreachable_reason = u.reason
+FROM unnest($1::bigint[], $2::text[]) AS u(id, reason)
+WHERE t.{col} = u.id AND t.reachable
+"""
+_RESTORE_DRIVER = """
+UPDATE drivers SET reachable = TRUE, unreachable_at = NULL, unreachable_reason = NULL
+WHERE driver_id = $1 AND NOT reachable
+RETURNING car_model, status
+"""
+_RESTORE_CUSTOMER = """
+UPDATE customers SET reachable = TRUE, unreachable_at = NULL, unreachable_reason = NULL
+WHERE user_id = $1 AND NOT reachable
+"""
+_UNREACHABLE = """
+SELECT driver_id FROM drivers WHERE NOT reachable
+UNION
+SELECT user_id FROM customers WHERE NOT reachable
+"""
+
+
+def classify(exc) -> str:
+    """Doimiy (qayta urinib bo'lmaydigan) yetkazib bo'lmaslik sababi yoki None."""
+    if isinstance(exc, TelegramForbiddenError):
+        return FORBIDDEN
+    if isinstance(exc, TelegramBadRequest) and any(m in str(exc).lower() for m in _GONE_MARKERS):
+        return NOT_FOUND
+    return None
+
+
+class Reachability:
+    """
+    Yetib bo'lmaydigan user_id lar to'plami (jarayon xotirasida) va ularni DB ga yozish.
+    on_marked(user_id) / on_restored(user_id, car_model, status) — haydovchi indeksini yangilash uchun.
+    """
+    def __init__(self):
+        self.pool = None
+        self.unreachable = set()
+        self.on_marked = None
+        self.on_restored = None
+        self._pending = {}
+        self._flushing = {}   # _flush() yozayotgan belgilar
+        self._wakeup = asyncio.Event()
+        self._task = None
+        self._loaded_at = 0.0
+        metrics.UNREACHABLE.set_function(lambda: len(self.unreachable))
+
+    def __contains__(self, user_id):
+        return user_id in self.unreachable
+
+    async def start(self, pool):
+        """Belgilanganlarni o'qiydi va partiyalab yozuvchi taskni ishga tushiradi."""
+        self.pool = pool
+        await self.load()
+        if self._task is None:
+            self._task = asyncio.create_task(self._loop())
+        return self._task
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._pending and self.pool is not None:
+            await self._flush()
+
+    async def load(self):
+        async with self.pool.acquire() as conn:
+            loaded = {r[0] for r in await conn.fetch(_UNREACHABLE)}
+        # hali DB ga yozilmagan belgilar yo'qolmasin
+        loaded.update(self._pending)
+        loaded.update(self._flushing)
+        self.unreachable = loaded
+        self._loaded_at = time.monotonic()
+
+    def report(self, chat_id: int, exc) -> str:
+        """Yuborish xatosi. Doimiy bo'lsa foydalanuvchini belgilaydi va sababini qaytaradi."""
+        reason = classify(exc)
+        if reason is None or chat_id in self.unreachable:
+            return reason
+        self.unreachable.add(chat_id)
+        self._pending[chat_id] = reason
+        metrics.UNREACHABLE_MARKED.labels(reason).inc()
+        if self.on_marked is not None:
+            self.on_marked(chat_id)
+        self._wakeup.set()
+        return reason
+
+    async def restore(self, user_id: int):
+        """Foydalanuvchi botga yozdi: yana yuborish ro'yxatlariga qaytadi."""
+        self.unreachable.discard(user_id)
+        self._pending.pop(user_id, None)
+        async with self.pool.acquire() as conn:
+            driver = await conn.fetchrow(_RESTORE_DRIVER, user_id)
+            await conn.execute(_RESTORE_CUSTOMER, user_id)
+        if driver is not None and self.on_restored is not None:
+            self.on_restored(user_id, driver["car_model"], driver["status"])
+        log.info("user %s is reachable again", user_id)
+
+    async def _flush(self):
+        pending, self._pending = self._pending, {}
+        self._flushing = pending
+        ids, reasons = list(pending), list(pending.values())
+        try:
+            async with self.pool.acquire() as conn:
+                await conn.execute(_MARK.format(table="drivers", col="driver_id"), ids, reasons)
+                await conn.execute(_MARK.format(table="customers", col="user_id"), ids, reasons)
+        except BaseException:
+            # keyingi urinishda qayta yoziladi (oradagi restore() qaytarilganlarni tashlab)
+            for user_id, reason in pending.items():
+                if user_id in self.unreachable:
+                    self._pending.setdefault(user_id, reason)
+            raise
+        finally:
+            self._flushing = {}
+        log.info("marked %s users unreachable", len(ids))
+
+    async def _loop(self):
+        while True:
+            try:
+                self._wakeup.clear()
+                if self._pending:
+                    await asyncio.sleep(FLUSH_DELAY)
+                    await self._flush()
+                    continue
+                if time.monotonic() - self._loaded_at >= REFRESH_EVERY:
+                    await self.load()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), REFRESH_EVERY)
+                except asyncio.TimeoutError:
+                    pass
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                log.exception("reachability flush error")
+                await asyncio.sleep(5)
+
+
+class RestoreOnUpdate(BaseMiddleware):
+    """`dp.update.outer_middleware` — belgilangan foydalanuvchidan update kelsa belgini olib tashlaydi."""
+    def __init__(self, reach: Reachability):
+        self.reach = reach
+
+    async def __call__(self, handler, event, data):
+        user = data.get("event_from_user")
+        if user is not None and user.id in self.reach.unreachable:
+            try:
+                await self.reach.restore(user.id)
+            except Exception:
+                log.exception("restore %s failed", user.id)
+        return await handler(event, data)
+
+
+# jarayon uchun umumiy
+tracker = Reachability()
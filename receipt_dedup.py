@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+"""
+receipt_dedup.py
+Takroriy kvitansiyalarni adminlarga yuborishdan oldin aniqlash.
+- aynan o'sha fayl: Telegram `file_unique_id` (yuklab olish shart emas)
+- qayta yuklangan / qayta siqilgan skrinshot: 64-bit dHash (perceptual hash)
+- hash Pillow bilan, event loopdan tashqarida (thread pool) hisoblanadi
+- yaqin hashlarni topish: hash 8 ta 8-bitlik bo'lakka bo'linadi (`receipt_hash_bands`);
+  Hamming masofasi <= 7 bo'lgan ikki hashda kamida bitta bo'lak albatta bir xil,
+  shuning uchun faqat bo'lagi mos kelgan kvitansiyalar solishtiriladi
+Pillow o'rnatilmagan bo'lsa faqat `file_unique_id` tekshiriladi.
+"""
+import asyncio
+import io
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    from PIL import Image
+except ImportError:  # ixtiyoriy bog'liqlik
+    Image = None
+
+log = logging.getLogger("receipt_dedup")
+
+HASH_SIZE = 8          # dHash: (HASH_SIZE+1) x HASH_SIZE kulrang rasm -> 64 bit
+BANDS = 8
+BAND_BITS = 64 // BANDS
+NEAR_DISTANCE = 6      # Hamming masofasi shundan oshmasa (<=) — "yaqin nusxa"
+WORKERS = 2
+
+_executor = ThreadPoolExecutor(max_workers=WORKERS, thread_name_prefix="receipt-hash")
+
+_FIND_CANDIDATES = """
+SELECT r.id, r.driver_id, r.status, r.phash
+FROM receipts r
+WHERE r.id IN (
+    SELECT receipt_id FROM receipt_hash_bands
+    WHERE (band, value) IN (SELECT * FROM unnest($1::smallint[], $2::smallint[]))
+)
+"""
+_ADD_BANDS = """
+INSERT INTO receipt_hash_bands(band, value, receipt_id)
+SELECT b, v, $3 FROM unnest($1::smallint[], $2::smallint[]) AS u(b, v)
+ON CONFLICT DO NOTHING
+"""
+
+
+def available() -> bool:
+    return Image is not None
+
+
+def dhash(data: bytes) -> int:
+    """Rasm baytlaridan 64-bit difference hash (unsigned)."""
+    with Image.open(io.BytesIO(data)) as img:
+        img = img.convert("L").resize((HASH_SIZE + 1, HASH_SIZE), Image.LANCZOS)
+        px = list(img.getdata())
+    value = 0
+    for row in range(HASH_SIZE):
+        for col in range(HASH_SIZE):
+            left = px[row * (HASH_SIZE + 1) + col]
+            right = px[row * (HASH_SIZE + 1) + col + 1]
+            value = (value << 1) | (left > right)
+    return value
+
+
+def to_signed(h: int) -> int:
+    """Postgres BIGINT uchun."""
+    return h - (1 << 64) if h >= 1 << 63 else h
+
+
+def to_unsigned(h: int) -> int:
+    return h + (1 << 64) if h < 0 else h
+
+
+def hamming(a: int, b: int) -> int:
+    return bin(to_unsigned(a) ^ to_unsigned(b)).count("1")
+
+
+def bands(h: int) -> tuple:
+    """([band_index...], [band_value...]) — unnest uchun ikki massiv."""
+    h = to_unsigned(h)
+    mask = (1 << BAND_BITS) - 1
+    values = [(h >> (i * BAND_BITS)) & mask for i in range(BANDS)]
+    return list(range(BANDS)), values
+
+
+async def compute(bot, file_id: str):
+    """Faylni yuklab, hashni thread poolda hisoblaydi. Imkon bo'lmasa None."""
+    if Image is None:
+        return None
+    try:
+        buf = await bot.download(file_id)
+        data = buf.read()
+        h = await asyncio.get_running_loop().run_in_executor(_executor, dhash, data)
+        return to_signed(h)
+    except Exception as e:
+        log.warning("receipt hash failed for %s: %s", file_id, e)
+        return None
+
+
+async def find_near(conn, phash: int, max_distance: int = NEAR_DISTANCE):
+    """Eng yaqin avvalgi kvitansiya: (masofa, Record(id, driver_id, status, phash)) yoki None."""
+    idx, values = bands(phash)
+    best = None
+    for r in await conn.fetch(_FIND_CANDIDATES, idx, values):
+        d = hamming(phash, r["phash"])
+        if d <= max_distance and (best is None or d < best[0]):
+            best = (d, r)
+    return best
+
+
+async def index(conn, receipt_id: int, phash: int):
+    idx, values = bands(phash)
+    await conn.execute(_ADD_BANDS, idx, values, receipt_id)
@@ -0,0 +1,480 @@
+# -*- coding: utf-8 -*-
+"""
+repo.py
+Ma'lumotlar bazasi so'rovlari (handlerlardan ajratilgan).
+- har bir so'rov uchun bitta funksiya, `SELECT *` yo'q — faqat kerakli ustunlar
+- SQL matnlari o'zgarmas, shuning uchun asyncpg ularni har bir connectionda
+  bir marta prepare qiladi (statement cache) va keyin faqat bind/execute qiladi
+- natijalar `__slots__` li yengil classlarga o'giriladi (Record o'rniga)
+"""
+
+
+class Driver:
+    __slots__ = ("driver_id", "username", "phone", "full_name", "car_model", "balance", "status")
+
+    def __init__(self, driver_id, username=None, phone=None, full_name=None,
+                 car_model=None, balance=0, status="active"):
+        self.driver_id = driver_id
+        self.username = username
+        self.phone = phone
+        self.full_name = full_name
+        self.car_model = car_model
+        self.balance = balance
+        self.status = status
+
+    @classmethod
+    def from_row(cls, row):
+        return cls(*row) if row is not None else None
+
+
+class Customer:
+    __slots__ = ("user_id", "username", "phone", "full_name", "status")
+
+    def __init__(self, user_id, username=None, phone=None, full_name=None, status="active"):
+        self.user_id = user_id
+        self.username = username
+        self.phone = phone
+        self.full_name = full_name
+        self.status = status
+
+    @classmethod
+    def from_row(cls, row):
+        return cls(*row) if row is not None else None
+
+
+class Order:
+    __slots__ = ("id", "customer_id", "from_address", "to_address", "cargo_type", "car_type",
+                 "cargo_weight", "date", "status", "driver_id", "customer_username",
+                 "customer_phone", "commission", "pickup_lat", "pickup_lon")
+
+    def __init__(self, id, customer_id=None, from_address=None, to_address=None, cargo_type=None,
+                 car_type=None, cargo_weight=None, date=None, status=None, driver_id=None,
+                 customer_username=None, customer_phone=None, commission=None,
+                 pickup_lat=None, pickup_lon=None):
+        self.id = id
+        self.customer_id = customer_id
+        self.from_address = from_address
+        self.to_address = to_address
+        self.cargo_type = cargo_type
+        self.car_type = car_type
+        self.cargo_weight = cargo_weight
+        self.date = date
+        self.status = status
+        self.driver_id = driver_id
+        self.customer_username = customer_username
+        self.customer_phone = customer_phone
+        self.commission = commission
+        self.pickup_lat = pickup_lat
+        self.pickup_lon = pickup_lon
+
+    @classmethod
+    def from_row(cls, row):
+        return cls(*row) if row is not None else None
+
+
+class Receipt:
+    __slots__ = ("id", "driver_id", "file_id", "status")
+
+    def __init__(self, id, driver_id=None, file_id=None, status=None):
+        self.id = id
+        self.driver_id = driver_id
+        self.file_id = file_id
+        self.status = status
+
+    @classmethod
+    def from_row(cls, row):
+        return cls(*row) if row is not None else None
+
+
+DRIVER_COLUMNS = ", ".join(Driver.__slots__)
+CUSTOMER_COLUMNS = ", ".join(Customer.__slots__)
+ORDER_COLUMNS = ", ".join(Order.__slots__)
+RECEIPT_COLUMNS = ", ".join(Receipt.__slots__)
+
+# balance_ledger.reason
+LEDGER_OPENING = "opening"
+LEDGER_SIGNUP_BONUS = "signup_bonus"
+LEDGER_ORDER_FEE = "order_fee"
+LEDGER_RECEIPT = "receipt"
+LEDGER_ADMIN_TOPUP = "admin_topup"
+
+
+# --------------------------
+# DRIVERS
+# --------------------------
+_GET_DRIVER = f"SELECT {DRIVER_COLUMNS} FROM drivers WHERE driver_id=$1"
+# botni bloklaganlar (reach.py) yuborish ro'yxatlariga kirmaydi
+_ACTIVE_DRIVER_VEHICLES = "SELECT driver_id, car_model FROM drivers WHERE status='active' AND reachable"
+# Balansni o'zgartiradigan har bir statement o'sha statementning o'zida balance_ledger ga yozadi.
+# bonus faqat yangi haydovchiga (xmax = 0 — INSERT bo'ldi, UPDATE emas)
+_UPSERT_DRIVER = f"""
+WITH u AS (
+    INSERT INTO drivers(driver_id, username, phone, full_name, car_model, balance, status)
+    VALUES($1,$2,$3,$4,$5,$6,'active')
+    ON CONFLICT (driver_id) DO UPDATE SET
+        username = EXCLUDED.username,
+        phone = EXCLUDED.phone,
+        full_name = EXCLUDED.full_name,
+        car_model = EXCLUDED.car_model
+    RETURNING driver_id, status, balance, (xmax = 0) AS inserted
+), led AS (
+    INSERT INTO balance_ledger(driver_id, amount, reason, actor_id, balance_after)
+    SELECT driver_id, balance, '{LEDGER_SIGNUP_BONUS}', driver_id, balance FROM u
+    WHERE inserted AND COALESCE(balance, 0) <> 0
+)
+SELECT status FROM u
+"""
+_ADD_DRIVER_BALANCE = """
+WITH b AS (
+    UPDATE drivers SET balance = COALESCE(balance,0) + $1 WHERE driver_id=$2
+    RETURNING driver_id, balance
+), led AS (
+    INSERT INTO balance_ledger(driver_id, amount, reason, actor_id, balance_after)
+    SELECT driver_id, $1, $3, $4, balance FROM b
+)
+SELECT balance FROM b
+"""
+_SET_DRIVER_STATUS = "UPDATE drivers SET status=$1 WHERE driver_id=$2 RETURNING car_model"
+_DRIVER_BALANCES = "SELECT driver_id, COALESCE(balance, 0) FROM drivers WHERE driver_id = ANY($1::bigint[])"
+_SET_DRIVER_LOCATION = """
+UPDATE drivers SET last_lat=$2, last_lon=$3, location_at=CURRENT_TIMESTAMP WHERE driver_id=$1
+"""
+_DRIVER_LOCATIONS = """
+SELECT driver_id, last_lat, last_lon, EXTRACT(EPOCH FROM CURRENT_TIMESTAMP - location_at)::float8
+FROM drivers
+WHERE status='active' AND location_at > CURRENT_TIMESTAMP - make_interval(secs => $1)
+"""
+_DRIVER_CHOICES = "SELECT driver_id, username FROM drivers ORDER BY driver_id DESC"
+
+
+async def get_driver(conn, driver_id: int):
+    return Driver.from_row(await conn.fetchrow(_GET_DRIVER, driver_id))
+
+
+async def list_active_driver_vehicles(conn) -> list:
+    """(driver_id, car_model) juftlari — matching.DriverIndex uchun."""
+    return [(r[0], r[1]) for r in await conn.fetch(_ACTIVE_DRIVER_VEHICLES)]
+
+
+async def upsert_driver(conn, driver_id: int, username, phone, full_name, car_model, bonus: int) -> str:
+    """Returns driver status (qayta ro'yxatdan o'tgan bloklangan haydovchi bloklanganicha qoladi)."""
+    return await conn.fetchval(_UPSERT_DRIVER, driver_id, username, phone, full_name, car_model, bonus)
+
+
+async def add_driver_balance(conn, driver_id: int, amount: int, reason: str = None, actor_id: int = None):
+    """
+    Returns yangi balans (haydovchi topilmasa None).
+    """
+    return await conn.fetchval(_ADD_DRIVER_BALANCE, amount, driver_id, reason or LEDGER_ADMIN_TOPUP, actor_id)
+
+
+async def set_driver_status(conn, driver_id: int, status: str):
+    """Returns car_model (haydovchi indeksini yangilash uchun)."""
+    return await conn.fetchval(_SET_DRIVER_STATUS, status, driver_id)
+
+
+async def driver_balances(conn, driver_ids) -> dict:
+    """driver_id -> balans (to'lqinlarni saralash uchun)."""
+    return {r[0]: r[1] for r in await conn.fetch(_DRIVER_BALANCES, list(driver_ids))}
+
+
+async def set_driver_location(conn, driver_id: int, lat: float, lon: float):
+    await conn.execute(_SET_DRIVER_LOCATION, driver_id, lat, lon)
+
+
+async def list_driver_locations(conn, max_age: float) -> list:
+    """(driver_id, lat, lon, yoshi_sekundda) — faqat faol va `max_age` dan yangi joylashuvlar."""
+    return [(r[0], r[1], r[2], r[3]) for r in await conn.fetch(_DRIVER_LOCATIONS, max_age)]
+
+
+async def list_driver_choices(conn) -> list:
+    return [(r[0], r[1]) for r in await conn.fetch(_DRIVER_CHOICES)]
+
+
+# --------------------------
+# CUSTOMERS
+# --------------------------
+_GET_CUSTOMER = f"SELECT {CUSTOMER_COLUMNS} FROM customers WHERE user_id=$1"
+_UPSERT_CUSTOMER_PROFILE = """
+INSERT INTO customers (user_id, username, phone, full_name, status)
+VALUES($1, $2, $3, $4, 'active')
+ON CONFLICT (user_id) DO UPDATE
+  SET username = EXCLUDED.username,
+      phone = EXCLUDED.phone,
+      full_name = EXCLUDED.full_name,
+      status = COALESCE(customers.status, 'active')
+"""
+_ENSURE_CUSTOMER = """
+INSERT INTO customers(user_id, username, phone, status) VALUES($1,$2,NULL,'active')
+ON CONFLICT (user_id) DO NOTHING
+"""
+_UPSERT_CUSTOMER_CONTACT = """
+INSERT INTO customers(user_id, username, phone, status)
+VALUES($1,$2,$3, COALESCE((SELECT status FROM customers WHERE user_id=$1), 'active'))
+ON CONFLICT (user_id) DO UPDATE SET
+    username = EXCLUDED.username,
+    phone = EXCLUDED.phone
+"""
+_SET_CUSTOMER_STATUS = "UPDATE customers SET status=$1 WHERE user_id=$2"
+
+
+async def get_customer(conn, user_id: int):
+    return Customer.from_row(await conn.fetchrow(_GET_CUSTOMER, user_id))
+
+
+async def upsert_customer_profile(conn, user_id: int, username, phone, full_name):
+    await conn.execute(_UPSERT_CUSTOMER_PROFILE, user_id, username, phone, full_name)
+
+
+async def ensure_customer(conn, user_id: int, username):
+    await conn.execute(_ENSURE_CUSTOMER, user_id, username)
+
+
+async def upsert_customer_contact(conn, user_id: int, username, phone):
+    await conn.execute(_UPSERT_CUSTOMER_CONTACT, user_id, username, phone)
+
+
+async def set_customer_status(conn, user_id: int, status: str):
+    await conn.execute(_SET_CUSTOMER_STATUS, status, user_id)
+
+
+# --------------------------
+# ORDERS
+# --------------------------
+_GET_ORDER = f"SELECT {ORDER_COLUMNS} FROM orders WHERE id=$1"
+_CREATE_ORDER = f"""
+INSERT INTO orders(customer_id, from_address, to_address, cargo_type, car_type, cargo_weight, date, status,
+                   customer_username, customer_phone, creator_role, pickup_lat, pickup_lon)
+VALUES($1,$2,$3,$4,$5,$6,$7,'pending_fee',$8,$9,$10,$11,$12)
+RETURNING {ORDER_COLUMNS}
+"""
+_ORDER_STATUS = "SELECT status FROM orders WHERE id=$1"
+_GET_ORDERS = f"SELECT {ORDER_COLUMNS} FROM orders WHERE id = ANY($1::int[])"
+_LIST_OPEN_ORDERS = f"SELECT {ORDER_COLUMNS} FROM orders WHERE status='open'"
+_OPEN_ORDER_VERSIONS = "SELECT id, commission FROM orders WHERE status='open'"
+_SET_ORDER_FEE = f"""
+UPDATE orders SET commission=$1, status='open' WHERE id=$2 AND status='pending_fee'
+RETURNING {ORDER_COLUMNS}
+"""
+_COMPLETE_ORDER = f"""
+UPDATE orders SET status='done' WHERE id=$1 AND driver_id=$2 AND status='taken'
+RETURNING {ORDER_COLUMNS}
+"""
+
+
+async def get_order(conn, order_id: int):
+    return Order.from_row(await conn.fetchrow(_GET_ORDER, order_id))
+
+
+async def get_order_status(conn, order_id: int):
+    return await conn.fetchval(_ORDER_STATUS, order_id)
+
+
+async def get_orders(conn, order_ids) -> list:
+    return [Order.from_row(r) for r in await conn.fetch(_GET_ORDERS, list(order_ids))]
+
+
+async def list_open_orders(conn) -> list:
+    return [Order.from_row(r) for r in await conn.fetch(_LIST_OPEN_ORDERS)]
+
+
+async def open_order_versions(conn) -> list:
+    """(id, commission) — xotiradagi order book bilan solishtirish uchun."""
+    return await conn.fetch(_OPEN_ORDER_VERSIONS)
+
+
+async def create_order(conn, customer_id: int, from_address, to_address, cargo_type, car_type,
+                       cargo_weight, date, customer_username, customer_phone, creator_role,
+                       pickup_lat=None, pickup_lon=None) -> Order:
+    return Order.from_row(await conn.fetchrow(
+        _CREATE_ORDER, customer_id, from_address, to_address, cargo_type, car_type, cargo_weight,
+        date, customer_username, customer_phone, creator_role, pickup_lat, pickup_lon))
+
+
+async def set_order_fee(conn, order_id: int, fee: int):
+    """
+    pending_fee -> open. Holat mos kelmasa None (sababini get_order bilan aniqlash mumkin).
+    """
+    return Order.from_row(await conn.fetchrow(_SET_ORDER_FEE, fee, order_id))
+
+
+async def complete_order(conn, order_id: int, driver_id: int):
+    """
+    taken -> done, faqat buyurtma egasi bo'lgan haydovchi uchun. Aks holda None.
+    """
+    return Order.from_row(await conn.fetchrow(_COMPLETE_ORDER, order_id, driver_id))
+
+
+# Buyurtmani bitta statementda qabul qilish:
+# haydovchi qatorini lock qiladi, balans va statusni tekshiradi,
+# buyurtmani 'open' holatidan 'taken' ga o'tkazadi va komissiyani yechadi.
+# Buyurtma olinmasa balansga tegilmaydi.
+ACCEPT_ORDER_SQL = f"""
+WITH d AS (
+    SELECT driver_id, balance, status, username, phone
+    FROM drivers WHERE driver_id = $1
+    FOR UPDATE
+), cur AS (
+    SELECT status, COALESCE(commission, 0) AS fee FROM orders WHERE id = $2
+), o AS (
+    UPDATE orders SET status = 'taken', driver_id = $1
+    WHERE id = $2 AND status = 'open'
+      AND EXISTS (SELECT 1 FROM d
+                  WHERE COALESCE(d.status, 'active') <> 'blocked'
+                    AND COALESCE(d.balance, 0) >= COALESCE(orders.commission, 0))
+    RETURNING {ORDER_COLUMNS}
+), debit AS (
+    UPDATE drivers SET balance = COALESCE(balance, 0) - (SELECT COALESCE(commission, 0) FROM o)
+    WHERE driver_id = $1 AND EXISTS (SELECT 1 FROM o)
+    RETURNING balance
+), led AS (
+    INSERT INTO balance_ledger(driver_id, amount, reason, order_id, actor_id, balance_after)
+    SELECT $1, -COALESCE(o.commission, 0), '{LEDGER_ORDER_FEE}', o.id, $1, debit.balance FROM o, debit
+)
+SELECT {", ".join("o." + c for c in Order.__slots__)},
+       d.status AS driver_status, d.balance AS driver_balance,
+       d.username AS driver_username, d.phone AS driver_phone,
+       cur.status AS order_status, cur.fee,
+       (SELECT balance FROM debit) AS new_balance
+FROM (SELECT 1) AS one
+LEFT JOIN d ON TRUE
+LEFT JOIN cur ON TRUE
+LEFT JOIN o ON TRUE
+"""
+
+# accept_order natijalari
+ACCEPTED = "accepted"
+NOT_DRIVER = "not_driver"
+BLOCKED = "blocked"
+NOT_OPEN = "not_open"
+NO_BALANCE = "no_balance"
+TOO_LATE = "too_late"
+
+
+class AcceptResult:
+    __slots__ = ("outcome", "order", "fee", "driver_username", "driver_phone", "new_balance")
+
+    def __init__(self, outcome, order, fee, driver_username, driver_phone, new_balance):
+        self.outcome = outcome
+        self.order = order
+        self.fee = fee
+        self.driver_username = driver_username
+        self.driver_phone = driver_phone
+        self.new_balance = new_balance
+
+
+async def accept_order(conn, driver_id: int, order_id: int) -> AcceptResult:
+    """
+    Natijada buyurtma va haydovchi ma'lumotlari bor,
+    keyingi xabarlar uchun qayta SELECT kerak emas.
+    """
+    row = await conn.fetchrow(ACCEPT_ORDER_SQL, driver_id, order_id)
+    n = len(Order.__slots__)
+    order = Order(*row[:n]) if row["id"] is not None else None
+    if order is not None:
+        outcome = ACCEPTED
+    elif row["driver_status"] is None:
+        outcome = NOT_DRIVER
+    elif row["driver_status"] == "blocked":
+        outcome = BLOCKED
+    elif row["order_status"] != "open":
+        outcome = NOT_OPEN
+    elif (row["driver_balance"] or 0) < row["fee"]:
+        outcome = NO_BALANCE
+    else:
+        # boshqa haydovchi bizdan oldin oldi
+        outcome = TOO_LATE
+    return AcceptResult(outcome, order, row["fee"], row["driver_username"], row["driver_phone"], row["new_balance"])
+
+
+# --------------------------
+# RECEIPTS
+# --------------------------
+_GET_RECEIPT = f"SELECT {RECEIPT_COLUMNS} FROM receipts WHERE id=$1"
+_RECEIPT_BY_UNIQUE_ID = f"SELECT {RECEIPT_COLUMNS} FROM receipts WHERE file_unique_id=$1"
+_CREATE_RECEIPT = """
+INSERT INTO receipts(driver_id, file_id, status, file_unique_id, phash) VALUES($1,$2,'pending',$3,$4)
+ON CONFLICT (file_unique_id) DO NOTHING
+RETURNING id
+"""
+# pending -> approved va balansni to'ldirish bitta statementda (ikki marta tasdiqlab bo'lmaydi)
+_APPROVE_RECEIPT = f"""
+WITH r AS (
+    UPDATE receipts SET status='approved' WHERE id=$1 AND status='pending'
+    RETURNING {RECEIPT_COLUMNS}
+), b AS (
+    UPDATE drivers SET balance = COALESCE(drivers.balance,0) + $2
+    FROM r WHERE drivers.driver_id = r.driver_id
+    RETURNING drivers.driver_id, drivers.balance
+), led AS (
+    INSERT INTO balance_ledger(driver_id, amount, reason, receipt_id, actor_id, balance_after)
+    SELECT b.driver_id, $2, '{LEDGER_RECEIPT}', r.id, $3, b.balance FROM r, b
+)
+SELECT {", ".join("r." + c for c in Receipt.__slots__)} FROM r
+"""
+_REJECT_RECEIPT = f"""
+UPDATE receipts SET status='rejected' WHERE id=$1 AND status='pending'
+RETURNING {RECEIPT_COLUMNS}
+"""
+
+
+async def get_receipt(conn, receipt_id: int):
+    return Receipt.from_row(await conn.fetchrow(_GET_RECEIPT, receipt_id))
+
+
+async def get_receipt_by_unique_id(conn, file_unique_id: str):
+    return Receipt.from_row(await conn.fetchrow(_RECEIPT_BY_UNIQUE_ID, file_unique_id))
+
+
+async def create_receipt(conn, driver_id: int, file_id: str, file_unique_id: str = None, phash: int = None):
+    """Returns yangi id yoki None (shu fayl allaqachon yuborilgan)."""
+    return await conn.fetchval(_CREATE_RECEIPT, driver_id, file_id, file_unique_id, phash)
+
+
+async def approve_receipt(conn, receipt_id: int, amount: int, actor_id: int = None):
+    """
+    Returns tasdiqlangan Receipt yoki None (topilmadi / allaqachon ko'rilgan).
+    """
+    return Receipt.from_row(await conn.fetchrow(_APPROVE_RECEIPT, receipt_id, amount, actor_id))
+
+
+async def reject_receipt(conn, receipt_id: int):
+    return Receipt.from_row(await conn.fetchrow(_REJECT_RECEIPT, receipt_id))
+
+
+# --------------------------
+# PAGINATION
+# --------------------------
+async def keyset_page(conn, record, table: str, key: str, where: str = None,
+                      anchor: int = None, direction: str = "next", limit: int = 10):
+    """
+    Keyset sahifalash (`key` bo'yicha kamayish tartibida).
+    direction: "next" -> key < anchor, "prev" -> key > anchor, "at" -> key <= anchor.
+    Returns (rows, has_more) — has_more shu yo'nalishda yana qator borligini bildiradi.
+    Narxi jadval hajmiga bog'liq emas: bitta index range scan, LIMIT n+1.
+    """
+    cond = [where] if where else []
+    args = []
+    if anchor is not None:
+        op = {"next": "<", "prev": ">", "at": "<="}[direction]
+        cond.append(f"{key} {op} $1")
+        args.append(anchor)
+    order = "ASC" if direction == "prev" else "DESC"
+    sql = f"SELECT {', '.join(record.__slots__)} FROM {table}"
+    if cond:
+        sql += " WHERE " + " AND ".join(cond)
+    sql += f" ORDER BY {key} {order} LIMIT {int(limit) + 1}"
+    rows = await conn.fetch(sql, *args)
+    has_more = len(rows) > limit
+    rows = [record.from_row(r) for r in rows[:limit]]
+    if direction == "prev":
+        rows.reverse()
+    return rows, has_more
+
+
+async def keyset_has_newer(conn, table: str, key: str, where: str = None, anchor: int = None) -> bool:
+    """`key > anchor` qator bormi — "at" (joyida yangilash) sahifasida ⬅️ tugmasi uchun."""
+    if anchor is None:
+        return False
+    cond = ([where] if where else []) + [f"{key} > $1"]
+    return await conn.fetchval(f"SELECT EXISTS(SELECT 1 FROM {table} WHERE {' AND '.join(cond)})", anchor)
@@ -0,0 +1,199 @@
+# -*- coding: utf-8 -*-
+"""
+waves.py
+Buyurtma taklifini to'lqinlar bilan yuborish.
+- birinchi to'lqin kichik (eng yaqin / eng mos haydovchilar)
+- `timeout` ichida hech kim olmasa keyingi, kengroq to'lqin yuboriladi
+- buyurtma olinganda (`cancel()` yoki DB dagi status) to'lqinlar to'xtaydi
+- barcha taymerlar bitta asyncio taskda, heap bo'yicha
+Telegram API hajmi park hajmiga emas, talabga mos bo'ladi.
+"""
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+
+from aiogram import BaseMiddleware
+
+import metrics
+
+log = logging.getLogger("waves")
+
+WAVE_SIZES = (10, 30, 100)   # undan keyin qolgan hamma bitta oxirgi to'lqinda
+WAVE_TIMEOUT = 60.0          # to'lqinlar orasidagi kutish, s
+
+# saralash mezonlari
+RANK_BALANCE = "balance"     # komissiyani to'lay oladiganlar, keyin balansi kattalar
+RANK_RECENT = "recent"       # yaqinda botdan foydalanganlar
+RANK_CRITERIA = (RANK_BALANCE, RANK_RECENT)
+
+
+def split_waves(ranked: list, sizes=WAVE_SIZES) -> list:
+    """Saralangan ro'yxatni to'lqinlarga bo'ladi; oxirgi to'lqin — qolgan hamma."""
+    waves = []
+    i = 0
+    for size in sizes:
+        if i >= len(ranked):
+            break
+        waves.append(ranked[i:i + size])
+        i += size
+    if i < len(ranked):
+        waves.append(ranked[i:])
+    return waves
+
+
+def rank(driver_ids, criteria, balances=None, fee: int = 0, last_seen=None, first=()) -> list:
+    """
+    `first` (masalan eng yaqinlar) o'z tartibida boshda, qolganlari `criteria` bo'yicha.
+    balances: driver_id -> balans; last_seen: driver_id -> monotonic vaqt.
+    """
+    balances = balances or {}
+    last_seen = last_seen or {}
+
+    def key(did):
+        k = []
+        for c in criteria:
+            if c == RANK_BALANCE:
+                b = balances.get(did, 0)
+                k.append(b < fee)
+                k.append(-b)
+            elif c == RANK_RECENT:
+                k.append(-last_seen.get(did, 0.0))
+        return k
+
+    head = list(dict.fromkeys(first))
+    seen = set(head)
+    rest = sorted((did for did in driver_ids if did not in seen), key=key)
+    return head + rest
+
+
+class LastSeen(BaseMiddleware):
+    """`dp.update.outer_middleware` — har bir foydalanuvchining oxirgi update vaqti (RANK_RECENT uchun)."""
+    def __init__(self):
+        self.seen = {}
+
+    async def __call__(self, handler, event, data):
+        user = data.get("event_from_user")
+        if user is not None:
+            self.seen[user.id] = time.monotonic()
+        return await handler(event, data)
+
+
+class _Plan:
+    __slots__ = ("order_id", "waves", "sent", "send", "started")
+
+    def __init__(self, order_id, waves, send):
+        self.order_id = order_id
+        self.waves = waves
+        self.sent = 0
+        self.send = send
+        self.started = time.monotonic()
+
+
+class WaveScheduler:
+    """
+    order_id -> reja. Heap da (vaqt, tartib, order_id); bekor qilingan reja
+    heap dan darhol o'chirilmaydi, navbati kelganda tashlab yuboriladi.
+    `still_open(order_id)` har bir keyingi to'lqin oldidan chaqiriladi
+    (boshqa jarayonda olingan buyurtmani ham to'xtatish uchun).
+    """
+    def __init__(self, still_open, timeout: float = WAVE_TIMEOUT):
+        self.still_open = still_open
+        self.timeout = timeout
+        self._plans = {}
+        self._heap = []
+        self._seq = itertools.count()
+        self._wakeup = asyncio.Event()
+        self._task = None
+        self._running = set()
+        metrics.DISPATCH_ACTIVE.set_function(lambda: len(self._plans))
+
+    def __len__(self):
+        return len(self._plans)
+
+    def __contains__(self, order_id):
+        return order_id in self._plans
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._loop())
+        return self._task
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        for task in list(self._running):
+            task.cancel()
+
+    async def dispatch(self, order_id: int, waves: list, send):
+        """
+        Birinchi to'lqinni darhol yuboradi (natijasini qaytaradi), qolganlarini rejalashtiradi.
+        send: async (driver_ids) -> natija.
+        """
+        if not waves:
+            return None
+        plan = _Plan(order_id, waves, send)
+        self._plans[order_id] = plan
+        return await self._send_next(plan)
+
+    def cancel(self, order_id: int) -> bool:
+        plan = self._plans.pop(order_id, None)
+        if plan is not None:
+            log.info("order #%s: waves stopped after %s/%s (%.0fs)", order_id, plan.sent, len(plan.waves),
+                     time.monotonic() - plan.started)
+        return plan is not None
+
+    async def _send_next(self, plan: _Plan):
+        wave = plan.waves[plan.sent]
+        plan.sent += 1
+        if plan.sent < len(plan.waves):
+            self._schedule(plan.order_id, time.monotonic() + self.timeout)
+        else:
+            self._plans.pop(plan.order_id, None)
+        metrics.DISPATCH_WAVES.labels(plan.sent).inc()
+        result = await plan.send(wave)
+        log.info("order #%s: wave %s/%s -> %s drivers: %s", plan.order_id, plan.sent, len(plan.waves), len(wave), result)
+        return result
+
+    def _schedule(self, order_id: int, due: float):
+        earliest = self._heap[0][0] if self._heap else None
+        heapq.heappush(self._heap, (due, next(self._seq), order_id))
+        if earliest is None or due < earliest:
+            self._wakeup.set()
+
+    async def _advance(self, order_id: int):
+        try:
+            if order_id not in self._plans:
+                return
+            if not await self.still_open(order_id):
+                self.cancel(order_id)
+                return
+            plan = self._plans.get(order_id)
+            if plan is not None:
+                await self._send_next(plan)
+        except Exception:
+            log.exception("order #%s: wave failed", order_id)
+
+    async def _loop(self):
+        while True:
+            now = time.monotonic()
+            while self._heap and self._heap[0][0] <= now:
+                _, _, order_id = heapq.heappop(self._heap)
+                if order_id not in self._plans:
+                    continue
+                # to'lqin yuborilishi boshqa taymerlarni ushlab turmasin
+                task = asyncio.create_task(self._advance(order_id))
+                self._running.add(task)
+                task.add_done_callback(self._running.discard)
+            self._wakeup.clear()
+            delay = self._heap[0][0] - now if self._heap else None
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), delay)
+            except asyncio.TimeoutError:
+                pass